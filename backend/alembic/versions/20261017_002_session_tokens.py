@@ -0,0 +1,36 @@
+"""session tokens
+
+Revision ID: 20261017_002
+Revises: 20241024_001
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_002'
+down_revision = '20241024_001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Current refresh token id for rotation and reuse detection
+    op.add_column('sessions', sa.Column('refresh_jti', sa.String(), nullable=True))
+    op.create_index(op.f('ix_sessions_refresh_jti'), 'sessions', ['refresh_jti'], unique=True)
+
+    # Revocation list; only revoked sessions are indexed
+    op.add_column('sessions', sa.Column('revoked_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(
+        'ix_sessions_revoked_at', 'sessions', ['revoked_at'],
+        unique=False, postgresql_where=sa.text('revoked_at IS NOT NULL')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_sessions_revoked_at', table_name='sessions')
+    op.drop_column('sessions', 'revoked_at')
+
+    op.drop_index(op.f('ix_sessions_refresh_jti'), table_name='sessions')
+    op.drop_column('sessions', 'refresh_jti')
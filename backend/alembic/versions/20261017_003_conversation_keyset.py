@@ -0,0 +1,42 @@
+"""conversation keyset index and per-user counter
+
+Revision ID: 20261017_003
+Revises: 20261017_002
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_003'
+down_revision = '20261017_002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Supports WHERE user_id = ? ORDER BY created_at DESC, id DESC and the
+    # (created_at, id) < (?, ?) keyset predicate
+    op.create_index(
+        'ix_conversations_user_id_created_at_id', 'conversations',
+        ['user_id', 'created_at', 'id'], unique=False
+    )
+
+    # Denormalized conversation count, backfilled from existing rows
+    op.add_column('users', sa.Column('conversation_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE users
+        SET conversation_count = counts.total
+        FROM (
+            SELECT user_id, COUNT(*) AS total
+            FROM conversations
+            GROUP BY user_id
+        ) AS counts
+        WHERE users.id = counts.user_id
+    """)
+
+
+def downgrade():
+    op.drop_column('users', 'conversation_count')
+    op.drop_index('ix_conversations_user_id_created_at_id', table_name='conversations')
@@ -0,0 +1,28 @@
+"""message history index
+
+Revision ID: 20261017_004
+Revises: 20261017_003
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_004'
+down_revision = '20261017_003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves per-conversation history in either direction and the
+    # (created_at, id) keyset predicate
+    op.create_index(
+        'ix_messages_conversation_id_created_at_id', 'messages',
+        ['conversation_id', 'created_at', 'id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_messages_conversation_id_created_at_id', table_name='messages')
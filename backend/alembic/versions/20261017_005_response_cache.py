@@ -0,0 +1,47 @@
+"""semantic response cache
+
+Revision ID: 20261017_005
+Revises: 20261017_004
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from pgvector.sqlalchemy import Vector
+
+# revision identifiers, used by Alembic.
+revision = '20261017_005'
+down_revision = '20261017_004'
+branch_labels = None
+depends_on = None
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS vector')
+
+    op.create_table('response_cache',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('model_type', sa.String(), nullable=False),
+        sa.Column('model_name', sa.String(), nullable=False),
+        sa.Column('temperature', sa.Float(), nullable=False),
+        sa.Column('prompt', sa.Text(), nullable=False),
+        sa.Column('response', sa.Text(), nullable=False),
+        sa.Column('embedding', Vector(EMBEDDING_DIMENSIONS), nullable=False),
+        sa.Column('hit_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('last_hit_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # Approximate nearest-neighbour search on cosine distance
+    op.execute(
+        'CREATE INDEX ix_response_cache_embedding ON response_cache '
+        'USING hnsw (embedding vector_cosine_ops)'
+    )
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_response_cache_embedding')
+    op.drop_table('response_cache')
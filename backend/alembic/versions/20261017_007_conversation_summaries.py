@@ -0,0 +1,34 @@
+"""rolling summaries of long conversations
+
+Revision ID: 20261017_007
+Revises: 20261017_006
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '20261017_007'
+down_revision = '20261017_006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation_summaries',
+        sa.Column('conversation_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=False),
+        sa.Column('covered_until', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('covered_message_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('token_count', sa.Integer(), nullable=False),
+        sa.Column('model_name', sa.String(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('conversation_id')
+    )
+
+
+def downgrade():
+    op.drop_table('conversation_summaries')
@@ -0,0 +1,40 @@
+"""full-text search over conversation titles and messages
+
+Revision ID: 20261017_008
+Revises: 20261017_007
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '20261017_008'
+down_revision = '20261017_007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Stored generated columns: Postgres fills them on insert and update, and
+    # adding them backfills (and rewrites) the existing rows
+    op.add_column('conversations', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("setweight(to_tsvector('english', coalesce(title, '')), 'A')", persisted=True),
+        nullable=True
+    ))
+    op.add_column('messages', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('english', coalesce(content, ''))", persisted=True),
+        nullable=True
+    ))
+    op.create_index('ix_conversations_search_vector', 'conversations', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_messages_search_vector', 'messages', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_messages_search_vector', table_name='messages')
+    op.drop_index('ix_conversations_search_vector', table_name='conversations')
+    op.drop_column('messages', 'search_vector')
+    op.drop_column('conversations', 'search_vector')
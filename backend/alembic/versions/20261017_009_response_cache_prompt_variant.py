@@ -0,0 +1,24 @@
+"""key cached responses on the system prompt variant
+
+Revision ID: 20261017_009
+Revises: 20261017_008
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '20261017_009'
+down_revision = '20261017_008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing entries were all generated under the shared default prompt
+    op.add_column('response_cache', sa.Column('prompt_variant', sa.String(), server_default='system', nullable=False))
+
+
+def downgrade():
+    op.drop_column('response_cache', 'prompt_variant')
@@ -0,0 +1,22 @@
+"""index response_cache.created_at for pruning expired entries
+
+Revision ID: 20261017_010
+Revises: 20261017_009
+Create Date: 2026-10-17
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '20261017_010'
+down_revision = '20261017_009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_response_cache_created_at', 'response_cache', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_response_cache_created_at', table_name='response_cache')
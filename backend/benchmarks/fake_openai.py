@@ -0,0 +1,143 @@
+"""Local OpenAI-compatible server with configurable latency and failures.
+
+Serves ``/v1/chat/completions`` (streaming and non-streaming),
+``/v1/embeddings`` and ``/v1/models`` so the backend can be load tested
+without network access or API spend::
+
+    python -m benchmarks.fake_openai --port 9100 --ttft 0.4 --tokens-per-second 60
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while streaming tokens across "
+    "an asynchronous event loop to measure latency throughput and memory"
+).split()
+
+@dataclass
+class FakeServerConfig:
+    ttft: float = 0.3
+    tokens_per_second: float = 50.0
+    tokens: int = 200
+    jitter: float = 0.1
+    error_rate: float = 0.0
+    error_status: int = 500
+
+def _completion_text(count: int) -> list:
+    return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+def _sleep_time(base: float, jitter: float) -> float:
+    return max(0.0, base * (1 + random.uniform(-jitter, jitter)))
+
+def create_fake_app(config: FakeServerConfig) -> FastAPI:
+    app = FastAPI()
+
+    def error_response():
+        return JSONResponse(
+            status_code=config.error_status,
+            content={"error": {"message": "Injected failure", "type": "server_error", "code": None}},
+        )
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model", "owned_by": "fake"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if random.random() < config.error_rate:
+            return error_response()
+
+        model = body.get("model", "gpt-3.5-turbo")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        tokens = _completion_text(int(body.get("max_tokens") or config.tokens))
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        usage = {"prompt_tokens": 16, "completion_tokens": len(tokens), "total_tokens": 16 + len(tokens)}
+
+        if not body.get("stream"):
+            await asyncio.sleep(_sleep_time(config.ttft, config.jitter) + len(tokens) / config.tokens_per_second)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def stream():
+            await asyncio.sleep(_sleep_time(config.ttft, config.jitter))
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            interval = 1 / config.tokens_per_second
+            for token in tokens:
+                yield _chunk(completion_id, model, {"content": token})
+                await asyncio.sleep(_sleep_time(interval, config.jitter))
+            yield _chunk(completion_id, model, {}, "stop")
+            if include_usage:
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        if random.random() < config.error_rate:
+            return error_response()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = int(body.get("dimensions") or 1536)
+        data = []
+        for index, text in enumerate(inputs):
+            # Deterministic per input so identical prompts embed identically
+            rng = random.Random(hashlib.sha256(str(text).encode()).digest())
+            data.append({"object": "embedding", "index": index, "embedding": [rng.uniform(-1, 1) for _ in range(dimensions)]})
+        return {"object": "list", "data": data, "model": body.get("model"), "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    return app
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=FakeServerConfig.ttft, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeServerConfig.tokens_per_second)
+    parser.add_argument("--tokens", type=int, default=FakeServerConfig.tokens, help="Tokens per completion")
+    parser.add_argument("--jitter", type=float, default=FakeServerConfig.jitter, help="Relative +/- jitter on every delay")
+    parser.add_argument("--error-rate", type=float, default=FakeServerConfig.error_rate, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=FakeServerConfig.error_status)
+    return parser.parse_args(argv)
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    config = FakeServerConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        tokens=args.tokens,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    uvicorn.run(create_fake_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
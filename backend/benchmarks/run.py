@@ -0,0 +1,330 @@
+"""Load test the backend against the fake OpenAI server.
+
+Boots ``benchmarks.fake_openai`` and the app (``uvicorn main:app``) as
+subprocesses, signs in a benchmark user directly through the database and
+drives the chat endpoints at a fixed concurrency::
+
+    python -m benchmarks.run --concurrency 50 --requests 500 --ttft 0.4
+
+The app uses the usual settings (``.env`` / environment) except that
+``OPENAI_BASE_URL`` points at the fake server and the per-user scheduler
+limits are lifted (all load comes from one benchmark user, so they would
+otherwise measure the rate limiter); ``DATABASE_URL`` must reach a migrated
+local database. Pass ``--app-url`` to benchmark an app that is already
+running instead; it needs similar limits.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SCENARIOS = ("ask", "conversations", "messages")
+# Overridable through the environment; a rate of 0 disables a bucket
+SCHEDULER_BENCH_ENV = {
+    "SCHEDULER_USER_MAX_CONCURRENT": "100000",
+    "SCHEDULER_USER_MAX_QUEUED": "100000",
+    "SCHEDULER_USER_REQUESTS_PER_MINUTE": "0",
+    "SCHEDULER_USER_TOKENS_PER_MINUTE": "0",
+}
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile; None for an empty sample."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+@dataclass
+class ScenarioResult:
+    name: str
+    concurrency: int
+    started: float = 0.0
+    finished: float = 0.0
+    ok: int = 0
+    errors: int = 0
+    latencies: List[float] = field(default_factory=list)
+    ttfts: List[float] = field(default_factory=list)
+    inter_frame: List[float] = field(default_factory=list)
+    chars: int = 0
+    baseline_rss: Optional[int] = None
+    peak_rss: Optional[int] = None
+
+    @property
+    def elapsed(self) -> float:
+        return self.finished - self.started
+
+    def summary(self) -> Dict:
+        def ms(values, pct):
+            value = percentile(values, pct)
+            return round(value * 1000, 2) if value is not None else None
+
+        summary = {
+            "scenario": self.name,
+            "concurrency": self.concurrency,
+            "requests": self.ok + self.errors,
+            "errors": self.errors,
+            "throughput_rps": round(self.ok / self.elapsed, 2) if self.elapsed else None,
+            "latency_ms": {f"p{p}": ms(self.latencies, p) for p in (50, 95, 99)},
+        }
+        if self.ttfts:
+            summary["ttft_ms"] = {f"p{p}": ms(self.ttfts, p) for p in (50, 95, 99)}
+            summary["inter_frame_ms"] = {f"p{p}": ms(self.inter_frame, p) for p in (50, 95, 99)}
+            summary["chars_per_second"] = round(self.chars / self.elapsed, 1) if self.elapsed else None
+        if self.baseline_rss is not None and self.peak_rss is not None:
+            summary["rss_mb"] = {"baseline": round(self.baseline_rss / 2**20, 1), "peak": round(self.peak_rss / 2**20, 1)}
+            summary["rss_kb_per_stream"] = round((self.peak_rss - self.baseline_rss) / 1024 / self.concurrency, 1)
+        return summary
+
+def read_rss(pid: int) -> Optional[int]:
+    """Resident set size in bytes from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+class RssSampler:
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "RssSampler":
+        if self.pid is not None:
+            self._task = asyncio.create_task(self._sample())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self) -> None:
+        while True:
+            rss = read_rss(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            await asyncio.sleep(self.interval)
+
+async def run_ask(client: httpx.AsyncClient, result: ScenarioResult, conversation_id: Optional[str], index: int) -> Optional[str]:
+    """One /api/streaming/ask round trip; returns the conversation id used."""
+    start = time.perf_counter()
+    body = {"message": f"Benchmark prompt {index}: summarise the history of stream processing."}
+    if conversation_id:
+        body["conversation_id"] = conversation_id
+    first_frame = last_frame = None
+    failed = False
+    async with client.stream("POST", "/api/streaming/ask", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            result.errors += 1
+            return conversation_id
+        conversation_id = response.headers.get("X-Conversation-ID", conversation_id)
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            payload = line[6:]
+            if payload == "[DONE]":
+                break
+            now = time.perf_counter()
+            data = json.loads(payload)
+            if "error" in data:
+                failed = True
+                break
+            if "queue_position" in data:
+                # Scheduler progress, not output
+                continue
+            if first_frame is None:
+                first_frame = now
+                result.ttfts.append(now - start)
+            else:
+                result.inter_frame.append(now - last_frame)
+            last_frame = now
+            result.chars += len(data.get("data", ""))
+    if failed:
+        result.errors += 1
+    else:
+        result.ok += 1
+        result.latencies.append(time.perf_counter() - start)
+    return conversation_id
+
+async def run_get(client: httpx.AsyncClient, result: ScenarioResult, path: str, params: Optional[dict] = None) -> None:
+    start = time.perf_counter()
+    response = await client.get(path, params=params)
+    if response.status_code == 200:
+        result.ok += 1
+        result.latencies.append(time.perf_counter() - start)
+    else:
+        result.errors += 1
+
+async def run_scenario(name: str, client: httpx.AsyncClient, args: argparse.Namespace, app_pid: Optional[int], conversations: List[str]) -> ScenarioResult:
+    result = ScenarioResult(name, args.concurrency)
+    counter = iter(range(args.requests))
+
+    async def worker(slot: int) -> None:
+        conversation_id = conversations[slot % len(conversations)] if conversations else None
+        for index in counter:
+            try:
+                if name == "ask":
+                    conversation_id = await run_ask(client, result, conversation_id, index)
+                elif name == "conversations":
+                    await run_get(client, result, "/api/conversations", {"per_page": 20})
+                else:
+                    await run_get(client, result, f"/api/messages/{conversation_id}", {"limit": 50})
+            except httpx.HTTPError:
+                result.errors += 1
+        if name == "ask" and conversation_id and conversation_id not in conversations:
+            conversations.append(conversation_id)
+
+    result.baseline_rss = read_rss(app_pid) if app_pid else None
+    async with RssSampler(app_pid) as sampler:
+        result.started = time.perf_counter()
+        await asyncio.gather(*(worker(slot) for slot in range(args.concurrency)))
+        result.finished = time.perf_counter()
+    result.peak_rss = sampler.peak
+    return result
+
+async def create_bench_token(email: str) -> str:
+    # Imported late: settings are read from the environment prepared in benchmark()
+    from sqlalchemy import select
+    from core.security import create_access_token, new_refresh_session
+    from database.database import AsyncSessionLocal, async_engine
+    from models.models import Session as DbSession, User
+
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.email == email))
+        if user is None:
+            user = User(email=email, google_id=f"benchmark:{email}")
+            db.add(user)
+            await db.flush()
+        session_id, refresh_jti, expires_at = new_refresh_session()
+        db.add(DbSession(id=session_id, user_id=user.id, refresh_jti=refresh_jti, expires_at=expires_at))
+        await db.commit()
+    await async_engine.dispose()
+    token, _ = create_access_token(user.id, user.email, None, session_id)
+    return token
+
+async def wait_until_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not become ready within {timeout} seconds")
+            await asyncio.sleep(0.2)
+
+def start_process(command: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+def print_report(results: List[ScenarioResult]) -> None:
+    for result in results:
+        summary = result.summary()
+        print(f"\n== {summary.pop('scenario')} ==")
+        for key, value in summary.items():
+            print(f"  {key:<20} {value}")
+
+async def benchmark(args: argparse.Namespace) -> List[ScenarioResult]:
+    processes: List[subprocess.Popen] = []
+    env = dict(os.environ)
+    app_url = args.app_url
+    app_pid = None
+    try:
+        if not app_url:
+            env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.fake_port}/v1"
+            env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+            env.setdefault("LOG_LEVEL", "WARNING")
+            for key, value in SCHEDULER_BENCH_ENV.items():
+                env.setdefault(key, value)
+            processes.append(start_process([
+                sys.executable, "-m", "benchmarks.fake_openai",
+                "--port", str(args.fake_port),
+                "--ttft", str(args.ttft),
+                "--tokens-per-second", str(args.tokens_per_second),
+                "--tokens", str(args.tokens),
+                "--error-rate", str(args.error_rate),
+            ], env))
+            app = start_process([
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning",
+            ], env)
+            processes.append(app)
+            app_pid = app.pid
+            app_url = f"http://127.0.0.1:{args.port}"
+            await wait_until_ready(f"http://127.0.0.1:{args.fake_port}/v1/models", args.startup_timeout)
+        await wait_until_ready(f"{app_url}/metrics", args.startup_timeout)
+
+        os.environ.update({key: env[key] for key in ("OPENAI_BASE_URL", "OPENAI_API_KEY") if key in env})
+        token = await create_bench_token(args.email)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        timeout = httpx.Timeout(args.request_timeout)
+        conversations: List[str] = []
+        results = []
+        async with httpx.AsyncClient(base_url=app_url, headers={"Authorization": f"Bearer {token}"}, limits=limits, timeout=timeout) as client:
+            for name in args.scenarios:
+                if name == "messages" and not conversations:
+                    # Needs history to read; seed it with one round of asks
+                    seed = argparse.Namespace(**{**vars(args), "requests": args.concurrency})
+                    await run_scenario("ask", client, seed, None, conversations)
+                results.append(await run_scenario(name, client, args, app_pid, conversations))
+        return results
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test the chat backend against a fake OpenAI server")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--app-url", help="Benchmark an already running app instead of booting one")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--email", default="benchmark@example.com")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json", dest="json_path", help="Also write the summaries to this file")
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    results = asyncio.run(benchmark(args))
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, "w") as output:
+            json.dump([result.summary() for result in results], output, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     OPENAI_API_KEY: str 
-    # ANTHROPIC_API_KEY: str
+    OPENAI_BASE_URL: str = "https://api.openai.com/v1"
+    ANTHROPIC_API_KEY: Optional[str] = None
+    ANTHROPIC_BASE_URL: str = "https://api.anthropic.com"
     DATABASE_URL: str
     SECRET_KEY: str
     ALGORITHM: str
@@ -12,6 +15,145 @@ class Settings(BaseSettings):
     GOOGLE_CLIENT_SECRET: str
     GOOGLE_REDIRECT_URI: str
     FRONTEND_URL: str
+
+    # Async database pool
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    MESSAGE_STREAM_BATCH_SIZE: int = 100
+    # Migrations own the schema; only enable for throwaway local databases
+    DB_CREATE_ALL_ON_STARTUP: bool = False
+
+    # SSE streaming
+    SSE_COALESCE_WINDOW_MS: float = 15.0
+    SSE_COALESCE_MAX_CHARS: int = 64
+    SSE_DISCONNECT_POLL_INTERVAL: float = 0.25
+    SSE_REPLAY_BUFFER_FRAMES: int = 4096
+    SSE_RESUME_GRACE_SECONDS: float = 30.0
+    SSE_RESUME_RETENTION_SECONDS: float = 60.0
+    GENERATION_MAX_ACTIVE_JOBS: int = 256
+
+    # WebSocket chat
+    WS_AUTH_TIMEOUT: float = 10.0
+    WS_MAX_STREAMS_PER_CONNECTION: int = 32
+    WS_SEND_QUEUE_SIZE: int = 1024
+
+    # Write-behind message persistence
+    MESSAGE_WRITE_QUEUE_SIZE: int = 2000
+    MESSAGE_WRITE_BATCH_SIZE: int = 200
+    MESSAGE_WRITE_FLUSH_INTERVAL: float = 0.01
+    MESSAGE_WRITE_ENQUEUE_TIMEOUT: float = 5.0
+    MESSAGE_WRITE_MAX_RETRIES: int = 3
+    MESSAGE_WRITE_ACK_TIMEOUT: float = 30.0
+
+    # Semantic response cache
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_EMBEDDER: str = "openai"  # "openai" or "hashing"
+    SEMANTIC_CACHE_EMBEDDING_MODEL: str = "text-embedding-3-small"
+    SEMANTIC_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    SEMANTIC_CACHE_TTL_SECONDS: int = 86400
+
+    # LLM defaults
+    DEFAULT_MODEL_TYPE: str = "openai"
+    DEFAULT_OPENAI_MODEL: str = "gpt-3.5-turbo"
+    DEFAULT_ANTHROPIC_MODEL: str = "claude-3-5-haiku-latest"
+    ANTHROPIC_MAX_TOKENS: int = 4096
+    DEFAULT_TEMPERATURE: float = 0.5
+
+    # Shared LLM HTTP connection pool
+    LLM_HTTP2: bool = True
+    LLM_MAX_CONNECTIONS: int = 200
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 50
+    LLM_KEEPALIVE_EXPIRY: float = 60.0
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_REQUEST_TIMEOUT: float = 120.0
+    LLM_WARM_UP: bool = True
+    LLM_PROVIDER_PLUGINS: Dict[str, str] = {}  # e.g. {"mistral": "my_pkg.providers:MistralModel"}
+    LLM_BACKENDS: Dict[str, str] = {}  # "native" or "langchain", e.g. {"openai:gpt-4o": "langchain"}
+    # Each entry becomes its own model type, e.g. {"groq": {"base_url": "https://api.groq.com/openai/v1", "api_key": "...", "model": "llama-3.1-70b-versatile"}}
+    LLM_OPENAI_COMPATIBLE_ENDPOINTS: Dict[str, Dict[str, str]] = {}
+
+    # Prompt template variants, e.g. [{"tenant": "example.com", "model": "anthropic", "path": "prompts/example.md"}]
+    PROMPT_VARIANTS: List[Dict[str, str]] = []
+    PROMPT_CACHE_MIN_TOKENS: int = 1024  # mark the system prompt cacheable (Anthropic) from this size
+
+    # Conversation history sent with each turn
+    CONTEXT_ENABLED: bool = True
+    CONTEXT_DEFAULT_TOKEN_BUDGET: int = 4000
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {}  # e.g. {"openai:gpt-4o": 16000, "anthropic": 12000}
+    CONTEXT_CACHE_CONVERSATIONS: int = 2000
+    CONTEXT_MAX_MESSAGES: int = 200
+
+    # Full-text search; snippets are Markdown, matches in bold
+    SEARCH_HEADLINE_OPTIONS: str = "StartSel=**, StopSel=**, MaxWords=35, MinWords=15, MaxFragments=2"
+
+    # Rolling summaries of long conversations, written by a background worker
+    SUMMARY_ENABLED: bool = True
+    SUMMARY_MODEL_TYPE: str = "openai"
+    SUMMARY_MODEL_NAME: Optional[str] = "gpt-4o-mini"
+    SUMMARY_TRIGGER_TOKENS: int = 3000  # unsummarized history that triggers a summary
+    SUMMARY_KEEP_RECENT_TOKENS: int = 1000  # newest turns always sent verbatim
+    SUMMARY_MAX_INPUT_TOKENS: int = 12000  # per summarization call; the rest waits for the next batch
+    SUMMARY_BATCH_INTERVAL_SECONDS: float = 5.0
+    SUMMARY_BATCH_SIZE: int = 16
+    SUMMARY_MAX_CONCURRENT: int = 2
+
+    # Latency-aware routing for the "router" model type; the model name picks a route
+    LLM_ROUTES: Dict[str, List[str]] = {"default": ["openai"]}  # e.g. {"default": ["openai:gpt-4o-mini", "anthropic", "groq"]}
+    LLM_ROUTER_WINDOW: int = 100
+    LLM_ROUTER_MIN_SAMPLES: int = 5
+    LLM_ROUTER_MAX_ERROR_RATE: float = 0.5
+    LLM_ROUTER_COOLDOWN_SECONDS: float = 30.0
+    LLM_ROUTER_HEDGE: bool = True
+    LLM_ROUTER_HEDGE_MIN_DELAY: float = 0.25
+    LLM_ROUTER_HEDGE_DEFAULT_DELAY: float = 2.0
+    LLM_ROUTER_HEDGE_MAX_DELAY: float = 10.0
+
+    # Upstream generation admission control
+    LLM_MAX_CONCURRENT_GENERATIONS: int = 64
+    LLM_CONCURRENCY_LIMITS: Dict[str, int] = {}  # e.g. {"openai:gpt-4o": 16, "openai": 64}
+    LLM_MAX_QUEUED_GENERATIONS: int = 256
+    LLM_ADMISSION_TIMEOUT: float = 30.0
+    LLM_COALESCE_GENERATIONS: bool = True
+
+    # Per-user fair-share scheduling of generations; limits of 0 disable a bucket
+    SCHEDULER_BACKEND: str = "memory"  # "memory" or "postgres" (shared by all workers)
+    SCHEDULER_MAX_CONCURRENT: int = 64
+    SCHEDULER_USER_MAX_CONCURRENT: int = 4
+    SCHEDULER_USER_MAX_QUEUED: int = 16
+    SCHEDULER_MAX_WAIT_SECONDS: float = 60.0
+    SCHEDULER_USER_REQUESTS_PER_MINUTE: float = 30.0
+    SCHEDULER_USER_REQUEST_BURST: float = 10.0
+    SCHEDULER_USER_TOKENS_PER_MINUTE: float = 100000.0
+    SCHEDULER_GLOBAL_REQUESTS_PER_MINUTE: float = 0.0
+    SCHEDULER_GLOBAL_TOKENS_PER_MINUTE: float = 0.0
+    SCHEDULER_ESTIMATED_COMPLETION_TOKENS: int = 512
+    SCHEDULER_USER_WEIGHTS: Dict[str, float] = {}  # by email, e.g. {"ops@example.com": 4.0}
+
+    # Bearer token verification cache
+    TOKEN_CACHE_BACKEND: str = "memory"  # "memory" or "redis"
+    TOKEN_CACHE_REDIS_URL: Optional[str] = None
+    TOKEN_CACHE_TTL: int = 300
+    TOKEN_NEGATIVE_CACHE_TTL: int = 30
+    TOKEN_CACHE_MAXSIZE: int = 10000
+
+    # Self-issued session tokens
+    JWT_ISSUER: str = "llm-app-backend"
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    TOKEN_REVOCATION_REFRESH_SECONDS: float = 30.0
+    # The refresh token only travels in this HttpOnly cookie, scoped to /auth
+    REFRESH_COOKIE_NAME: str = "refresh_token"
+    REFRESH_COOKIE_SECURE: bool = True
+    REFRESH_COOKIE_SAMESITE: str = "lax"  # "none" when the frontend is on another site (requires Secure)
+
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_DEFAULT_SAMPLE_RATE: float = 1.0
+    LOG_SAMPLE_RATES: Dict[str, float] = {}
+
     class Config:
         env_file = ".env"
 
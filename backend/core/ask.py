@@ -3,6 +3,7 @@ import logging
 from typing import AsyncGenerator, Optional
 from config.settings import settings
 from core.model_interface import ModelFactory
+from core.semantic_cache import with_semantic_cache
 
 logger = logging.getLogger(__name__)
 
@@ -30,23 +31,22 @@ async def askLLM(
         ValueError: If an invalid model configuration is provided.
         Exception: For any unexpected errors during execution.
     """
-    logger.info(f"Received message: {content}")
-    logger.info(f"Using model type: {model_type}, model name: {model_name}, temperature: {temperature}")
+    logger.info("Received message: %s", content)
+    logger.info("Using model type: %s, model name: %s, temperature: %s", model_type, model_name, temperature)
 
     try:
-        model = ModelFactory.create_model(model_type, model_name, temperature)
-        logger.info(f"Initialized {model_type} model")
+        model = with_semantic_cache(ModelFactory.create_model(model_type, model_name, temperature))
+        logger.info("Initialized %s model", model_type)
 
         logger.info("Generating response")
         async for token in model.generate(content):
-            logger.debug(f"Yielding token: {token}")
             yield token
 
     except ValueError as ve:
-        logger.error(f"Invalid model configuration: {ve}")
+        logger.error("Invalid model configuration: %s", ve)
         yield f"Error: {ve}"
     except Exception as e:
-        logger.error(f"Unexpected error occurred: {e}")
+        logger.error("Unexpected error occurred: %s", e)
         yield f"An unexpected error occurred. Please try again later."
 
     logger.info("Completed askLLM function")
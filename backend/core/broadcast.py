@@ -0,0 +1,66 @@
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, Optional
+
+class ReplayUnavailableError(LookupError):
+    """Raised when a subscriber asks for items already evicted from the buffer."""
+
+class TokenBroadcast:
+    """Append-only token log that any number of readers can follow.
+
+    One producer appends tokens and finally closes the log (optionally with
+    an error); each subscriber iterates from a starting index, so late
+    joiners replay what they missed before following the live tail. With
+    ``max_items`` the log becomes a ring buffer that keeps only the newest
+    items; indexes keep counting from the first item ever appended.
+    """
+
+    def __init__(self, max_items: Optional[int] = None):
+        self._items = deque(maxlen=max_items)
+        self._evicted = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def first_index(self) -> int:
+        return self._evicted
+
+    def __len__(self) -> int:
+        return self._evicted + len(self._items)
+
+    def append(self, item: str) -> None:
+        if self._items.maxlen is not None and len(self._items) == self._items.maxlen:
+            self._evicted += 1
+        self._items.append(item)
+        self._notify()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        self._closed = True
+        self._error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        # Wake current waiters and hand later ones a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self, start: int = 0) -> AsyncGenerator[str, None]:
+        index = start
+        while True:
+            if index < self._evicted:
+                raise ReplayUnavailableError(f"Item {index} is no longer buffered (oldest is {self._evicted})")
+            if index < len(self):
+                item = self._items[index - self._evicted]
+                index += 1
+                yield item
+                continue
+            if self._closed:
+                if self._error is not None:
+                    raise self._error
+                return
+            await self._changed.wait()
@@ -0,0 +1,198 @@
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from cachetools import LRUCache
+from sqlalchemy import desc, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from core.helper.prompt import count_tokens
+from models.models import ConversationSummary, Message
+
+logger = logging.getLogger(__name__)
+
+# Stored roles to chat roles
+_ROLES = {"user": "user", "llm": "assistant"}
+# Role and separator overhead chat formats add to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+def context_budget(model_type: str, model_name: Optional[str]) -> int:
+    """History token budget, looked up as ``"provider:model"``, then ``"provider"``."""
+    budgets = settings.CONTEXT_TOKEN_BUDGETS
+    if model_name and f"{model_type}:{model_name}" in budgets:
+        return budgets[f"{model_type}:{model_name}"]
+    return budgets.get(model_type, settings.CONTEXT_DEFAULT_TOKEN_BUDGET)
+
+class ConversationWindow:
+    """The newest messages of one conversation with their token counts.
+
+    Holds at most ``max_tokens`` worth of messages, oldest dropped first,
+    after the conversation's rolling summary if it has one.
+    ``last_message_id`` is the newest stored message the window has seen
+    and ``summary_version`` the summary's ``updated_at``; either changing in
+    the database means another worker moved on and the window must be
+    rebuilt. ``unsummarized_tokens`` also counts messages already dropped
+    from the window, so it tells when the summary has fallen behind.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.messages: Deque[Tuple[Dict[str, str], int]] = deque()
+        self.tokens = 0
+        self.last_message_id: Optional[UUID] = None
+        self.summary: Optional[Dict[str, str]] = None
+        self.summary_tokens = 0
+        self.summary_version: Optional[datetime] = None
+        self.unsummarized_tokens = 0
+
+    def set_summary(self, text: str, version: datetime) -> None:
+        content = SUMMARY_PREFIX + text
+        self.summary = {"role": "system", "content": content}
+        self.summary_tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        self.summary_version = version
+
+    def append(self, role: str, content: str, message_id: Optional[UUID] = None, tokens: Optional[int] = None) -> None:
+        if tokens is None:
+            tokens = count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        self.messages.append(({"role": _ROLES.get(role, role), "content": content}, tokens))
+        self.tokens += tokens
+        self.unsummarized_tokens += tokens
+        self.last_message_id = message_id
+        while self.tokens > self.max_tokens and len(self.messages) > 1:
+            _, dropped = self.messages.popleft()
+            self.tokens -= dropped
+
+    def select(self, budget: int) -> List[Dict[str, str]]:
+        """The summary and the newest messages that fit in ``budget`` tokens, oldest first.
+
+        The turns never start with an assistant turn, which some providers
+        reject.
+        """
+        prefix: List[Dict[str, str]] = []
+        if self.summary is not None and self.summary_tokens < budget:
+            prefix.append(self.summary)
+            budget -= self.summary_tokens
+        selected: List[Dict[str, str]] = []
+        used = 0
+        for message, tokens in reversed(self.messages):
+            if used + tokens > budget:
+                break
+            selected.append(message)
+            used += tokens
+        while selected and selected[-1]["role"] != "user":
+            selected.pop()
+        selected.reverse()
+        return prefix + selected
+
+class ContextBuilder:
+    """Per-worker cache of conversation windows, kept current as messages are stored.
+
+    A hit costs one round trip probing the conversation's newest message id
+    and summary version; a miss, or a window another worker has moved past,
+    reloads the summary and the newest messages after it, up to the window
+    size. ``on_overflow`` is called with the conversation id whenever a
+    window's unsummarized history reaches ``summary_trigger_tokens``.
+    """
+
+    def __init__(self, max_conversations: int, window_tokens: int, max_messages: int, summary_trigger_tokens: int):
+        self.window_tokens = window_tokens
+        self.max_messages = max_messages
+        self.summary_trigger_tokens = summary_trigger_tokens
+        self.on_overflow: Optional[Callable[[UUID], None]] = None
+        self._windows: LRUCache = LRUCache(maxsize=max_conversations)
+        self.hits = 0
+        self.misses = 0
+
+    async def history(self, db: AsyncSession, conversation_id: UUID, budget: int) -> List[Dict[str, str]]:
+        window = self._windows.get(conversation_id)
+        if window is not None:
+            newest = (
+                select(Message.id)
+                .where(Message.conversation_id == conversation_id)
+                .order_by(desc(Message.created_at), desc(Message.id))
+                .limit(1)
+                .scalar_subquery()
+            )
+            version = (
+                select(ConversationSummary.updated_at)
+                .where(ConversationSummary.conversation_id == conversation_id)
+                .scalar_subquery()
+            )
+            probe = (await db.execute(select(newest, version))).one()
+            if probe[0] == window.last_message_id and probe[1] == window.summary_version:
+                self.hits += 1
+                return window.select(budget)
+        self.misses += 1
+        window = await self._load(db, conversation_id)
+        self._windows[conversation_id] = window
+        self._check_overflow(conversation_id, window)
+        return window.select(budget)
+
+    def start(self, conversation_id: UUID) -> None:
+        """Track a conversation that has just been created and has no messages yet."""
+        self._windows[conversation_id] = ConversationWindow(self.window_tokens)
+
+    def append(self, conversation_id: UUID, role: str, content: str, message_id: UUID) -> None:
+        # Only extend windows we hold; a missing one is rebuilt from the table on demand
+        window = self._windows.get(conversation_id)
+        if window is not None:
+            window.append(role, content, message_id)
+            self._check_overflow(conversation_id, window)
+
+    def invalidate(self, conversation_id: UUID) -> None:
+        self._windows.pop(conversation_id, None)
+
+    def _check_overflow(self, conversation_id: UUID, window: ConversationWindow) -> None:
+        if self.on_overflow is not None and window.unsummarized_tokens >= self.summary_trigger_tokens:
+            self.on_overflow(conversation_id)
+
+    async def _load(self, db: AsyncSession, conversation_id: UUID) -> ConversationWindow:
+        summary = await db.get(ConversationSummary, conversation_id)
+        query = select(Message.id, Message.role, Message.content).where(Message.conversation_id == conversation_id)
+        if summary is not None:
+            query = query.where(tuple_(Message.created_at, Message.id) > tuple_(summary.covered_until, summary.covered_message_id))
+        rows = (await db.execute(
+            query
+            .order_by(desc(Message.created_at), desc(Message.id))
+            .limit(self.max_messages)
+        )).all()
+        # Walk newest first and stop loading counts once the window is full
+        kept = []
+        total = 0
+        for row in rows:
+            tokens = count_tokens(row.content or "") + MESSAGE_OVERHEAD_TOKENS
+            if kept and total + tokens > self.window_tokens:
+                break
+            kept.append((row, tokens))
+            total += tokens
+        window = ConversationWindow(self.window_tokens)
+        if summary is not None:
+            window.set_summary(summary.summary, summary.updated_at)
+        for row, tokens in reversed(kept):
+            window.append(row.role, row.content or "", row.id, tokens)
+        # Messages past the window only need a rough count to trigger a summary
+        window.unsummarized_tokens += sum(len(row.content or "") // 4 for row in rows[len(kept):])
+        if rows:
+            window.last_message_id = rows[0].id
+        else:
+            window.last_message_id = summary.covered_message_id if summary is not None else None
+        logger.debug("Rebuilt context window for conversation %s: %s messages, %s tokens", conversation_id, len(window.messages), window.tokens)
+        return window
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._windows),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+context_builder = ContextBuilder(
+    max_conversations=settings.CONTEXT_CACHE_CONVERSATIONS,
+    window_tokens=max([settings.CONTEXT_DEFAULT_TOKEN_BUDGET, *settings.CONTEXT_TOKEN_BUDGETS.values()]),
+    max_messages=settings.CONTEXT_MAX_MESSAGES,
+    summary_trigger_tokens=settings.SUMMARY_TRIGGER_TOKENS,
+)
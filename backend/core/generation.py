@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncGenerator, Callable, Coroutine, Dict, Iterator, Optional, Tuple
+from uuid import UUID
+
+from config.settings import settings
+from core import metrics
+from core.broadcast import TokenBroadcast
+from models.models import utc_now
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ABANDONED = "abandoned"
+
+class GenerationCapacityError(RuntimeError):
+    """Raised when this worker already runs its maximum number of generations."""
+
+class GenerationStream:
+    """One background generation job and its sequenced SSE frames.
+
+    Frames are numbered from 1 in publish order and kept in a bounded ring
+    buffer. The producing task runs independently of any HTTP response, so
+    any number of readers can attach, detach and resume from the last
+    sequence number they saw. With ``abandon_grace`` set the producer may
+    stop once nobody has been attached for that many seconds; without it the
+    job always runs to completion.
+    """
+
+    def __init__(
+        self,
+        generation_id: str,
+        user_id: UUID,
+        conversation_id: UUID,
+        max_frames: int,
+        abandon_grace: Optional[float] = None
+    ):
+        self.id = generation_id
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.frames = TokenBroadcast(max_items=max_frames)
+        self.abandon_grace = abandon_grace
+        self.task: Optional[asyncio.Task] = None
+        self.status = RUNNING
+        self.error: Optional[str] = None
+        self.created_at: datetime = utc_now()
+        self.finished_at: Optional[datetime] = None
+        self.subscribers = 0
+        self._detached_at: Optional[float] = asyncio.get_running_loop().time()
+
+    @property
+    def finished(self) -> bool:
+        return self.frames.closed
+
+    def publish(self, frame: str) -> int:
+        self.frames.append(frame)
+        return len(self.frames)
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        if self.status == RUNNING:
+            self.status = status
+            self.error = error
+
+    def close(self) -> None:
+        self.finished_at = utc_now()
+        self.frames.close()
+
+    @property
+    def abandoned(self) -> bool:
+        """True once nobody has been attached for ``abandon_grace`` seconds."""
+        return (
+            self.abandon_grace is not None
+            and self.subscribers == 0
+            and self._detached_at is not None
+            and asyncio.get_running_loop().time() - self._detached_at >= self.abandon_grace
+        )
+
+    @contextmanager
+    def attach(self) -> Iterator[None]:
+        self.subscribers += 1
+        self._detached_at = None
+        try:
+            yield
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self._detached_at = asyncio.get_running_loop().time()
+
+    async def replay(self, after_seq: int = 0) -> AsyncGenerator[Tuple[int, str], None]:
+        seq = after_seq
+        async for frame in self.frames.subscribe(after_seq):
+            seq += 1
+            yield seq, frame
+
+    def to_dict(self) -> dict:
+        return {
+            "generation_id": self.id,
+            "conversation_id": self.conversation_id,
+            "status": self.status,
+            "error": self.error,
+            "frames": len(self.frames),
+            "subscribers": self.subscribers,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class GenerationRegistry:
+    """Per-worker registry of background generation jobs.
+
+    At most ``max_active`` jobs run at once, which together with the frame
+    cap bounds the memory a worker spends on in-flight answers. Finished
+    jobs stay available for ``retention`` seconds so readers whose
+    connection dropped near the end can still replay the tail.
+    """
+
+    def __init__(self, max_frames: int, retention: float, max_active: int):
+        self.max_frames = max_frames
+        self.retention = retention
+        self.max_active = max_active
+        self._streams: Dict[str, GenerationStream] = {}
+        self._active = 0
+
+    def has_capacity(self) -> bool:
+        return self._active < self.max_active
+
+    def start(
+        self,
+        user_id: UUID,
+        conversation_id: UUID,
+        producer: Callable[[GenerationStream], Coroutine],
+        abandon_grace: Optional[float] = None
+    ) -> GenerationStream:
+        if not self.has_capacity():
+            raise GenerationCapacityError(f"Too many active generations ({self._active})")
+        stream = GenerationStream(uuid.uuid4().hex, user_id, conversation_id, self.max_frames, abandon_grace)
+        self._streams[stream.id] = stream
+        self._active += 1
+        metrics.active_generations.set(self._active)
+        stream.task = asyncio.create_task(self._run(stream, producer(stream)))
+        return stream
+
+    async def _run(self, stream: GenerationStream, producer: Coroutine) -> None:
+        try:
+            await producer
+            stream.finish(COMPLETED)
+        except asyncio.CancelledError:
+            stream.finish(CANCELLED)
+        except Exception as e:
+            logger.error("Generation %s failed: %s", stream.id, e)
+            stream.finish(FAILED, str(e))
+        finally:
+            self._active -= 1
+            metrics.active_generations.set(self._active)
+            stream.close()
+            asyncio.get_running_loop().call_later(self.retention, self._streams.pop, stream.id, None)
+
+    def get(self, generation_id: str) -> Optional[GenerationStream]:
+        return self._streams.get(generation_id)
+
+    def cancel(self, generation_id: str) -> bool:
+        stream = self._streams.get(generation_id)
+        if stream is None or stream.task is None or stream.task.done():
+            return False
+        return stream.task.cancel()
+
+    async def shutdown(self) -> None:
+        tasks = [stream.task for stream in self._streams.values() if stream.task and not stream.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "max_active": self.max_active,
+            "retained": len(self._streams) - self._active,
+        }
+
+def parse_event_id(event_id: str) -> Tuple[str, int]:
+    """Split an SSE event id of the form ``<generation id>:<sequence>``."""
+    generation_id, _, seq = event_id.rpartition(":")
+    if not generation_id or not seq.isdigit():
+        raise ValueError("Invalid event id")
+    return generation_id, int(seq)
+
+generation_registry = GenerationRegistry(
+    max_frames=settings.SSE_REPLAY_BUFFER_FRAMES,
+    retention=settings.SSE_RESUME_RETENTION_SECONDS,
+    max_active=settings.GENERATION_MAX_ACTIVE_JOBS,
+)
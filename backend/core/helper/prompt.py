@@ -1,8 +1,13 @@
-from langchain.schema import SystemMessage
+import inspect
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-def get_system_message() -> SystemMessage:
-    return SystemMessage(content=
-    """
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """
         You are an intelligent, knowledgeable, and versatile AI assistant designed to provide accurate, relevant, and helpful responses across a wide range of topics. Your primary goal is to assist users by answering questions, solving problems, and engaging in meaningful conversations while maintaining a professional, friendly, and empathetic tone. Your responses should be tailored to the user’s level of expertise and preferences.
 
         ## 1. Knowledge and Capabilities
@@ -110,4 +115,112 @@ def get_system_message() -> SystemMessage:
         Remember, managing stress is a process, and it may take time to find the strategies that work best for you. Be patient with yourself and don't hesitate to seek help if you need it. Your mental well-being is important, and taking steps to care for yourself is a sign of strength, not weakness.
 
         If you'd like, I can share some additional resources or discuss any of these strategies in more detail. Please let me know how else I can support you on your journey to better mental well-being.
-   """)
\ No newline at end of file
+   """
+
+SUMMARY_PROMPT = """
+        You maintain a running summary of a conversation between a user and an AI assistant.
+        You are given the current summary, which may be empty, and the messages that came after it.
+        Write an updated summary that replaces the current one.
+
+        - Keep facts, names, numbers, decisions, open questions and the user's stated preferences.
+        - Keep code, commands and identifiers the conversation still depends on, verbatim.
+        - Drop greetings, repetition and anything later superseded.
+        - Write in the third person, in plain prose or short bullet points, with no preamble.
+   """
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """Token count with tiktoken when it is installed, else a 4 chars/token estimate."""
+    try:
+        import tiktoken
+    except ImportError:
+        return max(1, len(text) // 4)
+    try:
+        encoding = tiktoken.encoding_for_model(model_name) if model_name else tiktoken.get_encoding("cl100k_base")
+    except KeyError:
+        # Not an OpenAI model; cl100k is close enough for budgeting
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text))
+
+class PromptTemplate:
+    """A system prompt compiled once.
+
+    The text is dedented and stripped when registered and the system message
+    dict is built once and shared, so every request sends a byte-identical
+    prefix that provider-side prompt caches can match. Token counts are
+    computed once per model.
+    """
+
+    def __init__(self, name: str, text: str, tenant: Optional[str] = None, model: Optional[str] = None):
+        self.name = name
+        self.tenant = tenant
+        self.model = model
+        self.text = inspect.cleandoc(text)
+        self.message = {"role": "system", "content": self.text}
+        self._token_counts: Dict[str, int] = {}
+
+    @property
+    def variant(self) -> str:
+        """Identifies the variant, e.g. ``system@example.com/anthropic``."""
+        return self.name + (f"@{self.tenant}" if self.tenant else "") + (f"/{self.model}" if self.model else "")
+
+    def token_count(self, model_name: Optional[str] = None) -> int:
+        key = model_name or ""
+        count = self._token_counts.get(key)
+        if count is None:
+            count = self._token_counts[key] = count_tokens(self.text, model_name)
+        return count
+
+class PromptRegistry:
+    """Prompt templates with per-tenant and per-model variants.
+
+    ``model`` is ``"provider"`` or ``"provider:model"``. Lookups prefer the
+    tenant's variant over the shared one and, within each, the exact model
+    over the provider over the default; the answer is cached per key.
+    """
+
+    MAX_RESOLVED = 10000
+
+    def __init__(self):
+        self._templates: Dict[Tuple[str, Optional[str], Optional[str]], PromptTemplate] = {}
+        self._resolved: Dict[Tuple[str, Optional[str], str, str], PromptTemplate] = {}
+
+    def register(self, name: str, text: str, tenant: Optional[str] = None, model: Optional[str] = None) -> PromptTemplate:
+        template = PromptTemplate(name, text, tenant.lower() if tenant else None, model)
+        self._templates[(name, template.tenant, model)] = template
+        self._resolved.clear()
+        return template
+
+    def resolve(self, name: str, tenant: Optional[str] = None, provider: str = "", model_name: str = "") -> PromptTemplate:
+        key = (name, tenant, provider, model_name)
+        template = self._resolved.get(key)
+        if template is None:
+            template = self._lookup(name, tenant, provider, model_name)
+            if len(self._resolved) >= self.MAX_RESOLVED:
+                self._resolved.clear()
+            self._resolved[key] = template
+        return template
+
+    def _lookup(self, name: str, tenant: Optional[str], provider: str, model_name: str) -> PromptTemplate:
+        models = [f"{provider}:{model_name}", provider, None]
+        for tenant_key in ([tenant] if tenant else []) + [None]:
+            for model in models:
+                template = self._templates.get((name, tenant_key, model))
+                if template is not None:
+                    return template
+        raise KeyError(f"No prompt template named {name}")
+
+    def stats(self) -> List[dict]:
+        return [
+            {"variant": template.variant, "characters": len(template.text), "tokens": template.token_count()}
+            for template in self._templates.values()
+        ]
+
+prompt_registry = PromptRegistry()
+prompt_registry.register("system", SYSTEM_PROMPT)
+prompt_registry.register("summary", SUMMARY_PROMPT)
+
+for _variant in settings.PROMPT_VARIANTS:
+    # e.g. {"tenant": "example.com", "model": "anthropic", "path": "prompts/example.md"}
+    _text = _variant.get("text") or Path(_variant["path"]).read_text()
+    _template = prompt_registry.register(_variant.get("name", "system"), _text, _variant.get("tenant"), _variant.get("model"))
+    logger.info("Registered prompt variant: %s", _template.variant)
@@ -0,0 +1,206 @@
+import math
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Recording happens on the event loop thread (SQLAlchemy's async engine runs
+# its sync events there too), so plain attribute updates need no locks.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 300, 500)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "bucket_counts", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # One slot per bound plus the +Inf overflow slot; made cumulative on export
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str, **kwargs: str):
+        """Child for one label combination; cache it on hot paths."""
+        key = tuple(str(v) for v in values) if values else tuple(str(kwargs[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._children[()].inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+            for key, child in list(self._children.items())
+        ]
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._children[()].dec(amount)
+
+    def set(self, value: float) -> None:
+        self._children[()].set(value)
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.upper_bounds + (math.inf,), child.bucket_counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Optional[Sequence[float]] = None) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets or LATENCY_BUCKETS))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time until response headers, by route", ("method", "route", "status"))
+chat_setup_duration = registry.histogram(
+    "chat_setup_seconds", "Time from request to generation start", ("route", "model"))
+llm_time_to_first_token = registry.histogram(
+    "llm_time_to_first_token_seconds", "Upstream time to first token", ("provider", "model"))
+llm_tokens_per_second = registry.histogram(
+    "llm_tokens_per_second", "Upstream streaming rate after the first token", ("provider", "model"), RATE_BUCKETS)
+llm_generation_duration = registry.histogram(
+    "llm_generation_duration_seconds", "Total upstream generation time", ("provider", "model"))
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens streamed from upstream", ("provider", "model"))
+llm_usage_tokens = registry.counter(
+    "llm_usage_tokens_total", "Tokens billed by the provider, as reported in usage", ("provider", "model", "kind"))
+llm_finish_reasons = registry.counter(
+    "llm_finish_reasons_total", "Completed generations by finish reason", ("provider", "model", "reason"))
+llm_upstream_errors = registry.counter(
+    "llm_upstream_errors_total", "Upstream generation failures", ("provider", "model", "error"))
+llm_router_attempts = registry.counter(
+    "llm_router_attempts_total", "Routed backend attempts by outcome (won, lost, failed)", ("route", "backend", "outcome"))
+llm_router_hedges = registry.counter(
+    "llm_router_hedges_total", "Hedged requests started because the first token was late", ("route",))
+scheduler_wait_duration = registry.histogram(
+    "scheduler_wait_seconds", "Time generations spent queued for a fair-share slot")
+scheduler_queued = registry.gauge(
+    "scheduler_queued_generations", "Generations waiting for a fair-share slot")
+scheduler_rejections = registry.counter(
+    "scheduler_rejections_total", "Generations refused by the scheduler", ("reason",))
+db_query_duration = registry.histogram(
+    "db_query_duration_seconds", "Database statement latency", ("operation",), DB_LATENCY_BUCKETS)
+auth_token_cache = registry.counter(
+    "auth_token_cache_requests_total", "Opaque token cache lookups", ("result",))
+auth_verifications = registry.counter(
+    "auth_verifications_total", "Token verifications by method", ("method",))
+active_streams = registry.gauge(
+    "chat_active_streams", "Clients currently attached to a generation", ("transport",))
+active_generations = registry.gauge(
+    "chat_active_generations", "Generation jobs currently running")
@@ -1,116 +1,359 @@
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Any
-from langchain.callbacks import AsyncIteratorCallbackHandler
-from langchain.schema.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, AsyncIterator, Any, Callable, Dict, List, Optional, Tuple
 import asyncio
+import hashlib
+import httpx
+import json
 from config.settings import settings
 import logging
 import time
-from core.helper.prompt import get_system_message
+from core import metrics
+from core.broadcast import TokenBroadcast
+from core.helper.prompt import PromptTemplate, prompt_registry
+from core.providers import get_provider_class, provider_options, resolve_backend
 
 logger = logging.getLogger(__name__)
 
+class ModelClientRegistry:
+    """Process-wide cache of provider chat clients.
+
+    Clients are keyed by (provider, model name, api key, kind) and every
+    client of a provider shares one keep-alive HTTP connection pool, so only the first
+    generation on a worker pays for DNS, TCP and TLS setup. Temperature and
+    callbacks are passed per call and never baked into a cached client.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, str, str], Any] = {}
+        self._http_clients: Dict[str, httpx.AsyncClient] = {}
+
+    def get_http_client(self, provider: str) -> httpx.AsyncClient:
+        http_client = self._http_clients.get(provider)
+        if http_client is None or http_client.is_closed:
+            http_client = httpx.AsyncClient(
+                http2=settings.LLM_HTTP2,
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+            )
+            self._http_clients[provider] = http_client
+            logger.info("Created shared HTTP client for provider: %s", provider)
+        return http_client
+
+    def get_client(
+        self,
+        provider: str,
+        model_name: str,
+        api_key: str,
+        factory: Callable[[httpx.AsyncClient], Any],
+        kind: str = "chat"
+    ) -> Any:
+        # ``kind`` keeps differently shaped clients (e.g. a raw SDK client and
+        # a LangChain wrapper) of the same provider apart
+        key = (provider, model_name, api_key, kind)
+        client = self._clients.get(key)
+        if client is None:
+            client = factory(self.get_http_client(provider))
+            self._clients[key] = client
+            logger.info("Registered %s client for model: %s", provider, model_name)
+        return client
+
+    async def aclose(self) -> None:
+        for provider, http_client in self._http_clients.items():
+            try:
+                await http_client.aclose()
+            except Exception as e:
+                logger.error("Error closing HTTP client for provider %s: %s", provider, e)
+        self._http_clients.clear()
+        self._clients.clear()
+
+client_registry = ModelClientRegistry()
+
+class AdmissionRejectedError(RuntimeError):
+    """Raised when a generation cannot be admitted within the configured bounds."""
+
+class _AdmissionGate:
+    def __init__(self, limit: int, max_queued: int):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.semaphore = asyncio.Semaphore(limit)
+
+class AdmissionController:
+    """Bounds concurrent upstream generations per provider/model.
+
+    Each (provider, model) pair gets its own gate. A generation that finds its
+    gate full waits in line for at most ``timeout`` seconds; once
+    ``max_queued`` generations are already waiting, new ones are rejected
+    straight away instead of piling up behind the provider's rate limit.
+    Limits are looked up as ``"provider:model"``, then ``"provider"``, then
+    fall back to ``default_limit``.
+    """
+
+    def __init__(self, default_limit: int, limits: Dict[str, int], max_queued: int, timeout: float):
+        self.default_limit = default_limit
+        self.limits = limits
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._gates: Dict[Tuple[str, str], _AdmissionGate] = {}
+
+    def _get_gate(self, provider: str, model_name: str) -> _AdmissionGate:
+        key = (provider, model_name)
+        gate = self._gates.get(key)
+        if gate is None:
+            limit = self.limits.get(f"{provider}:{model_name}", self.limits.get(provider, self.default_limit))
+            gate = _AdmissionGate(limit, self.max_queued)
+            self._gates[key] = gate
+        return gate
+
+    @asynccontextmanager
+    async def admit(self, provider: str, model_name: str) -> AsyncIterator[None]:
+        gate = self._get_gate(provider, model_name)
+        if gate.semaphore.locked():
+            if gate.queued >= gate.max_queued:
+                gate.rejected += 1
+                logger.warning("Admission queue full for %s:%s. In flight: %s, queued: %s", provider, model_name, gate.in_flight, gate.queued)
+                raise AdmissionRejectedError("Too many concurrent generations, please try again shortly")
+            gate.queued += 1
+            try:
+                await asyncio.wait_for(gate.semaphore.acquire(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                gate.rejected += 1
+                logger.warning("Admission wait timed out for %s:%s after %.1f seconds", provider, model_name, self.timeout)
+                raise AdmissionRejectedError("Timed out waiting for a generation slot, please try again shortly")
+            finally:
+                gate.queued -= 1
+        else:
+            await gate.semaphore.acquire()
+
+        gate.in_flight += 1
+        try:
+            yield
+        finally:
+            gate.in_flight -= 1
+            gate.semaphore.release()
+
+    def queue_depth(self, provider: str, model_name: str) -> int:
+        gate = self._gates.get((provider, model_name))
+        return gate.queued if gate else 0
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            f"{provider}:{model_name}": {
+                "limit": gate.limit,
+                "in_flight": gate.in_flight,
+                "queued": gate.queued,
+                "rejected": gate.rejected,
+            }
+            for (provider, model_name), gate in self._gates.items()
+        }
+
+admission_controller = AdmissionController(
+    default_limit=settings.LLM_MAX_CONCURRENT_GENERATIONS,
+    limits=settings.LLM_CONCURRENCY_LIMITS,
+    max_queued=settings.LLM_MAX_QUEUED_GENERATIONS,
+    timeout=settings.LLM_ADMISSION_TIMEOUT,
+)
+
+class _SharedGeneration:
+    def __init__(self, source: AsyncIterator[str]):
+        self.broadcast = TokenBroadcast()
+        self.subscribers = 0
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for token in source:
+                self.broadcast.append(token)
+        except asyncio.CancelledError:
+            self.broadcast.close(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            self.broadcast.close(e)
+        else:
+            self.broadcast.close()
+
+class GenerationCoalescer:
+    """Shares one upstream generation among identical concurrent requests.
+
+    The first request for a key starts the upstream stream in a task; every
+    request with the same key that arrives while it is still running
+    subscribes to the same token log, replaying tokens it missed. Finished
+    generations are dropped immediately, so nothing is ever served stale.
+    The upstream stream is cancelled once its last subscriber goes away.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, _SharedGeneration] = {}
+
+    async def generate(self, key: str, start: Callable[[], AsyncIterator[str]]) -> AsyncGenerator[str, None]:
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = _SharedGeneration(start())
+            self._inflight[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget(key, shared))
+        else:
+            logger.info("Coalescing generation into in-flight request. Subscribers: %s", shared.subscribers + 1)
+
+        shared.subscribers += 1
+        try:
+            async for token in shared.broadcast.subscribe():
+                yield token
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.task.done():
+                self._forget(key, shared)
+                shared.task.cancel()
+
+    def _forget(self, key: str, shared: _SharedGeneration) -> None:
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "subscribers": sum(shared.subscribers for shared in self._inflight.values()),
+        }
+
+generation_coalescer = GenerationCoalescer()
+
+def coalescing_key(provider: str, model_name: str, temperature: float, prompt_variant: str, messages: List[Dict[str, str]]) -> str:
+    # The system prompt is identified by its variant rather than hashed in full
+    payload = json.dumps([provider, model_name, temperature, prompt_variant, messages], separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 class ModelInterface(ABC):
+    # Selects per-tenant prompt variants; set by whoever creates the model
+    tenant: Optional[str] = None
+    # Name of the prompt template sent as the system message
+    prompt_name: str = "system"
+
     @abstractmethod
-    async def generate(self, content: str) -> AsyncGenerator[str, None]:
-        pass
+    async def generate(self, content: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncGenerator[str, None]:
+        """Stream the answer to ``content``, given earlier ``history`` turns (oldest first)."""
+
+    def prompt_variant(self) -> str:
+        """Identifies the system prompt answers are generated under, for cache keys."""
+        return prompt_registry.resolve(self.prompt_name, self.tenant).variant
 
 class BaseLLMModel(ModelInterface):
+    provider = "llm"
+
     def __init__(self, model_name: str, temperature: float, api_key: str):
         self.model_name = model_name
         self.temperature = temperature
         self.api_key = api_key
-        self._current_task = None
-        self._callback = None
-        self._generation_lock = asyncio.Lock()
-        logger.info(f"Initialized {self.__class__.__name__} with model: {model_name}, temperature: {temperature}")
+        # Filled in by backends that report them, once a stream has finished.
+        # With coalescing only the instance that ran the upstream call sees them.
+        self.usage: Optional[Dict[str, int]] = None
+        self.finish_reason: Optional[str] = None
+        logger.info("Initialized %s with model: %s, temperature: %s", self.__class__.__name__, model_name, temperature)
 
-    async def generate(self, content: str) -> AsyncGenerator[str, None]:
-        start_time = time.time()
-        token_count = 0
-        async with self._generation_lock:  # Ensure only one generation at a time
-            self._callback = AsyncIteratorCallbackHandler()
-            model = self.get_model(self._callback)
-            
-            system_message = get_system_message()
-            logger.debug(f"System message generated for {self.model_name}")
-
-            self._current_task = asyncio.create_task(
-                model.agenerate(messages=[[system_message, HumanMessage(content=content)]])
-            )
+    async def generate(self, content: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncGenerator[str, None]:
+        messages = self.build_messages(content, history)
+        if not settings.LLM_COALESCE_GENERATIONS:
+            async for token in self._generate_upstream(messages):
+                yield token
+            return
 
+        key = coalescing_key(self.provider, self.model_name, self.temperature, self.prompt_variant(), messages[1:])
+        async for token in generation_coalescer.generate(key, lambda: self._generate_upstream(messages)):
+            yield token
+
+    async def _generate_upstream(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        start_time = time.perf_counter()
+        first_token_time = None
+        token_count = 0
+        async with admission_controller.admit(self.provider, self.model_name):
+            tokens = self._stream_tokens(messages)
             try:
-                async for token in self._callback.aiter():
+                async for token in tokens:
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                        metrics.llm_time_to_first_token.labels(self.provider, self.model_name).observe(first_token_time - start_time)
                     token_count += 1
                     yield token
             except Exception as e:
-                logger.error(f"Error during generation with {self.model_name}: {str(e)}")
+                metrics.llm_upstream_errors.labels(self.provider, self.model_name, type(e).__name__).inc()
+                logger.error("Error during generation with %s: %s", self.model_name, e)
                 raise
             finally:
-                if self._callback:
-                    self._callback.done.set()
+                # Closes the provider stream right away when our reader goes away
+                await tokens.aclose()
+
+        end_time = time.perf_counter()
+        total_time = end_time - start_time
+        metrics.llm_generation_duration.labels(self.provider, self.model_name).observe(total_time)
+        metrics.llm_tokens.labels(self.provider, self.model_name).inc(token_count)
+        if token_count > 1 and end_time > first_token_time:
+            metrics.llm_tokens_per_second.labels(self.provider, self.model_name).observe((token_count - 1) / (end_time - first_token_time))
+        if self.usage:
+            for kind in ("prompt_tokens", "cached_prompt_tokens", "completion_tokens"):
+                if self.usage.get(kind) is not None:
+                    metrics.llm_usage_tokens.labels(self.provider, self.model_name, kind).inc(self.usage[kind])
+        if self.finish_reason:
+            metrics.llm_finish_reasons.labels(self.provider, self.model_name, self.finish_reason).inc()
+        average = f"{total_time / token_count:.4f} seconds" if token_count else "n/a"
+        logger.info("Generation completed for %s. Tokens generated: %s. Total time: %.2f seconds. Average time per token: %s", self.model_name, token_count, total_time, average)
 
-                try:
-                    if not self._current_task.done():
-                        await self._current_task
-                except Exception as e:
-                    logger.error(f"Error waiting for generation task with {self.model_name}: {str(e)}")
+    def system_prompt(self) -> PromptTemplate:
+        return prompt_registry.resolve(self.prompt_name, self.tenant, self.provider, self.model_name)
 
-        total_time = time.time() - start_time
-        logger.info(f"Generation completed for {self.model_name}. Tokens generated: {token_count}. Total time: {total_time:.2f} seconds. Average time per token: {total_time/token_count:.4f} seconds")
+    def prompt_variant(self) -> str:
+        return self.system_prompt().variant
+
+    def build_messages(self, content: str, history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
+        """Provider-neutral chat messages in OpenAI's role/content shape.
+
+        The compiled system message always comes first and is shared between
+        requests, followed by the history in order, so the cacheable prefix
+        only ever grows.
+        """
+        return [
+            self.system_prompt().message,
+            *(history or ()),
+            {"role": "user", "content": content},
+        ]
+
+    @abstractmethod
+    def _stream_tokens(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        """Stream the answer to ``messages`` from the provider, token by token."""
 
     @abstractmethod
-    def get_model(self, callback: AsyncIteratorCallbackHandler) -> Any:
+    def get_client(self) -> Any:
         pass
 
-class OpenAIModel(BaseLLMModel):
-    def __init__(self, model_name: str = "gpt-3.5-turbo", temperature: float = 0.5):
-        super().__init__(model_name, temperature, settings.OPENAI_API_KEY)
-
-    def get_model(self, callback: AsyncIteratorCallbackHandler) -> ChatOpenAI:
-        if not self.api_key:
-            logger.error("OpenAI API key is not set")
-            raise ValueError("OpenAI API key is not set")
-        logger.info(f"Creating ChatOpenAI model: {self.model_name}")
-        return ChatOpenAI(
-            model_name=self.model_name,
-            streaming=True,
-            verbose=True,
-            callbacks=[callback],
-            temperature=self.temperature,
-            openai_api_key=self.api_key
-        )
-
-# class AnthropicModel(BaseLLMModel):
-#     def __init__(self, model_name: str = settings.DEFAULT_ANTHROPIC_MODEL, temperature: float = settings.DEFAULT_TEMPERATURE):
-#         super().__init__(model_name, temperature, settings.ANTHROPIC_API_KEY)
-
-#     def get_model(self, callback: AsyncIteratorCallbackHandler) -> ChatAnthropic:
-#         if not self.api_key:
-#             logger.error("Anthropic API key is not set")
-#             raise ValueError("Anthropic API key is not set")
-#         logger.info(f"Creating ChatAnthropic model: {self.model_name}")
-#         return ChatAnthropic(
-#             model=self.model_name,
-#             streaming=True,
-#             verbose=True,
-#             callbacks=[callback],
-#             temperature=self.temperature,
-#             anthropic_api_key=self.api_key
-#         )
+    async def warm_up(self) -> None:
+        self.get_client()
 
 class ModelFactory:
     @staticmethod
-    def create_model(model_type: str, model_name: str = None, temperature: float = 0.5) -> ModelInterface:
-        logger.info(f"Creating model. Type: {model_type}, Name: {model_name}, Temperature: {temperature}")
-        if model_type.lower() == "openai":
-            return OpenAIModel(model_name or settings.DEFAULT_OPENAI_MODEL, temperature)
-        # elif model_type.lower() == "anthropic":
-        #     return AnthropicModel(model_name or settings.DEFAULT_ANTHROPIC_MODEL, temperature)
-        else:
-            logger.error(f"Unsupported model type: {model_type}")
-            raise ValueError(f"Unsupported model type: {model_type}")
+    def create_model(model_type: str, model_name: str = None, temperature: float = 0.5, tenant: Optional[str] = None) -> ModelInterface:
+        logger.info("Creating model. Type: %s, Name: %s, Temperature: %s", model_type, model_name, temperature)
+        try:
+            provider_class = get_provider_class(model_type, resolve_backend(model_type, model_name))
+        except ValueError:
+            logger.error("Unsupported model type: %s", model_type)
+            raise
+        # Providers fall back to their own default model when none is given
+        model = provider_class(model_name, temperature, **provider_options(model_type))
+        model.tenant = tenant
+        return model
+
+async def warm_up_models() -> None:
+    if not settings.LLM_WARM_UP:
+        return
+    try:
+        model = ModelFactory.create_model(settings.DEFAULT_MODEL_TYPE, None, settings.DEFAULT_TEMPERATURE)
+        await model.warm_up()
+        logger.info("Warmed up %s client for model: %s", settings.DEFAULT_MODEL_TYPE, model.model_name)
+    except Exception as e:
+        logger.warning("Model warm-up failed: %s", e)
 
 logger.info("Model interface module initialized")
@@ -0,0 +1,95 @@
+"""Lazily loaded model provider plugins.
+
+Providers are registered as ``"module:ClassName"`` strings and only imported
+the first time a model of that type is created, so a worker never pays the
+import time and memory of SDKs it does not use. A provider may offer several
+backends (for example the native SDK and LangChain); the first one
+registered is its default and ``LLM_BACKENDS`` picks another per provider or
+per model. Extra providers can be plugged in through ``LLM_PROVIDER_PLUGINS``
+and OpenAI-compatible endpoints through ``LLM_OPENAI_COMPATIBLE_ENDPOINTS``
+without touching this module; registration options are passed to the
+provider class as keyword arguments.
+"""
+import importlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NATIVE_BACKEND = "native"
+LANGCHAIN_BACKEND = "langchain"
+
+_registry: Dict[str, Dict[str, str]] = {
+    "openai": {
+        NATIVE_BACKEND: "core.providers.openai_provider:OpenAIModel",
+        LANGCHAIN_BACKEND: "core.providers.openai_langchain:OpenAILangChainModel",
+    },
+    "anthropic": {
+        NATIVE_BACKEND: "core.providers.anthropic_provider:AnthropicModel",
+        LANGCHAIN_BACKEND: "core.providers.anthropic_langchain:AnthropicLangChainModel",
+    },
+    "router": {NATIVE_BACKEND: "core.routing:RouterModel"},
+}
+_options: Dict[str, Dict[str, Any]] = {}
+_loaded: Dict[Tuple[str, str], Type] = {}
+
+def register_provider(name: str, target: str, backend: str = NATIVE_BACKEND, options: Optional[Dict[str, Any]] = None) -> None:
+    """Register ``target`` (``"package.module:ClassName"``) as ``backend`` of provider ``name``."""
+    name, backend = name.lower(), backend.lower()
+    _registry.setdefault(name, {})[backend] = target
+    if options is not None:
+        _options[name] = options
+    _loaded.pop((name, backend), None)
+
+def provider_options(name: str) -> Dict[str, Any]:
+    """Keyword arguments the provider class is constructed with."""
+    return _options.get(name.lower(), {})
+
+def resolve_backend(name: str, model_name: Optional[str] = None) -> Optional[str]:
+    """Configured backend for a model, looked up as ``"provider:model"`` then ``"provider"``."""
+    name = name.lower()
+    if model_name:
+        backend = settings.LLM_BACKENDS.get(f"{name}:{model_name}")
+        if backend:
+            return backend
+    return settings.LLM_BACKENDS.get(name)
+
+def get_provider_class(name: str, backend: Optional[str] = None) -> Type:
+    name = name.lower()
+    backends = _registry.get(name)
+    if not backends:
+        raise ValueError(f"Unsupported model type: {name}")
+    backend = backend.lower() if backend else next(iter(backends))
+    provider_class = _loaded.get((name, backend))
+    if provider_class is None:
+        target = backends.get(backend)
+        if target is None:
+            raise ValueError(f"Unsupported backend for model type {name}: {backend}")
+        module_name, _, class_name = target.partition(":")
+        provider_class = getattr(importlib.import_module(module_name), class_name)
+        _loaded[(name, backend)] = provider_class
+        logger.info("Loaded model provider %s (%s) from %s", name, backend, module_name)
+    return provider_class
+
+def available_providers() -> List[str]:
+    return sorted(_registry)
+
+def available_backends(name: str) -> List[str]:
+    return list(_registry.get(name.lower(), {}))
+
+for _name, _endpoint in settings.LLM_OPENAI_COMPATIBLE_ENDPOINTS.items():
+    _endpoint_options = {
+        "provider": _name.lower(),
+        "base_url": _endpoint["base_url"],
+        "api_key": _endpoint.get("api_key", ""),
+        "default_model": _endpoint.get("model"),
+    }
+    register_provider(_name, _registry["openai"][NATIVE_BACKEND], NATIVE_BACKEND, _endpoint_options)
+    register_provider(_name, _registry["openai"][LANGCHAIN_BACKEND], LANGCHAIN_BACKEND)
+
+for _key, _target in settings.LLM_PROVIDER_PLUGINS.items():
+    # Keys are "provider" or "provider:backend"
+    _name, _, _backend = _key.partition(":")
+    register_provider(_name, _target, _backend or NATIVE_BACKEND)
@@ -0,0 +1,29 @@
+import logging
+
+import httpx
+from langchain_anthropic import ChatAnthropic
+
+from config.settings import settings
+from core.model_interface import client_registry
+from core.providers.anthropic_provider import AnthropicModel
+from core.providers.langchain_provider import LangChainModel
+
+logger = logging.getLogger(__name__)
+
+class AnthropicLangChainModel(LangChainModel, AnthropicModel):
+    """Anthropic through LangChain's ChatAnthropic; select with ``LLM_BACKENDS``."""
+
+    def get_client(self) -> ChatAnthropic:
+        self._check_api_key()
+        return client_registry.get_client(self.provider, self.model_name, self.api_key, self._create_client, kind="langchain")
+
+    def _create_client(self, http_client: httpx.AsyncClient) -> ChatAnthropic:
+        # ChatAnthropic manages its own HTTP client
+        logger.info("Creating ChatAnthropic model: %s", self.model_name)
+        return ChatAnthropic(
+            model=self.model_name,
+            streaming=True,
+            anthropic_api_key=self.api_key,
+            anthropic_api_url=self.base_url,
+            max_tokens=settings.ANTHROPIC_MAX_TOKENS
+        )
@@ -0,0 +1,102 @@
+import logging
+from functools import lru_cache
+from typing import AsyncGenerator, Dict, List, Tuple
+
+import httpx
+from anthropic import AsyncAnthropic
+
+from config.settings import settings
+from core.helper.prompt import PromptTemplate
+from core.model_interface import BaseLLMModel, client_registry
+
+logger = logging.getLogger(__name__)
+
+def split_system(messages: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """Anthropic takes system prompts as a separate parameter."""
+    return (
+        [message for message in messages if message["role"] == "system"],
+        [message for message in messages if message["role"] != "system"],
+    )
+
+@lru_cache(maxsize=256)
+def prompt_block(prompt: PromptTemplate, model_name: str) -> dict:
+    """The template as a system block, marked as a cache breakpoint when it is big enough.
+
+    Anthropic only caches prefixes above a minimum size and charges extra
+    for cache writes, so short prompts are sent unmarked.
+    """
+    block = {"type": "text", "text": prompt.text}
+    if prompt.token_count(model_name) >= settings.PROMPT_CACHE_MIN_TOKENS:
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+class AnthropicModel(BaseLLMModel):
+    """Streams from the Anthropic SDK's async event iterator."""
+
+    provider = "anthropic"
+
+    def __init__(self, model_name: str = None, temperature: float = settings.DEFAULT_TEMPERATURE):
+        super().__init__(model_name or settings.DEFAULT_ANTHROPIC_MODEL, temperature, settings.ANTHROPIC_API_KEY)
+        self.base_url = settings.ANTHROPIC_BASE_URL.rstrip("/")
+
+    def _check_api_key(self) -> None:
+        if not self.api_key:
+            logger.error("Anthropic API key is not set")
+            raise ValueError("Anthropic API key is not set")
+
+    def get_client(self) -> AsyncAnthropic:
+        self._check_api_key()
+        return client_registry.get_client(self.provider, "", self.api_key, self._create_client, kind="sdk")
+
+    def _create_client(self, http_client: httpx.AsyncClient) -> AsyncAnthropic:
+        logger.info("Creating AsyncAnthropic client for %s", self.base_url)
+        return AsyncAnthropic(api_key=self.api_key, base_url=self.base_url, http_client=http_client, max_retries=0)
+
+    async def _stream_tokens(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        prompt = self.system_prompt()
+        system, messages = split_system(messages)
+        request = {
+            "model": self.model_name,
+            "max_tokens": settings.ANTHROPIC_MAX_TOKENS,
+            "messages": messages,
+            "temperature": self.temperature,
+            "stream": True,
+        }
+        if system:
+            request["system"] = [
+                prompt_block(prompt, self.model_name) if message is prompt.message else {"type": "text", "text": message["content"]}
+                for message in system
+            ]
+        stream = await self.get_client().messages.create(**request)
+        prompt_tokens = cached_tokens = completion_tokens = None
+        try:
+            async for event in stream:
+                if event.type == "content_block_delta":
+                    if event.delta.type == "text_delta" and event.delta.text:
+                        yield event.delta.text
+                elif event.type == "message_start":
+                    usage = event.message.usage
+                    # input_tokens excludes the part read from or written to the prompt cache
+                    cached_tokens = getattr(usage, "cache_read_input_tokens", None) or 0
+                    prompt_tokens = usage.input_tokens + cached_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+                elif event.type == "message_delta":
+                    completion_tokens = event.usage.output_tokens
+                    if event.delta.stop_reason:
+                        self.finish_reason = event.delta.stop_reason
+        finally:
+            await stream.close()
+        if prompt_tokens is not None and completion_tokens is not None:
+            self.usage = {
+                "prompt_tokens": prompt_tokens,
+                "cached_prompt_tokens": cached_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+
+    async def warm_up(self) -> None:
+        # Open a pooled connection ahead of the first user request.
+        await super().warm_up()
+        await client_registry.get_http_client(self.provider).get(
+            f"{self.base_url}/v1/models",
+            headers={"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+        )
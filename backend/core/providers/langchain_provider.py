@@ -0,0 +1,49 @@
+import asyncio
+from functools import lru_cache
+from typing import AsyncGenerator, Dict, List
+
+from langchain.callbacks import AsyncIteratorCallbackHandler
+from langchain.schema.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from core.model_interface import BaseLLMModel
+
+_MESSAGE_TYPES = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+
+@lru_cache(maxsize=256)
+def _system_message(content: str) -> SystemMessage:
+    # System prompts repeat on every request; build each one once
+    return SystemMessage(content=content)
+
+def to_langchain_messages(messages: List[Dict[str, str]]) -> List[BaseMessage]:
+    # Later system messages (conversation summaries) are per conversation and not cached
+    return [
+        _system_message(message["content"]) if index == 0 and message["role"] == "system"
+        else _MESSAGE_TYPES[message["role"]](content=message["content"])
+        for index, message in enumerate(messages)
+    ]
+
+class LangChainModel(BaseLLMModel):
+    """Streams tokens from a LangChain chat model through an async callback handler."""
+
+    async def _stream_tokens(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        callback = AsyncIteratorCallbackHandler()
+        model = self.get_client()
+
+        current_task = asyncio.create_task(
+            model.agenerate(
+                messages=[to_langchain_messages(messages)],
+                callbacks=[callback],
+                temperature=self.temperature
+            )
+        )
+
+        try:
+            async for token in callback.aiter():
+                yield token
+            # Surfaces upstream errors that only ended the callback stream
+            await current_task
+        finally:
+            callback.done.set()
+            # Stop paying for tokens nobody will read
+            if not current_task.done():
+                current_task.cancel()
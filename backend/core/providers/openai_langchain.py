@@ -0,0 +1,27 @@
+import logging
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from core.model_interface import client_registry
+from core.providers.langchain_provider import LangChainModel
+from core.providers.openai_provider import OpenAIModel
+
+logger = logging.getLogger(__name__)
+
+class OpenAILangChainModel(LangChainModel, OpenAIModel):
+    """OpenAI through LangChain's ChatOpenAI; select with ``LLM_BACKENDS``."""
+
+    def get_client(self) -> ChatOpenAI:
+        self._check_api_key()
+        return client_registry.get_client(self.provider, self.model_name, self.api_key, self._create_client, kind="langchain")
+
+    def _create_client(self, http_client: httpx.AsyncClient) -> ChatOpenAI:
+        logger.info("Creating ChatOpenAI model: %s", self.model_name)
+        return ChatOpenAI(
+            model_name=self.model_name,
+            streaming=True,
+            openai_api_key=self.api_key,
+            openai_api_base=self.base_url,
+            http_async_client=http_client
+        )
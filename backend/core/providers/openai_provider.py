@@ -0,0 +1,98 @@
+import logging
+from typing import AsyncGenerator, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from config.settings import settings
+from core.model_interface import BaseLLMModel, client_registry
+
+logger = logging.getLogger(__name__)
+
+class OpenAIModel(BaseLLMModel):
+    """Streams straight from the OpenAI SDK's async chunk iterator.
+
+    No callback handler or extra task sits between the HTTP stream and the
+    caller, and the final usage chunk (``stream_options.include_usage``)
+    fills in ``usage`` and ``finish_reason``.
+    """
+
+    provider = "openai"
+
+    def __init__(
+        self,
+        model_name: str = None,
+        temperature: float = settings.DEFAULT_TEMPERATURE,
+        provider: Optional[str] = None,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        default_model: Optional[str] = None
+    ):
+        # The keyword arguments describe an OpenAI-compatible endpoint
+        # registered from LLM_OPENAI_COMPATIBLE_ENDPOINTS
+        if provider:
+            self.provider = provider
+        super().__init__(
+            model_name or default_model or settings.DEFAULT_OPENAI_MODEL,
+            temperature,
+            settings.OPENAI_API_KEY if api_key is None else api_key
+        )
+        self.base_url = (base_url or settings.OPENAI_BASE_URL).rstrip("/")
+
+    def _check_api_key(self) -> None:
+        if not self.api_key:
+            logger.error("API key is not set for provider: %s", self.provider)
+            raise ValueError(f"API key is not set for provider: {self.provider}")
+
+    def get_client(self) -> AsyncOpenAI:
+        self._check_api_key()
+        # The SDK client is not tied to a model, so every model shares one
+        return client_registry.get_client(self.provider, "", self.api_key, self._create_client, kind="sdk")
+
+    def _create_client(self, http_client: httpx.AsyncClient) -> AsyncOpenAI:
+        logger.info("Creating AsyncOpenAI client for %s", self.base_url)
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client,
+            # Retries would replay a half-streamed answer; admission control handles overload
+            max_retries=0
+        )
+
+    async def _stream_tokens(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        stream = await self.get_client().chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    # OpenAI caches long prompt prefixes automatically; this is how much hit
+                    details = getattr(chunk.usage, "prompt_tokens_details", None)
+                    self.usage = {
+                        "prompt_tokens": chunk.usage.prompt_tokens,
+                        "cached_prompt_tokens": getattr(details, "cached_tokens", None),
+                        "completion_tokens": chunk.usage.completion_tokens,
+                        "total_tokens": chunk.usage.total_tokens,
+                    }
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    self.finish_reason = choice.finish_reason
+                if choice.delta.content:
+                    yield choice.delta.content
+        finally:
+            # Releases the pooled connection even when the reader stopped early
+            await stream.close()
+
+    async def warm_up(self) -> None:
+        # Open a pooled connection ahead of the first user request.
+        await super().warm_up()
+        await client_registry.get_http_client(self.provider).get(
+            f"{self.base_url}/models",
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        )
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional
+
+from config.settings import settings
+from core import metrics
+from core.helper.prompt import prompt_registry
+from core.model_interface import ModelFactory, ModelInterface
+
+logger = logging.getLogger(__name__)
+
+# Marks an attempt whose stream ended without producing a token
+_EMPTY = object()
+
+class BackendHealth:
+    """Rolling time-to-first-token samples and outcomes for one backend."""
+
+    def __init__(self, window: int):
+        self.ttfts: Deque[float] = deque(maxlen=window)
+        self.failures: Deque[bool] = deque(maxlen=window)
+        self.last_failure: Optional[float] = None
+
+    def record_success(self, ttft: float) -> None:
+        self.ttfts.append(ttft)
+        self.failures.append(False)
+
+    def record_failure(self) -> None:
+        self.failures.append(True)
+        self.last_failure = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.failures) / len(self.failures) if self.failures else 0.0
+
+    def ttft_percentile(self, pct: float) -> Optional[float]:
+        if not self.ttfts:
+            return None
+        ordered = sorted(self.ttfts)
+        return ordered[min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered)))) - 1]
+
+class BackendTracker:
+    """Per-worker health of routed backends.
+
+    A backend is unhealthy once its rolling error rate reaches
+    ``max_error_rate`` over at least ``min_samples`` outcomes. It becomes
+    eligible again ``cooldown`` seconds after its last failure, so a
+    recovered provider is probed by live traffic rather than left out for
+    good.
+    """
+
+    def __init__(self, window: int, min_samples: int, max_error_rate: float, cooldown: float):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._backends: Dict[str, BackendHealth] = {}
+
+    def get(self, backend: str) -> BackendHealth:
+        health = self._backends.get(backend)
+        if health is None:
+            health = self._backends[backend] = BackendHealth(self.window)
+        return health
+
+    def healthy(self, backend: str) -> bool:
+        health = self.get(backend)
+        if len(health.failures) < self.min_samples or health.error_rate < self.max_error_rate:
+            return True
+        return health.last_failure is not None and time.monotonic() - health.last_failure >= self.cooldown
+
+    def rank(self, backends: List[str]) -> List[str]:
+        """Healthy backends first, fastest median TTFT first.
+
+        Backends without samples sort as fastest so they get measured; ties
+        keep the configured order.
+        """
+        def key(backend: str):
+            median = self.get(backend).ttft_percentile(50)
+            return (not self.healthy(backend), median if median is not None else 0.0)
+        return sorted(backends, key=key)
+
+    def hedge_delay(self, backend: str) -> float:
+        """How long to wait for a first token before hedging: the backend's p95 TTFT."""
+        health = self.get(backend)
+        p95 = health.ttft_percentile(95) if len(health.ttfts) >= self.min_samples else None
+        if p95 is None:
+            return settings.LLM_ROUTER_HEDGE_DEFAULT_DELAY
+        return min(max(p95, settings.LLM_ROUTER_HEDGE_MIN_DELAY), settings.LLM_ROUTER_HEDGE_MAX_DELAY)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            backend: {
+                "healthy": self.healthy(backend),
+                "samples": len(health.failures),
+                "error_rate": round(health.error_rate, 4),
+                "ttft_p50": health.ttft_percentile(50),
+                "ttft_p95": health.ttft_percentile(95),
+            }
+            for backend, health in self._backends.items()
+        }
+
+backend_tracker = BackendTracker(
+    window=settings.LLM_ROUTER_WINDOW,
+    min_samples=settings.LLM_ROUTER_MIN_SAMPLES,
+    max_error_rate=settings.LLM_ROUTER_MAX_ERROR_RATE,
+    cooldown=settings.LLM_ROUTER_COOLDOWN_SECONDS,
+)
+
+class _Attempt:
+    """One backend's stream, with its first token being awaited in a task."""
+
+    def __init__(self, backend: str, model: ModelInterface, content: str, history: Optional[List[Dict[str, str]]]):
+        self.backend = backend
+        self.model = model
+        self.tokens = model.generate(content, history)
+        self.started = time.perf_counter()
+        self.first = asyncio.ensure_future(self._first_token())
+
+    async def _first_token(self):
+        try:
+            return await self.tokens.__anext__()
+        except StopAsyncIteration:
+            return _EMPTY
+
+    async def close(self) -> None:
+        if not self.first.done():
+            self.first.cancel()
+            await asyncio.wait({self.first})
+        await self.tokens.aclose()
+
+class RouterModel(ModelInterface):
+    """Routes each generation to the fastest healthy backend of a route.
+
+    Backends are ``"provider"`` or ``"provider:model"`` entries of
+    ``LLM_ROUTES[model_name]``. A backend that fails before its first token
+    is failed over to the next one. With ``LLM_ROUTER_HEDGE`` the next
+    backend is also started when the first token is later than the current
+    backend's p95 TTFT; whichever streams first is kept and the other is
+    cancelled. Once tokens have been sent the answer is never switched.
+    """
+
+    provider = "router"
+
+    def __init__(self, model_name: str = None, temperature: float = settings.DEFAULT_TEMPERATURE):
+        route = model_name if model_name in settings.LLM_ROUTES else "default"
+        if route not in settings.LLM_ROUTES:
+            raise ValueError(f"Unknown route: {model_name}")
+        self.model_name = route
+        self.temperature = temperature
+        self.backends = list(settings.LLM_ROUTES[route])
+        if not self.backends or any(backend.partition(":")[0].lower() == self.provider for backend in self.backends):
+            raise ValueError(f"Route {route} needs at least one non-router backend")
+        self.usage: Optional[Dict[str, int]] = None
+        self.finish_reason: Optional[str] = None
+        logger.info("Initialized RouterModel with route: %s, backends: %s", route, self.backends)
+
+    def _create(self, backend: str) -> ModelInterface:
+        model_type, _, model_name = backend.partition(":")
+        return ModelFactory.create_model(model_type, model_name or None, self.temperature, self.tenant)
+
+    def prompt_variant(self) -> str:
+        # Any backend may answer, so the route is keyed on all of their prompts
+        variants = []
+        for backend in self.backends:
+            model_type, _, model_name = backend.partition(":")
+            variants.append(prompt_registry.resolve(self.prompt_name, self.tenant, model_type.lower(), model_name).variant)
+        return ",".join(variants)
+
+    def _start(self, backend: str, content: str, history: Optional[List[Dict[str, str]]]) -> _Attempt:
+        return _Attempt(backend, self._create(backend), content, history)
+
+    def _record(self, attempt: _Attempt, outcome: str) -> None:
+        metrics.llm_router_attempts.labels(self.model_name, attempt.backend, outcome).inc()
+
+    async def generate(self, content: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncGenerator[str, None]:
+        loop = asyncio.get_running_loop()
+        candidates = backend_tracker.rank(self.backends)
+        pending: List[_Attempt] = []
+        winner: Optional[_Attempt] = None
+        first_token = None
+        last_error: Optional[Exception] = None
+        hedge_at: Optional[float] = None
+        try:
+            while winner is None:
+                if not pending:
+                    if not candidates:
+                        raise last_error or RuntimeError(f"No backend available for route {self.model_name}")
+                    pending.append(self._start(candidates.pop(0), content, history))
+                    hedge_at = None
+                    if settings.LLM_ROUTER_HEDGE and candidates:
+                        hedge_at = loop.time() + backend_tracker.hedge_delay(pending[0].backend)
+
+                timeout = max(0.0, hedge_at - loop.time()) if hedge_at is not None else None
+                done, _ = await asyncio.wait({attempt.first for attempt in pending}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_at = None
+                    metrics.llm_router_hedges.labels(self.model_name).inc()
+                    logger.info("No first token from %s yet, hedging with %s", pending[0].backend, candidates[0])
+                    pending.append(self._start(candidates.pop(0), content, history))
+                    continue
+
+                for attempt in [attempt for attempt in pending if attempt.first.done()]:
+                    pending.remove(attempt)
+                    try:
+                        token = attempt.first.result()
+                    except Exception as e:
+                        last_error = e
+                        backend_tracker.get(attempt.backend).record_failure()
+                        self._record(attempt, "failed")
+                        logger.warning("Backend %s failed before its first token: %s", attempt.backend, e)
+                        await attempt.close()
+                        if pending and candidates and settings.LLM_ROUTER_HEDGE:
+                            # A hedge failed while the slow attempt is still going; try the next one now
+                            hedge_at = loop.time()
+                        continue
+                    if winner is None:
+                        winner, first_token = attempt, token
+                        backend_tracker.get(attempt.backend).record_success(time.perf_counter() - attempt.started)
+                        self._record(attempt, "won")
+                    else:
+                        self._record(attempt, "lost")
+                        await attempt.close()
+
+            for attempt in pending:
+                self._record(attempt, "lost")
+                await attempt.close()
+            pending = []
+
+            if first_token is not _EMPTY:
+                yield first_token
+                try:
+                    async for token in winner.tokens:
+                        yield token
+                except Exception:
+                    backend_tracker.get(winner.backend).record_failure()
+                    raise
+            self.usage = getattr(winner.model, "usage", None)
+            self.finish_reason = getattr(winner.model, "finish_reason", None)
+        finally:
+            for attempt in pending:
+                await attempt.close()
+            if winner is not None:
+                await winner.tokens.aclose()
+
+    async def warm_up(self) -> None:
+        for backend in self.backends:
+            model = self._create(backend)
+            if hasattr(model, "warm_up"):
+                await model.warm_up()
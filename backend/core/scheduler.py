@@ -0,0 +1,421 @@
+import asyncio
+import itertools
+import logging
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from config.settings import settings
+from core import metrics
+from database.database import async_engine
+from models.models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_PREFIX = "global:"
+
+class RateLimitedError(RuntimeError):
+    """Raised when a generation is refused or waited too long for its turn."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BucketSpec:
+    """One token bucket a request draws ``cost`` from."""
+
+    __slots__ = ("key", "rate", "capacity", "cost")
+
+    def __init__(self, key: str, rate: float, capacity: float, cost: float):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.cost = cost
+
+    def shortfall(self, level: float) -> float:
+        """Seconds until the bucket holds enough for this request, 0 if it already does.
+
+        A cost larger than the whole bucket is let through once the bucket is
+        full and leaves it in debt, so oversized requests are slowed, not
+        starved.
+        """
+        missing = min(self.cost, self.capacity) - level
+        return missing / self.rate if missing > 0 else 0.0
+
+def _refill(spec: BucketSpec, tokens: float, elapsed: float) -> float:
+    return min(spec.capacity, tokens + max(elapsed, 0.0) * spec.rate)
+
+class BucketStore(ABC):
+    @abstractmethod
+    async def take(self, buckets: List[BucketSpec]) -> Tuple[float, Optional[str]]:
+        """Draw from every bucket or from none.
+
+        Returns ``(0, None)`` on success, otherwise the seconds until the
+        request could fit and the key of the bucket that is short.
+        """
+
+    @abstractmethod
+    async def adjust(self, buckets: List[BucketSpec]) -> None:
+        """Unconditionally draw ``cost`` (negative to give tokens back)."""
+
+class InMemoryBucketStore(BucketStore):
+    """Per-process buckets; the default backend."""
+
+    PRUNE_EVERY = 1024
+
+    def __init__(self):
+        # key -> (tokens, updated, capacity)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._calls = 0
+
+    def _level(self, spec: BucketSpec, now: float) -> float:
+        state = self._buckets.get(spec.key)
+        if state is None:
+            return spec.capacity
+        return _refill(spec, state[0], now - state[1])
+
+    async def take(self, buckets: List[BucketSpec]) -> Tuple[float, Optional[str]]:
+        now = time.monotonic()
+        levels = [(spec, self._level(spec, now)) for spec in buckets]
+        wait, blocked = 0.0, None
+        for spec, level in levels:
+            shortfall = spec.shortfall(level)
+            if shortfall > wait:
+                wait, blocked = shortfall, spec.key
+        if blocked is not None:
+            return wait, blocked
+        for spec, level in levels:
+            self._buckets[spec.key] = (level - spec.cost, now, spec.capacity)
+        self._calls += 1
+        if self._calls % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        return 0.0, None
+
+    async def adjust(self, buckets: List[BucketSpec]) -> None:
+        now = time.monotonic()
+        for spec in buckets:
+            self._buckets[spec.key] = (min(spec.capacity, self._level(spec, now) - spec.cost), now, spec.capacity)
+
+    def _prune(self, now: float) -> None:
+        # A bucket left untouched long enough to refill is the same as a missing one
+        for key, (tokens, updated, capacity) in list(self._buckets.items()):
+            if tokens >= capacity and now > updated:
+                del self._buckets[key]
+
+class PostgresBucketStore(BucketStore):
+    """Buckets in the ``rate_limit_buckets`` table, shared by every worker.
+
+    Rows are locked in key order for the length of one short transaction and
+    refilled against the database clock, so workers never disagree about
+    elapsed time. Database errors let the request through rather than
+    turning an outage of the limiter into an outage of chat.
+    """
+
+    async def take(self, buckets: List[BucketSpec]) -> Tuple[float, Optional[str]]:
+        try:
+            async with async_engine.begin() as conn:
+                levels, now = await self._lock(conn, buckets)
+                wait, blocked = 0.0, None
+                for spec in buckets:
+                    shortfall = spec.shortfall(levels[spec.key])
+                    if shortfall > wait:
+                        wait, blocked = shortfall, spec.key
+                if blocked is not None:
+                    return wait, blocked
+                await self._write(conn, [(spec.key, levels[spec.key] - spec.cost) for spec in buckets], now)
+                return 0.0, None
+        except SQLAlchemyError as e:
+            logger.warning("Rate limit store unavailable, allowing generation: %s", e)
+            return 0.0, None
+
+    async def adjust(self, buckets: List[BucketSpec]) -> None:
+        try:
+            async with async_engine.begin() as conn:
+                levels, now = await self._lock(conn, buckets)
+                await self._write(conn, [(spec.key, min(spec.capacity, levels[spec.key] - spec.cost)) for spec in buckets], now)
+        except SQLAlchemyError as e:
+            logger.warning("Rate limit adjustment failed: %s", e)
+
+    async def _lock(self, conn, buckets: List[BucketSpec]):
+        ordered = sorted(buckets, key=lambda spec: spec.key)
+        await conn.execute(
+            insert(RateLimitBucket)
+            .values([{"key": spec.key, "tokens": spec.capacity} for spec in ordered])
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
+        rows = (await conn.execute(
+            select(RateLimitBucket.key, RateLimitBucket.tokens, RateLimitBucket.updated_at, func.now())
+            .where(RateLimitBucket.key.in_([spec.key for spec in ordered]))
+            .order_by(RateLimitBucket.key)
+            .with_for_update()
+        )).all()
+        specs = {spec.key: spec for spec in buckets}
+        now = rows[0][3]
+        levels = {
+            row.key: _refill(specs[row.key], row.tokens, (now - row.updated_at).total_seconds())
+            for row in rows
+        }
+        return levels, now
+
+    async def _write(self, conn, values: List[Tuple[str, float]], now) -> None:
+        await conn.execute(
+            update(RateLimitBucket)
+            .where(RateLimitBucket.key == bindparam("b_key"))
+            .values(tokens=bindparam("b_tokens"), updated_at=now),
+            [{"b_key": key, "b_tokens": tokens} for key, tokens in values]
+        )
+
+def create_bucket_store() -> BucketStore:
+    if settings.SCHEDULER_BACKEND == "postgres":
+        return PostgresBucketStore()
+    return InMemoryBucketStore()
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+class Grant:
+    __slots__ = ("user_key", "buckets", "estimated_tokens", "used_tokens")
+
+    def __init__(self, user_key: str, buckets: List[BucketSpec], estimated_tokens: int):
+        self.user_key = user_key
+        self.buckets = buckets
+        self.estimated_tokens = estimated_tokens
+        # Set by the caller once known; the token buckets are corrected on release
+        self.used_tokens: Optional[int] = None
+
+class _Waiter:
+    __slots__ = ("user_key", "buckets", "estimated_tokens", "start_tag", "finish_tag", "seq", "enqueued_at", "future", "position", "on_position")
+
+    def __init__(self, user_key, buckets, estimated_tokens, start_tag, finish_tag, seq, on_position):
+        self.user_key = user_key
+        self.buckets = buckets
+        self.estimated_tokens = estimated_tokens
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.enqueued_at = time.perf_counter()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.position: Optional[int] = None
+        self.on_position = on_position
+
+class GenerationScheduler:
+    """Fair-share admission of generations across users.
+
+    Each request is tagged with a virtual finish time, ``start + cost /
+    weight``, where cost is its estimated token count and ``start`` is the
+    later of the scheduler's virtual clock and the user's previous finish
+    tag (weighted fair queueing). Waiting requests are started in tag
+    order, so a user with a burst of requests queues behind their own
+    earlier work instead of in front of everyone else's. A request starts
+    once a concurrency slot is free, its user is under
+    ``user_max_concurrent``, and every token bucket (per-user and global,
+    requests and estimated tokens) can pay for it. Buckets live in
+    ``store``; the queue itself is per worker.
+    """
+
+    def __init__(
+        self,
+        store: BucketStore,
+        max_concurrent: int,
+        user_max_concurrent: int,
+        user_max_queued: int,
+        max_wait: float
+    ):
+        self.store = store
+        self.max_concurrent = max_concurrent
+        self.user_max_concurrent = user_max_concurrent
+        self.user_max_queued = user_max_queued
+        self.max_wait = max_wait
+        self._waiting: List[_Waiter] = []
+        self._active = 0
+        self._user_active: Dict[str, int] = {}
+        self._user_queued: Dict[str, int] = {}
+        self._user_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def bucket_specs(self, user_key: str, estimated_tokens: int) -> List[BucketSpec]:
+        specs = []
+
+        def add(key: str, per_minute: float, burst: float, cost: float) -> None:
+            if per_minute > 0:
+                specs.append(BucketSpec(key, per_minute / 60, burst or per_minute, cost))
+
+        add(f"user:{user_key}:requests", settings.SCHEDULER_USER_REQUESTS_PER_MINUTE, settings.SCHEDULER_USER_REQUEST_BURST, 1)
+        add(f"user:{user_key}:tokens", settings.SCHEDULER_USER_TOKENS_PER_MINUTE, 0, estimated_tokens)
+        add(f"{GLOBAL_PREFIX}requests", settings.SCHEDULER_GLOBAL_REQUESTS_PER_MINUTE, 0, 1)
+        add(f"{GLOBAL_PREFIX}tokens", settings.SCHEDULER_GLOBAL_TOKENS_PER_MINUTE, 0, estimated_tokens)
+        return specs
+
+    def check_queue(self, user_key: str) -> None:
+        """Refuse up front when the user already has a full queue."""
+        if self._user_queued.get(user_key, 0) >= self.user_max_queued:
+            metrics.scheduler_rejections.labels("queue_full").inc()
+            raise RateLimitedError("Too many queued generations, please wait for earlier answers to finish", retry_after=1.0)
+
+    async def acquire(
+        self,
+        user_key: str,
+        estimated_tokens: int,
+        weight: float = 1.0,
+        on_position: Optional[Callable[[int], None]] = None
+    ) -> Grant:
+        self.check_queue(user_key)
+        start_tag = max(self._virtual_time, self._user_finish.get(user_key, 0.0))
+        finish_tag = start_tag + estimated_tokens / max(weight, 1e-6)
+        self._user_finish[user_key] = finish_tag
+        waiter = _Waiter(user_key, self.bucket_specs(user_key, estimated_tokens), estimated_tokens, start_tag, finish_tag, next(self._seq), on_position)
+        self._waiting.append(waiter)
+        self._user_queued[user_key] = self._user_queued.get(user_key, 0) + 1
+        metrics.scheduler_queued.inc()
+        self._kick()
+        try:
+            try:
+                return await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                metrics.scheduler_rejections.labels("timeout").inc()
+                raise RateLimitedError(f"Waited more than {self.max_wait:g} seconds for a generation slot", retry_after=self.max_wait) from None
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller gave up
+                await self.release(waiter.future.result())
+            else:
+                waiter.future.cancel()
+                self._dequeue(waiter)
+                self._kick()
+            raise
+
+    async def release(self, grant: Grant) -> None:
+        self._active -= 1
+        remaining = self._user_active.get(grant.user_key, 1) - 1
+        if remaining:
+            self._user_active[grant.user_key] = remaining
+        else:
+            self._user_active.pop(grant.user_key, None)
+        self._kick()
+        if grant.used_tokens is not None and grant.used_tokens != grant.estimated_tokens:
+            # Charge the token buckets what was actually generated
+            delta = grant.used_tokens - grant.estimated_tokens
+            corrections = [
+                BucketSpec(spec.key, spec.rate, spec.capacity, delta)
+                for spec in grant.buckets if spec.key.endswith(":tokens")
+            ]
+            if corrections:
+                await self.store.adjust(corrections)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_key: str,
+        estimated_tokens: int,
+        weight: float = 1.0,
+        on_position: Optional[Callable[[int], None]] = None
+    ) -> AsyncIterator[Grant]:
+        grant = await self.acquire(user_key, estimated_tokens, weight, on_position)
+        try:
+            yield grant
+        finally:
+            await self.release(grant)
+
+    def _dequeue(self, waiter: _Waiter) -> bool:
+        try:
+            self._waiting.remove(waiter)
+        except ValueError:
+            return False
+        metrics.scheduler_queued.dec()
+        remaining = self._user_queued.get(waiter.user_key, 1) - 1
+        if remaining:
+            self._user_queued[waiter.user_key] = remaining
+        else:
+            self._user_queued.pop(waiter.user_key, None)
+            if self._user_finish.get(waiter.user_key, 0.0) <= self._virtual_time:
+                self._user_finish.pop(waiter.user_key, None)
+        return True
+
+    def _kick(self) -> None:
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        self._wake.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                retry_after = await self._dispatch()
+            except Exception as e:
+                logger.error("Generation scheduler dispatch failed: %s", e)
+                retry_after = 1.0
+            if not self._waiting and self._active == 0:
+                return
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=retry_after)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self) -> Optional[float]:
+        retry_after: Optional[float] = None
+        while self._waiting and self._active < self.max_concurrent:
+            started = False
+            for waiter in sorted(self._waiting, key=lambda w: (w.finish_tag, w.seq)):
+                if self._user_active.get(waiter.user_key, 0) >= self.user_max_concurrent:
+                    continue
+                wait, blocked = await self.store.take(waiter.buckets)
+                if blocked is not None:
+                    retry_after = wait if retry_after is None else min(retry_after, wait)
+                    if blocked.startswith(GLOBAL_PREFIX):
+                        # Nobody else fits either
+                        break
+                    continue
+                if not self._dequeue(waiter):
+                    # Left the queue while the buckets were being charged
+                    await self.store.adjust([BucketSpec(spec.key, spec.rate, spec.capacity, -spec.cost) for spec in waiter.buckets])
+                    started = True
+                    break
+                self._start(waiter)
+                started = True
+                break
+            if not started:
+                break
+        self._publish_positions()
+        return retry_after
+
+    def _start(self, waiter: _Waiter) -> None:
+        self._active += 1
+        self._user_active[waiter.user_key] = self._user_active.get(waiter.user_key, 0) + 1
+        self._virtual_time = max(self._virtual_time, waiter.start_tag)
+        metrics.scheduler_wait_duration.observe(time.perf_counter() - waiter.enqueued_at)
+        waiter.future.set_result(Grant(waiter.user_key, waiter.buckets, waiter.estimated_tokens))
+
+    def _publish_positions(self) -> None:
+        for position, waiter in enumerate(sorted(self._waiting, key=lambda w: (w.finish_tag, w.seq)), start=1):
+            if waiter.position != position:
+                waiter.position = position
+                if waiter.on_position is not None:
+                    waiter.on_position(position)
+
+    def stats(self) -> dict:
+        return {
+            "backend": settings.SCHEDULER_BACKEND,
+            "active": self._active,
+            "max_concurrent": self.max_concurrent,
+            "queued": len(self._waiting),
+            "queued_users": len(self._user_queued),
+        }
+
+generation_scheduler = GenerationScheduler(
+    store=create_bucket_store(),
+    max_concurrent=settings.SCHEDULER_MAX_CONCURRENT,
+    user_max_concurrent=settings.SCHEDULER_USER_MAX_CONCURRENT,
+    user_max_queued=settings.SCHEDULER_USER_MAX_QUEUED,
+    max_wait=settings.SCHEDULER_MAX_WAIT_SECONDS,
+)
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Set, Tuple
+from uuid import UUID
+
+from jose import jwt, JWTError
+from sqlalchemy import select
+
+from config.settings import settings
+from database.database import AsyncSessionLocal
+from models.models import Session as DbSession
+
+logger = logging.getLogger(__name__)
+
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+class TokenError(Exception):
+    """Raised when a self-issued token is malformed, expired or of the wrong type."""
+
+def looks_like_jwt(token: str) -> bool:
+    # Google access tokens are opaque ("ya29.…"); ours have three segments
+    return token.count(".") == 2
+
+def _encode(claims: dict) -> str:
+    return jwt.encode(claims, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def create_access_token(user_id: UUID, email: str, picture: str, session_id: UUID) -> Tuple[str, datetime]:
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    token = _encode({
+        "iss": settings.JWT_ISSUER,
+        "sub": str(user_id),
+        "sid": str(session_id),
+        "type": ACCESS_TOKEN_TYPE,
+        "email": email,
+        "picture": picture,
+        "iat": now,
+        "exp": expires_at,
+    })
+    return token, expires_at
+
+def create_refresh_token(user_id: UUID, session_id: UUID, jti: str, expires_at: datetime) -> str:
+    return _encode({
+        "iss": settings.JWT_ISSUER,
+        "sub": str(user_id),
+        "sid": str(session_id),
+        "jti": jti,
+        "type": REFRESH_TOKEN_TYPE,
+        "iat": datetime.now(timezone.utc),
+        "exp": expires_at,
+    })
+
+def new_refresh_session() -> Tuple[UUID, str, datetime]:
+    """Return a fresh session id, refresh token id and session expiry."""
+    expires_at = datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    return uuid.uuid4(), uuid.uuid4().hex, expires_at
+
+def decode_token(token: str, expected_type: str) -> dict:
+    try:
+        claims = jwt.decode(
+            token,
+            settings.SECRET_KEY,
+            algorithms=[settings.ALGORITHM],
+            issuer=settings.JWT_ISSUER,
+        )
+    except JWTError as e:
+        raise TokenError(str(e))
+    if claims.get("type") != expected_type or "sid" not in claims:
+        raise TokenError("Invalid token type")
+    return claims
+
+class RevocationList:
+    """In-memory mirror of revoked sessions from the ``sessions`` table.
+
+    The auth hot path only checks set membership. Revocations made by this
+    worker apply immediately; those made by other workers are picked up on
+    the next periodic refresh.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._revoked: Set[str] = set()
+        # Local revocations not yet visible in a refresh, with their expiry
+        self._pending: Dict[str, datetime] = {}
+
+    def is_revoked(self, session_id: str) -> bool:
+        return session_id in self._revoked
+
+    def revoke(self, session_id: UUID, expires_at: datetime) -> None:
+        self._revoked.add(str(session_id))
+        self._pending[str(session_id)] = expires_at
+
+    async def refresh(self) -> None:
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as db:
+            result = await db.scalars(
+                select(DbSession.id).where(
+                    DbSession.revoked_at.isnot(None),
+                    DbSession.expires_at > now
+                )
+            )
+            revoked = {str(session_id) for session_id in result}
+        self._pending = {sid: exp for sid, exp in self._pending.items() if exp > now and sid not in revoked}
+        self._revoked = revoked | set(self._pending)
+        logger.debug("Revocation list refreshed. Revoked sessions: %s", len(self._revoked))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Failed to refresh revocation list: %s", e)
+            await asyncio.sleep(self.refresh_interval)
+
+revocation_list = RevocationList(settings.TOKEN_REVOCATION_REFRESH_SECONDS)
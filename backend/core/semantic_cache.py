@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import logging
+import math
+import re
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import AsyncGenerator, Dict, List, Optional, Set
+
+from sqlalchemy import delete, insert, select, update
+
+from config.settings import settings
+from core.model_interface import ModelInterface, client_registry
+from database.database import AsyncSessionLocal
+from models.models import EMBEDDING_DIMENSIONS, ResponseCache, utc_now
+
+logger = logging.getLogger(__name__)
+
+class Embedder(ABC):
+    dimensions: int = EMBEDDING_DIMENSIONS
+
+    @abstractmethod
+    async def embed(self, text: str) -> List[float]:
+        pass
+
+class OpenAIEmbedder(Embedder):
+    def __init__(self, model_name: str, api_key: str):
+        self.model_name = model_name
+        self.api_key = api_key
+
+    def _get_client(self):
+        from openai import AsyncOpenAI
+        return client_registry.get_client(
+            "openai-embeddings", self.model_name, self.api_key,
+            lambda http_client: AsyncOpenAI(api_key=self.api_key, base_url=settings.OPENAI_BASE_URL, http_client=http_client)
+        )
+
+    async def embed(self, text: str) -> List[float]:
+        response = await self._get_client().embeddings.create(
+            model=self.model_name,
+            input=text,
+            dimensions=self.dimensions
+        )
+        return response.data[0].embedding
+
+class HashingEmbedder(Embedder):
+    """Deterministic local embedder (feature hashing over words and bigrams).
+
+    Needs no network and gives identical vectors for identical text, which
+    makes it suitable for tests and offline development.
+    """
+
+    _word_pattern = re.compile(r"\w+")
+
+    async def embed(self, text: str) -> List[float]:
+        words = self._word_pattern.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = [0.0] * self.dimensions
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+def create_embedder() -> Embedder:
+    if settings.SEMANTIC_CACHE_EMBEDDER == "hashing":
+        return HashingEmbedder()
+    if settings.SEMANTIC_CACHE_EMBEDDER == "openai":
+        return OpenAIEmbedder(settings.SEMANTIC_CACHE_EMBEDDING_MODEL, settings.OPENAI_API_KEY)
+    raise ValueError(f"Unsupported embedder: {settings.SEMANTIC_CACHE_EMBEDDER}")
+
+class SemanticCache:
+    """Near-duplicate prompt cache stored in ``response_cache``.
+
+    A hit requires the same model type, model name, temperature and system
+    prompt variant, so tenants with their own prompts never share answers,
+    and a cosine similarity of at least ``threshold`` with an entry younger than
+    ``ttl_seconds``; the nearest neighbour is found through the HNSW index.
+    Expired entries are deleted every ``PRUNE_EVERY`` stores.
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, embedder: Embedder, threshold: float, ttl_seconds: int):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+        self._stores = 0
+
+    async def lookup(self, embedding: List[float], model_type: str, model_name: str, temperature: float, prompt_variant: str) -> Optional[str]:
+        distance = ResponseCache.embedding.cosine_distance(embedding)
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(ResponseCache.id, ResponseCache.response, distance.label("distance"))
+                .where(
+                    ResponseCache.model_type == model_type,
+                    ResponseCache.model_name == model_name,
+                    ResponseCache.temperature == temperature,
+                    ResponseCache.prompt_variant == prompt_variant,
+                    ResponseCache.created_at > utc_now() - timedelta(seconds=self.ttl_seconds)
+                )
+                .order_by(distance)
+                .limit(1)
+            )).first()
+            if row is None or 1 - row.distance < self.threshold:
+                self.misses += 1
+                return None
+            await db.execute(
+                update(ResponseCache)
+                .where(ResponseCache.id == row.id)
+                .values(hit_count=ResponseCache.hit_count + 1, last_hit_at=utc_now())
+            )
+            await db.commit()
+        self.hits += 1
+        logger.info("Semantic cache hit for %s:%s. Similarity: %.4f", model_type, model_name, 1 - row.distance)
+        return row.response
+
+    async def store(self, embedding: List[float], prompt: str, response: str, model_type: str, model_name: str, temperature: float, prompt_variant: str) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(ResponseCache).values(
+                model_type=model_type,
+                model_name=model_name,
+                temperature=temperature,
+                prompt_variant=prompt_variant,
+                prompt=prompt,
+                response=response,
+                embedding=embedding
+            ))
+            await db.commit()
+        self._stores += 1
+        if self._stores % self.PRUNE_EVERY == 0:
+            await self.prune()
+
+    async def prune(self) -> int:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(ResponseCache)
+                .where(ResponseCache.created_at <= utc_now() - timedelta(seconds=self.ttl_seconds))
+            )
+            await db.commit()
+        self.pruned += result.rowcount
+        if result.rowcount:
+            logger.info("Pruned %s expired semantic cache entries", result.rowcount)
+        return result.rowcount
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "pruned": self.pruned}
+
+_replay_pattern = re.compile(r"\s*\S+\s*")
+
+class CachedModel(ModelInterface):
+    """Serves near-duplicate prompts from the semantic cache.
+
+    On a hit the cached answer is replayed in word-sized chunks so callers
+    stream it exactly like a live generation; on a miss the wrapped model
+    streams and its complete answer is stored in the background.
+    """
+
+    _pending_stores: Set[asyncio.Task] = set()
+
+    def __init__(self, model: ModelInterface, cache: SemanticCache):
+        self.model = model
+        self.cache = cache
+        self.model_type = getattr(model, "provider", model.__class__.__name__)
+        self.model_name = getattr(model, "model_name", "")
+        self.temperature = getattr(model, "temperature", 0.0)
+        self._prompt_variant = model.prompt_variant()
+
+    def prompt_variant(self) -> str:
+        return self.model.prompt_variant()
+
+    async def generate(self, content: str, history: Optional[List[Dict[str, str]]] = None) -> AsyncGenerator[str, None]:
+        if history:
+            # Follow-up turns depend on the conversation, not just the prompt
+            async for token in self.model.generate(content, history):
+                yield token
+            return
+
+        embedding = None
+        try:
+            start_time = time.time()
+            embedding = await self.cache.embedder.embed(content)
+            cached = await self.cache.lookup(embedding, self.model_type, self.model_name, self.temperature, self._prompt_variant)
+            logger.debug("Semantic cache lookup took %.3f seconds", time.time() - start_time)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+            cached = None
+
+        if cached is not None:
+            for chunk in _replay_pattern.findall(cached):
+                yield chunk
+            return
+
+        chunks = []
+        async for token in self.model.generate(content):
+            chunks.append(token)
+            yield token
+
+        # Only complete answers reach this point and get cached
+        if embedding is not None and chunks:
+            task = asyncio.create_task(self._store(embedding, content, "".join(chunks)))
+            self._pending_stores.add(task)
+            task.add_done_callback(self._pending_stores.discard)
+
+    async def _store(self, embedding: List[float], prompt: str, response: str) -> None:
+        try:
+            await self.cache.store(embedding, prompt, response, self.model_type, self.model_name, self.temperature, self._prompt_variant)
+        except Exception as e:
+            logger.warning("Failed to store semantic cache entry: %s", e)
+
+semantic_cache: Optional[SemanticCache] = None
+
+def with_semantic_cache(model: ModelInterface) -> ModelInterface:
+    global semantic_cache
+    if not settings.SEMANTIC_CACHE_ENABLED:
+        return model
+    if semantic_cache is None:
+        semantic_cache = SemanticCache(
+            create_embedder(),
+            settings.SEMANTIC_CACHE_SIMILARITY_THRESHOLD,
+            settings.SEMANTIC_CACHE_TTL_SECONDS,
+        )
+    return CachedModel(model, semantic_cache)
+
+def get_semantic_cache_stats() -> Optional[dict]:
+    return semantic_cache.stats() if semantic_cache else None
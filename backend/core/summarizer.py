@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import asc, desc, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.settings import settings
+from core.context import MESSAGE_OVERHEAD_TOKENS, context_builder
+from core.helper.prompt import count_tokens
+from core.model_interface import ModelFactory
+from database.database import AsyncSessionLocal
+from models.models import ConversationSummary, Message
+
+logger = logging.getLogger(__name__)
+
+_SPEAKERS = {"user": "User", "llm": "Assistant"}
+
+class ConversationSummarizer:
+    """Background worker that folds the older turns of long conversations into a rolling summary.
+
+    The context builder schedules a conversation once its unsummarized
+    history passes ``SUMMARY_TRIGGER_TOKENS``; scheduling only records the
+    id. Every ``interval`` seconds the worker takes up to ``batch_size``
+    scheduled conversations and summarizes them with at most
+    ``max_concurrent`` calls to the summary model, so the chat path never
+    waits on a summary. The newest ``keep_recent_tokens`` of each
+    conversation, and at least its latest user message and everything
+    after it, stay verbatim; everything older is merged into the stored
+    summary, at most ``max_input_tokens`` per call, and a conversation with
+    more left over is scheduled again.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        model_type: str,
+        model_name: Optional[str],
+        interval: float,
+        batch_size: int,
+        max_concurrent: int,
+        keep_recent_tokens: int,
+        max_input_tokens: int,
+        max_messages: int,
+    ):
+        self.enabled = enabled
+        self.model_type = model_type
+        self.model_name = model_name
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_concurrent = max_concurrent
+        self.keep_recent_tokens = keep_recent_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_messages = max_messages
+        # Insertion-ordered set of scheduled conversations
+        self._pending: Dict[UUID, None] = {}
+        self._running: Set[UUID] = set()
+        self._worker: Optional[asyncio.Task] = None
+        self.summaries_written = 0
+        self.messages_summarized = 0
+        self.failures = 0
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+            context_builder.on_overflow = self.schedule
+            logger.info("Conversation summarizer started")
+
+    async def stop(self) -> None:
+        context_builder.on_overflow = None
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            logger.info("Conversation summarizer stopped")
+
+    def schedule(self, conversation_id: UUID) -> None:
+        # A running summary reschedules itself if it could not catch up
+        if conversation_id not in self._running:
+            self._pending[conversation_id] = None
+
+    async def _run(self) -> None:
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        while True:
+            await asyncio.sleep(self.interval)
+            batch = list(itertools.islice(self._pending, self.batch_size))
+            for conversation_id in batch:
+                del self._pending[conversation_id]
+            if batch:
+                await asyncio.gather(*(self._summarize_scheduled(conversation_id, semaphore) for conversation_id in batch))
+
+    async def _summarize_scheduled(self, conversation_id: UUID, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            self._running.add(conversation_id)
+            try:
+                behind = await self.summarize(conversation_id)
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Summarizing conversation %s failed: %s", conversation_id, e)
+                return
+            finally:
+                self._running.discard(conversation_id)
+        if behind:
+            self._pending[conversation_id] = None
+
+    async def summarize(self, conversation_id: UUID) -> bool:
+        """Fold the conversation's older unsummarized messages into its summary.
+
+        Returns whether older messages are still left unsummarized.
+        """
+        async with AsyncSessionLocal() as db:
+            summary = await db.get(ConversationSummary, conversation_id)
+            rows, behind = await self._older_messages(db, conversation_id, summary)
+        if not rows:
+            return False
+
+        transcript = "\n\n".join(f"{_SPEAKERS.get(row.role, row.role)}: {row.content or ''}" for row in rows)
+        content = f"Current summary:\n{summary.summary if summary is not None else '(none)'}\n\nNew messages:\n{transcript}"
+        model = ModelFactory.create_model(self.model_type, self.model_name, temperature=0.0)
+        model.prompt_name = "summary"
+        text = "".join([token async for token in model.generate(content)]).strip()
+        if not text:
+            raise RuntimeError("The summary model returned an empty summary")
+
+        last = rows[-1]
+        values = {
+            "conversation_id": conversation_id,
+            "summary": text,
+            "covered_until": last.created_at,
+            "covered_message_id": last.id,
+            "token_count": count_tokens(text),
+            "model_name": getattr(model, "model_name", None),
+            "updated_at": func.now(),
+        }
+        statement = insert(ConversationSummary).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=["conversation_id"],
+            set_={key: statement.excluded[key] for key in values if key != "conversation_id"},
+            # Another worker may have summarized further in the meantime
+            where=tuple_(ConversationSummary.covered_until, ConversationSummary.covered_message_id)
+            < tuple_(statement.excluded.covered_until, statement.excluded.covered_message_id),
+        )
+        async with AsyncSessionLocal() as db:
+            await db.execute(statement)
+            await db.commit()
+
+        context_builder.invalidate(conversation_id)
+        self.summaries_written += 1
+        self.messages_summarized += len(rows)
+        logger.info("Summarized %s messages of conversation %s into %s tokens", len(rows), conversation_id, values["token_count"])
+        return behind
+
+    async def _older_messages(self, db: AsyncSession, conversation_id: UUID, summary: Optional[ConversationSummary]) -> Tuple[List, bool]:
+        """Unsummarized messages older than the recent turns kept verbatim, oldest first."""
+        query = select(Message.id, Message.role, Message.content, Message.created_at).where(Message.conversation_id == conversation_id)
+        if summary is not None:
+            query = query.where(tuple_(Message.created_at, Message.id) > tuple_(summary.covered_until, summary.covered_message_id))
+
+        newest = (await db.execute(query.order_by(desc(Message.created_at), desc(Message.id)).limit(self.max_messages))).all()
+        kept = 0
+        used = 0
+        for row in newest:
+            tokens = count_tokens(row.content or "") + MESSAGE_OVERHEAD_TOKENS
+            if used + tokens > self.keep_recent_tokens:
+                break
+            kept += 1
+            used += tokens
+        # The verbatim turns start with a user message
+        while kept and newest[kept - 1].role != "user":
+            kept -= 1
+        # The latest exchange always stays verbatim, even when it alone is over the budget
+        latest_user = next((index for index, row in enumerate(newest) if row.role == "user"), len(newest) - 1)
+        kept = max(kept, latest_user + 1)
+        if kept == len(newest):
+            return [], False
+
+        boundary = newest[kept]
+        rows = (await db.execute(
+            query
+            .where(tuple_(Message.created_at, Message.id) <= tuple_(boundary.created_at, boundary.id))
+            .order_by(asc(Message.created_at), asc(Message.id))
+            .limit(self.max_messages)
+        )).all()
+        selected = []
+        used = 0
+        for row in rows:
+            tokens = count_tokens(row.content or "") + MESSAGE_OVERHEAD_TOKENS
+            if selected and used + tokens > self.max_input_tokens:
+                break
+            selected.append(row)
+            used += tokens
+        return selected, selected[-1].id != boundary.id
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "running": len(self._running),
+            "summaries_written": self.summaries_written,
+            "messages_summarized": self.messages_summarized,
+            "failures": self.failures,
+        }
+
+conversation_summarizer = ConversationSummarizer(
+    enabled=settings.SUMMARY_ENABLED and settings.CONTEXT_ENABLED,
+    model_type=settings.SUMMARY_MODEL_TYPE,
+    model_name=settings.SUMMARY_MODEL_NAME,
+    interval=settings.SUMMARY_BATCH_INTERVAL_SECONDS,
+    batch_size=settings.SUMMARY_BATCH_SIZE,
+    max_concurrent=settings.SUMMARY_MAX_CONCURRENT,
+    keep_recent_tokens=settings.SUMMARY_KEEP_RECENT_TOKENS,
+    max_input_tokens=settings.SUMMARY_MAX_INPUT_TOKENS,
+    max_messages=settings.CONTEXT_MAX_MESSAGES,
+)
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from config.settings import settings
+from database.database import async_engine
+from models.models import Message, utc_now
+
+logger = logging.getLogger(__name__)
+
+class MessageWriteError(RuntimeError):
+    """Raised when a message could not be queued or persisted."""
+
+class MessageWriter:
+    """Write-behind queue that batches message inserts from many streams.
+
+    Callers enqueue a row and await its acknowledgement; one worker drains
+    the queue into multi-row INSERTs on a dedicated connection and resolves
+    every waiter in the batch only after the transaction commits, so a
+    stream reports success only once its message is durable. The queue is
+    bounded: when it is full, ``write`` waits for room (backpressure) for at
+    most ``enqueue_timeout`` seconds, and it waits at most ``ack_timeout``
+    seconds for the commit. Every dequeued message is resolved, with
+    ``MessageWriteError`` if it could not be stored, even when the worker
+    is cancelled mid-batch. A batch rejected for its data (a constraint or
+    an invalid value) is retried row by row, so only the offending rows
+    fail. An ack timeout also raises ``MessageWriteError``, but the row is
+    still queued and may be committed afterwards.
+    """
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        max_queue: int,
+        batch_size: int,
+        flush_interval: float,
+        enqueue_timeout: float,
+        max_retries: int,
+        ack_timeout: float,
+    ):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.ack_timeout = ack_timeout
+        self._max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._connection: Optional[AsyncConnection] = None
+        self.batches_written = 0
+        self.rows_written = 0
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self._max_queue)
+            self._worker = asyncio.create_task(self._run())
+            logger.info("Message writer started")
+
+    async def stop(self) -> None:
+        # Let queued messages drain before closing the connection
+        if self._worker is not None and not self._worker.done():
+            await self._queue.join()
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        await self._close_connection()
+        logger.info("Message writer stopped")
+
+    async def write(self, conversation_id: UUID, role: str, content: str) -> UUID:
+        self.start()
+        message_id = uuid.uuid4()
+        record = {
+            "id": message_id,
+            "conversation_id": conversation_id,
+            "role": role,
+            "content": content,
+            "created_at": utc_now(),
+        }
+        ack = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._queue.put((record, ack)), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            raise MessageWriteError("Message write queue is full")
+        try:
+            await asyncio.wait_for(ack, timeout=self.ack_timeout)
+        except asyncio.TimeoutError:
+            # The row stays queued and may still be committed later
+            raise MessageWriteError("Timed out waiting for the message to be stored; it may still be stored later")
+        return message_id
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        pass
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                    except asyncio.TimeoutError:
+                        break
+                await self._flush(batch)
+            finally:
+                # Only reached with unresolved acks when the worker is cancelled or crashes
+                self._fail(batch, MessageWriteError("Message writer stopped before the message was stored"))
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        records = [record for record, _ in batch]
+        start_time = time.time()
+        error: Optional[Exception] = None
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                if self._connection is None or self._connection.closed:
+                    self._connection = await self.engine.connect()
+                async with self._connection.begin():
+                    await self._connection.execute(insert(Message), records)
+                self.batches_written += 1
+                self.rows_written += len(records)
+                logger.debug("Stored %s messages in %.3f seconds", len(records), time.time() - start_time)
+                for _, ack in batch:
+                    if not ack.done():
+                        ack.set_result(None)
+                return
+            except (IntegrityError, DataError) as e:
+                # Retrying the same batch would fail again; isolate the rejected rows instead
+                logger.warning("Message batch of %s rejected, storing rows one by one: %s", len(records), e)
+                await self._flush_rows(batch)
+                return
+            except Exception as e:
+                # Opening the connection can also fail with driver or OS errors
+                error = e
+                logger.error("Failed to store message batch of %s (attempt %s): %s", len(records), attempt, e)
+                await self._close_connection()
+                if attempt < self.max_retries:
+                    await asyncio.sleep(0.5 * attempt)
+
+        self._fail(batch, MessageWriteError(f"Failed to store message: {error}"))
+
+    async def _flush_rows(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        for record, ack in batch:
+            try:
+                async with self._connection.begin():
+                    await self._connection.execute(insert(Message), [record])
+            except (IntegrityError, DataError) as e:
+                logger.error("Failed to store message %s: %s", record["id"], e)
+                if not ack.done():
+                    ack.set_exception(MessageWriteError(f"Failed to store message: {e}"))
+                continue
+            except Exception as e:
+                # The connection itself failed; the rest of the batch fails with it
+                logger.error("Failed to store message %s: %s", record["id"], e)
+                await self._close_connection()
+                self._fail(batch, MessageWriteError(f"Failed to store message: {e}"))
+                return
+            self.rows_written += 1
+            if not ack.done():
+                ack.set_result(None)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[dict, asyncio.Future]], error: MessageWriteError) -> None:
+        for _, ack in batch:
+            if not ack.done():
+                ack.set_exception(error)
+
+    async def _close_connection(self) -> None:
+        if self._connection is not None:
+            try:
+                await self._connection.close()
+            except Exception as e:
+                logger.warning("Error closing message writer connection: %s", e)
+            self._connection = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self._max_queue,
+            "batches_written": self.batches_written,
+            "rows_written": self.rows_written,
+        }
+
+message_writer = MessageWriter(
+    engine=async_engine,
+    max_queue=settings.MESSAGE_WRITE_QUEUE_SIZE,
+    batch_size=settings.MESSAGE_WRITE_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_WRITE_FLUSH_INTERVAL,
+    enqueue_timeout=settings.MESSAGE_WRITE_ENQUEUE_TIMEOUT,
+    max_retries=settings.MESSAGE_WRITE_MAX_RETRIES,
+    ack_timeout=settings.MESSAGE_WRITE_ACK_TIMEOUT,
+)
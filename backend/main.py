@@ -1,22 +1,23 @@
-import os
 import logging
-from routers.main import create_app
-from database.database import engine
-from models.models import Base
+from config.settings import settings
+from core.logging_config import setup_logging
+
+# Set up logging before anything else logs
+log_level = settings.LOG_LEVEL.upper()
+setup_logging(log_level, settings.LOG_FORMAT)
 
-# Set up logging
-log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+from routers.main import create_app
 
 logger = logging.getLogger(__name__)
-logger.info(f"Logging level set to {log_level}")
+logger.info("Logging level set to %s", log_level)
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-logger.info("Database tables created")
+# Schema is managed by `alembic upgrade head`; creating it again on every
+# worker start only slows cold starts down
+if settings.DB_CREATE_ALL_ON_STARTUP:
+    from database.database import engine
+    from models.models import Base
+    Base.metadata.create_all(bind=engine)
+    logger.info("Database tables created")
 
 app = create_app()
 app.title = "Backend Recommender"
@@ -26,4 +27,4 @@ logger.info("Application startup complete")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level=log_level.lower())
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_level=log_level.lower(), log_config=None)
\ No newline at end of file
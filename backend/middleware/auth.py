@@ -1,101 +1,270 @@
+import asyncio
+import hashlib
+import json
 import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, asdict
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
 from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from uuid import UUID
 import httpx
-from database.database import get_db
+from sqlalchemy import select
+from config.settings import settings
+from database.database import AsyncSessionLocal
 from models.models import User, Session as DbSession
-from cachetools import TTLCache
-from functools import lru_cache
+from core import metrics
+from core.security import ACCESS_TOKEN_TYPE, TokenError, decode_token, looks_like_jwt, revocation_list
+from cachetools import TLRUCache
 
 logger = logging.getLogger(__name__)
 
-# Create a cache with a 5-minute TTL and a maximum of 1000 items
-token_cache = TTLCache(maxsize=1000, ttl=300)
-
 # List of paths that don't require authentication
 PUBLIC_PATHS = ['/auth/login', '/auth/callback', '/health', '/ping']
 
-async def verify_google_token(token: str):
-    async with httpx.AsyncClient() as client:
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """Detached snapshot of the authenticated user stored on ``request.state.user``."""
+    id: UUID
+    email: str
+    picture: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "id": str(self.id)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AuthenticatedUser":
+        return cls(id=UUID(data["id"]), email=data["email"], picture=data.get("picture"))
+
+    @classmethod
+    def from_model(cls, user: User) -> "AuthenticatedUser":
+        return cls(id=user.id, email=user.email, picture=user.picture)
+
+class TokenCacheBackend(ABC):
+    """Stores verification results keyed by a hash of the bearer token.
+
+    Entries are ``{"user": {...}}`` for valid tokens and ``{"error": "..."}``
+    for rejected ones, each with its own TTL.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        pass
+
+class InMemoryTokenCache(TokenCacheBackend):
+    """Per-process cache; the default backend and the stand-in for tests."""
+
+    def __init__(self, maxsize: int):
+        self._cache = TLRUCache(maxsize=maxsize, ttu=lambda key, entry, now: now + entry[1])
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._cache.get(key)
+        return entry[0] if entry else None
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        self._cache[key] = (value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key, None)
+
+class RedisTokenCache(TokenCacheBackend):
+    """Cache shared by every worker. Backend errors degrade to cache misses."""
+
+    def __init__(self, url: str, prefix: str = "auth:token:"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[dict]:
         try:
-            response = await client.get(
-                "https://www.googleapis.com/oauth2/v3/tokeninfo",
-                params={"access_token": token}
-            )
-            if response.status_code == 200:
-                token_info = response.json()
-                return token_info
-            logger.warning(f"Google token verification failed. Response: {response.text}")
-            return None
+            raw = await self._redis.get(self._prefix + key)
         except Exception as e:
-            logger.error(f"Error verifying Google token: {str(e)}")
+            logger.warning("Token cache read failed: %s", e)
             return None
+        return json.loads(raw) if raw else None
 
-@lru_cache(maxsize=1)
-def get_db_session():
-    return next(get_db())
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        try:
+            await self._redis.set(self._prefix + key, json.dumps(value), px=max(int(ttl * 1000), 1))
+        except Exception as e:
+            logger.warning("Token cache write failed: %s", e)
 
-async def verify_token(token: str):
-    logger.info(f"Verifying token: {token[:10]}...")  # Log first 10 characters of token
-    # Check if the token is in the cache
-    cached_user = token_cache.get(token)
-    if cached_user:
-        return cached_user, None
+    async def delete(self, key: str) -> None:
+        try:
+            await self._redis.delete(self._prefix + key)
+        except Exception as e:
+            logger.warning("Token cache delete failed: %s", e)
 
-    db = get_db_session()
-    try:
-        # Verify the token with Google
-        token_info = await verify_google_token(token)
-        if token_info is None:
-            logger.warning("Token verification with Google failed")
-            return None, "Invalid Google token"
+def create_token_cache() -> TokenCacheBackend:
+    if settings.TOKEN_CACHE_BACKEND == "redis":
+        if not settings.TOKEN_CACHE_REDIS_URL:
+            raise ValueError("TOKEN_CACHE_REDIS_URL must be set when TOKEN_CACHE_BACKEND is 'redis'")
+        return RedisTokenCache(settings.TOKEN_CACHE_REDIS_URL)
+    return InMemoryTokenCache(maxsize=settings.TOKEN_CACHE_MAXSIZE)
+
+token_cache = create_token_cache()
+
+# Verifications currently running, keyed like the cache, so concurrent
+# requests carrying the same token share one Google round trip.
+_inflight_verifications: Dict[str, asyncio.Future] = {}
+
+_google_client: Optional[httpx.AsyncClient] = None
+
+def _get_google_client() -> httpx.AsyncClient:
+    global _google_client
+    if _google_client is None or _google_client.is_closed:
+        _google_client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=5.0))
+    return _google_client
+
+async def close_auth_clients() -> None:
+    if _google_client is not None:
+        await _google_client.aclose()
+
+def token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+async def verify_google_token(token: str):
+    """Return Google's token info, or None if Google rejects the token.
+
+    Network failures and 5xx responses raise, so they are never mistaken for
+    an invalid token and negatively cached.
+    """
+    response = await _get_google_client().get(
+        "https://www.googleapis.com/oauth2/v3/tokeninfo",
+        params={"access_token": token}
+    )
+    if response.status_code == 200:
+        return response.json()
+    if response.status_code >= 500:
+        response.raise_for_status()
+    logger.warning("Google token verification failed. Response: %s", response.text)
+    return None
+
+async def _verify_uncached(token: str) -> Tuple[Optional[AuthenticatedUser], Optional[str], float]:
+    """Verify ``token`` against Google and the database.
+
+    Returns ``(user, error, ttl)`` where ``ttl`` is how long the outcome may be
+    cached; internal errors propagate and are not cached.
+    """
+    negative_ttl = settings.TOKEN_NEGATIVE_CACHE_TTL
 
+    # Verify the token with Google
+    token_info = await verify_google_token(token)
+    if token_info is None:
+        logger.warning("Token verification with Google failed")
+        return None, "Invalid Google token", negative_ttl
+
+    async with AsyncSessionLocal() as db:
         # Check if the token exists in our database
-        db_session = db.query(DbSession).filter(DbSession.access_token == token).first()
+        db_session = await db.scalar(select(DbSession).where(DbSession.access_token == token))
         if db_session is None:
             logger.warning("Token not found in database")
-            return None, "Token not found in database"
+            return None, "Token not found in database", negative_ttl
 
         # Check if the token has expired
-        if db_session.expires_at < datetime.now(timezone.utc):
-            logger.warning(f"Token has expired. Expiry: {db_session.expires_at}")
-            db.delete(db_session)
-            db.commit()
-            return None, "Token has expired"
+        now = datetime.now(timezone.utc)
+        if db_session.expires_at < now:
+            logger.warning("Token has expired. Expiry: %s", db_session.expires_at)
+            await db.delete(db_session)
+            await db.commit()
+            return None, "Token has expired", negative_ttl
 
         # Get the user associated with this session
-        user = db.query(User).filter(User.id == db_session.user_id).first()
+        user = await db.get(User, db_session.user_id)
         if user is None:
-            logger.warning(f"User not found for session id: {db_session.id}")
-            return None, "User not found"
+            logger.warning("User not found for session id: %s", db_session.id)
+            return None, "User not found", negative_ttl
+
+    # Never cache a token beyond the session's or Google's own expiry
+    ttl = min(float(settings.TOKEN_CACHE_TTL), (db_session.expires_at - now).total_seconds())
+    if "expires_in" in token_info:
+        ttl = min(ttl, float(token_info["expires_in"]))
+    return AuthenticatedUser.from_model(user), None, ttl
 
-        # Cache the user object
-        token_cache[token] = user
-        return user, None
+async def _verify_and_cache(token: str, key: str) -> Tuple[Optional[AuthenticatedUser], Optional[str]]:
+    try:
+        user, error, ttl = await _verify_uncached(token)
     except Exception as e:
-        logger.error(f"Error in verify_token: {str(e)}")
+        logger.error("Error in verify_token: %s", e)
         return None, f"Internal server error: {str(e)}"
 
+    if ttl > 0:
+        entry = {"user": user.to_dict()} if user else {"error": error}
+        await token_cache.set(key, entry, ttl)
+    return user, error
+
+async def verify_token(token: str):
+    logger.debug("Verifying token: %s...", token[:10])  # Log first 10 characters of token
+    key = token_cache_key(token)
+
+    # Check if the token (or its rejection) is in the cache
+    entry = await token_cache.get(key)
+    if entry:
+        if "error" in entry:
+            metrics.auth_token_cache.labels("negative_hit").inc()
+            return None, entry["error"]
+        metrics.auth_token_cache.labels("hit").inc()
+        return AuthenticatedUser.from_dict(entry["user"]), None
+    metrics.auth_token_cache.labels("miss").inc()
+
+    verification = _inflight_verifications.get(key)
+    if verification is None:
+        verification = asyncio.ensure_future(_verify_and_cache(token, key))
+        _inflight_verifications[key] = verification
+        verification.add_done_callback(lambda _: _inflight_verifications.pop(key, None))
+    # Shielded so one caller disconnecting does not cancel the others' result
+    return await asyncio.shield(verification)
+
+async def invalidate_token(token: str) -> None:
+    await token_cache.delete(token_cache_key(token))
+
+def verify_session_token(token: str):
+    """Verify one of our own access tokens with CPU work only."""
+    try:
+        claims = decode_token(token, ACCESS_TOKEN_TYPE)
+    except TokenError as e:
+        return None, f"Invalid token: {str(e)}"
+    if revocation_list.is_revoked(claims["sid"]):
+        return None, "Session has been revoked"
+    return AuthenticatedUser(id=UUID(claims["sub"]), email=claims["email"], picture=claims.get("picture")), None
+
+async def authenticate_token(token: str):
+    if looks_like_jwt(token):
+        metrics.auth_verifications.labels("jwt").inc()
+        return verify_session_token(token)
+    # Raw Google access tokens issued before self-issued sessions
+    metrics.auth_verifications.labels("google").inc()
+    return await verify_token(token)
+
 async def auth_middleware(request: Request, call_next):
 
     # Check if the path requires authentication
     if request.url.path in PUBLIC_PATHS:
-        logger.info(f"Skipping authentication for public path: {request.url.path}")
+        logger.debug("Skipping authentication for public path: %s", request.url.path)
         return await call_next(request)
 
     try:
         auth_header = request.headers.get('Authorization')
-        logger.info(f"Authorization header: {auth_header[:15]}..." if auth_header else "No Authorization header")
+        logger.debug("Authorization header present: %s", bool(auth_header))
         
         if auth_header and auth_header.startswith('Bearer '):
             token = auth_header.split(' ')[1]
-            user, error = await verify_token(token)
+            user, error = await authenticate_token(token)
             if user is None:
-                logger.warning(f"Authentication failed: {error}")
+                logger.warning("Authentication failed: %s", error)
                 return JSONResponse(status_code=401, content={"detail": f"Invalid authentication credentials: {error}"})
             request.state.user = user
-            logger.info(f"User authenticated: {user.email}")
+            logger.info("User authenticated: %s", user.email)
         else:
             logger.warning("No valid Authorization header provided")
             return JSONResponse(status_code=401, content={"detail": "No valid Authorization header provided"})
@@ -104,12 +273,12 @@ async def auth_middleware(request: Request, call_next):
         x_http_method = request.headers.get('X-HTTP-Method')
         if x_http_method:
             request.state.custom_method = x_http_method.upper()
-            logger.info(f"Custom method stored in request state: {x_http_method}")
+            logger.info("Custom method stored in request state: %s", x_http_method)
 
         response = await call_next(request)
-        logger.info(f"Request completed. Status code: {response.status_code}")
+        logger.debug("Request completed. Status code: %s", response.status_code)
         return response
 
     except Exception as e:
-        logger.error(f"Error in auth_middleware: {str(e)}")
+        logger.error("Error in auth_middleware: %s", e)
         return JSONResponse(status_code=500, content={"detail": f"Internal server error: {str(e)}"})
@@ -1,9 +1,13 @@
 from .ping import router as ping_router
 from .health import router as health_router
 from .chat.chat import router as chat_router
+from .chat.generations import router as generations_router
+from .chat.ws import router as ws_router
 
 routers = [
     ping_router,
     health_router,
-    chat_router
+    chat_router,
+    generations_router,
+    ws_router
 ]
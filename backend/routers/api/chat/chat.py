@@ -3,20 +3,25 @@ import time
 import math
 from fastapi import APIRouter, HTTPException, Depends, Request, Query
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from models.models import Conversation, Message
-from database.database import get_db
+from models.models import Conversation, Message, User
+from database.database import get_async_db
+from config.settings import settings
 import traceback
-from typing import List
+from typing import List, Optional
 from uuid import UUID
-from sqlalchemy import desc, func, asc
+from sqlalchemy import desc, asc, select, tuple_
 
 from .chat_models import (
     ChatRequest, MessageResponse, ConversationResponse, 
-    ConversationsListResponse, ConversationCreate, MessagesListResponse
+    ConversationsListResponse, ConversationCreate, MessagesListResponse, SearchResponse, SearchResult
+)
+from .chat_utils import (
+    start_chat_generation, stream_generation_frames, event_stream_response, create_conversation_record,
+    encode_cursor, decode_cursor, get_owned_conversation, stream_messages_ndjson,
+    encode_search_cursor, decode_search_cursor, build_search_query
 )
-from .chat_utils import stream_generator, create_model_for_conversation
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -24,32 +29,47 @@ logger = logging.getLogger(__name__)
 @router.get('/conversations', response_model=ConversationsListResponse)
 async def get_conversations(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     page: int = Query(1, ge=1, description="Page number, starting from 1"),
-    per_page: int = Query(10, ge=1, le=50, description="Number of items per page")
+    per_page: int = Query(10, ge=1, le=50, description="Number of items per page"),
+    after: Optional[str] = Query(None, description="Opaque cursor from a previous next_cursor; takes precedence over page")
 ):
     start_time = time.time()
     user = request.state.user
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    logger.info(f"GET /conversations - User ID: {user.id} - Page: {page}")
+    logger.info("GET /conversations - User ID: %s - Page: %s", user.id, page)
+
+    if after:
+        try:
+            after_created_at, after_id = decode_cursor(after)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
     
     try:
-        offset = (page - 1) * per_page
-        
-        total_count = db.query(func.count(Conversation.id))\
-            .filter(Conversation.user_id == user.id)\
-            .scalar()
+        total_count = await db.scalar(
+            select(User.conversation_count).where(User.id == user.id)
+        ) or 0
         
         total_pages = math.ceil(total_count / per_page)
         
-        conversations = db.query(Conversation)\
-            .filter(Conversation.user_id == user.id)\
-            .order_by(desc(Conversation.created_at))\
-            .offset(offset)\
-            .limit(per_page)\
-            .all()
+        # Fetch one extra row to know whether another page exists
+        query = select(Conversation)\
+            .where(Conversation.user_id == user.id)\
+            .order_by(desc(Conversation.created_at), desc(Conversation.id))\
+            .limit(per_page + 1)
+        if after:
+            query = query.where(
+                tuple_(Conversation.created_at, Conversation.id) < tuple_(after_created_at, after_id)
+            )
+        else:
+            query = query.offset((page - 1) * per_page)
+
+        conversations = (await db.scalars(query)).all()
+        has_more = len(conversations) > per_page
+        conversations = conversations[:per_page]
+        next_cursor = encode_cursor(conversations[-1].created_at, conversations[-1].id) if has_more else None
         
         response_conversations = [
             ConversationResponse(
@@ -60,8 +80,7 @@ async def get_conversations(
         ]
         
         logger.info(
-            f"Retrieved {len(response_conversations)} conversations for user {user.id}. "
-            f"Page: {page}, Total pages: {total_pages}"
+            "Retrieved %s conversations for user %s. Page: %s, Total pages: %s", len(response_conversations), user.id, page, total_pages
         )
         
         return ConversationsListResponse(
@@ -69,53 +88,136 @@ async def get_conversations(
             page=page,
             total_pages=total_pages,
             total_count=total_count,
-            per_page=per_page
+            per_page=per_page,
+            next_cursor=next_cursor
         )
         
     except SQLAlchemyError as e:
-        logger.error(f"Database error in get_conversations: {str(e)}")
+        logger.error("Database error in get_conversations: %s", e)
+        raise HTTPException(status_code=500, detail="A database error occurred")
+    except Exception as e:
+        logger.error("Unexpected error in get_conversations: %s", e)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+@router.get('/search', response_model=SearchResponse)
+async def search(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200, description="Search terms; supports \"quoted phrases\", OR and -exclusions"),
+    db: AsyncSession = Depends(get_async_db),
+    per_page: int = Query(20, ge=1, le=50, description="Number of results per page"),
+    after: Optional[str] = Query(None, description="Opaque cursor from a previous next_cursor")
+):
+    start_time = time.time()
+    user = request.state.user
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    cursor = None
+    if after:
+        try:
+            cursor = decode_search_cursor(after)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
+
+    try:
+        # Fetch one extra row to know whether another page exists
+        rows = (await db.execute(build_search_query(user.id, q, per_page + 1, cursor))).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        next_cursor = encode_search_cursor(rows[-1].rank, rows[-1].created_at, rows[-1].hit_id) if has_more else None
+
+        results = [
+            SearchResult(
+                kind=row.kind,
+                conversation_id=row.conversation_id,
+                conversation_title=row.title,
+                message_id=row.hit_id if row.kind == "message" else None,
+                role=row.role,
+                snippet=row.snippet,
+                rank=row.rank,
+                created_at=row.created_at.isoformat()
+            ) for row in rows
+        ]
+
+        logger.info("Search for user %s returned %s results", user.id, len(results))
+
+        return SearchResponse(
+            results=results,
+            per_page=per_page,
+            next_cursor=next_cursor,
+            has_more=has_more
+        )
+
+    except SQLAlchemyError as e:
+        logger.error("Database error in search: %s", e)
         raise HTTPException(status_code=500, detail="A database error occurred")
     except Exception as e:
-        logger.error(f"Unexpected error in get_conversations: {str(e)}")
+        logger.error("Unexpected error in search: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
+    finally:
+        logger.info("Total processing time for search: %.2f seconds", time.time() - start_time)
 
 @router.get('/messages/{conversation_id}', response_model=MessagesListResponse)
 async def get_messages(
     conversation_id: UUID,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    limit: Optional[int] = Query(None, ge=1, le=200, description="Return the newest messages in windows of this size"),
+    before: Optional[str] = Query(None, description="Opaque cursor from a previous next_cursor, for older messages")
 ):
     start_time = time.time()
     user = request.state.user
-    logger.info(f"Fetching all messages for conversation: {conversation_id}")
+    windowed = limit is not None or before is not None
+    logger.info("Fetching %s messages for conversation: %s", 'a window of' if windowed else 'all', conversation_id)
+
+    if before:
+        try:
+            before_created_at, before_id = decode_cursor(before)
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=str(ve))
     
     try:
         # Verify conversation belongs to user
-        conversation = db.query(Conversation).filter(
-            Conversation.id == conversation_id,
-            Conversation.user_id == user.id
-        ).first()
+        conversation = await get_owned_conversation(db, conversation_id, user.id)
         if not conversation:
-            logger.error(f"Conversation not found: {conversation_id}")
+            logger.error("Conversation not found: %s", conversation_id)
             raise HTTPException(status_code=404, detail="Conversation not found")
 
-        # Query all messages with chronological ordering (oldest to newest)
-        messages = db.query(Message)\
-            .filter(Message.conversation_id == conversation_id)\
-            .order_by(asc(Message.created_at))\
-            .all()
+        query = select(Message.id, Message.role, Message.content, Message.created_at)\
+            .where(Message.conversation_id == conversation_id)
+
+        if windowed:
+            # Newest-first window, returned oldest to newest for display
+            per_page = limit or 50
+            query = query.order_by(desc(Message.created_at), desc(Message.id)).limit(per_page + 1)
+            if before:
+                query = query.where(tuple_(Message.created_at, Message.id) < tuple_(before_created_at, before_id))
+            rows = (await db.execute(query)).all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page][::-1]
+            next_cursor = encode_cursor(rows[0].created_at, rows[0].id) if has_more else None
+        else:
+            # Query all messages with chronological ordering (oldest to newest)
+            rows = (await db.execute(query.order_by(asc(Message.created_at), asc(Message.id)))).all()
 
         response_messages = [
             MessageResponse(
-                id=msg.id,
-                role=msg.role,
-                content=msg.content,
-                created_at=msg.created_at.isoformat()
-            ) for msg in messages
+                id=row.id,
+                role=row.role,
+                content=row.content,
+                created_at=row.created_at.isoformat()
+            ) for row in rows
         ]
 
-        logger.info(f"Retrieved {len(response_messages)} messages for conversation {conversation_id}")
+        logger.info("Retrieved %s messages for conversation %s", len(response_messages), conversation_id)
 
+        if windowed:
+            return MessagesListResponse(
+                messages=response_messages,
+                per_page=per_page,
+                next_cursor=next_cursor,
+                has_more=has_more
+            )
         return MessagesListResponse(
             messages=response_messages,
             page=1,
@@ -124,39 +226,59 @@ async def get_messages(
             per_page=len(response_messages)
         )
 
+    except HTTPException:
+        raise
     except SQLAlchemyError as e:
-        logger.error(f"Database error: {str(e)}")
+        logger.error("Database error: %s", e)
         raise HTTPException(status_code=500, detail="Database error occurred")
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
     finally:
         total_time = time.time() - start_time
-        logger.info(f"Total processing time for get_messages: {total_time:.2f} seconds")
+        logger.info("Total processing time for get_messages: %.2f seconds", total_time)
+
+@router.get('/messages/{conversation_id}/stream')
+async def stream_messages(
+    conversation_id: UUID,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+) -> StreamingResponse:
+    user = request.state.user
+    logger.info("Streaming messages for conversation: %s", conversation_id)
+
+    try:
+        conversation = await get_owned_conversation(db, conversation_id, user.id)
+    except SQLAlchemyError as e:
+        logger.error("Database error: %s", e)
+        raise HTTPException(status_code=500, detail="Database error occurred")
+    if not conversation:
+        logger.error("Conversation not found: %s", conversation_id)
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    return StreamingResponse(
+        stream_messages_ndjson(conversation_id),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.post('/conversations', response_model=ConversationResponse)
 async def create_conversation(
     conversation: ConversationCreate,
     request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     start_time = time.time()
     user = request.state.user
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    logger.info(f"POST /conversations - User ID: {user.id}")
+    logger.info("POST /conversations - User ID: %s", user.id)
     
     try:
-        new_conversation = Conversation(
-            user_id=user.id,
-            title=conversation.title
-        )
-        db.add(new_conversation)
-        db.commit()
-        db.refresh(new_conversation)
+        new_conversation = await create_conversation_record(db, user.id, conversation.title)
         
-        logger.info(f"Created new conversation: {new_conversation.id}")
+        logger.info("Created new conversation: %s", new_conversation.id)
         
         return ConversationResponse(
             id=new_conversation.id,
@@ -164,91 +286,55 @@ async def create_conversation(
             created_at=new_conversation.created_at.isoformat()
         )
     except SQLAlchemyError as e:
-        db.rollback()
-        logger.error(f"Database error in create_conversation: {str(e)}")
+        await db.rollback()
+        logger.error("Database error in create_conversation: %s", e)
         raise HTTPException(status_code=500, detail="A database error occurred")
     except Exception as e:
-        logger.error(f"Unexpected error in create_conversation: {str(e)}")
+        logger.error("Unexpected error in create_conversation: %s", e)
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
     finally:
         total_time = time.time() - start_time
-        logger.info(f"Total processing time for create_conversation: {total_time:.2f} seconds")
+        logger.info("Total processing time for create_conversation: %.2f seconds", total_time)
 
 @router.post('/streaming/ask')
-async def streaming_ask(request: Request, db: Session = Depends(get_db)) -> StreamingResponse:
+async def streaming_ask(request: Request, db: AsyncSession = Depends(get_async_db)) -> StreamingResponse:
     start_time = time.time()
     user = request.state.user
-    logger.info(f"Streaming ask request received for user: {user.email}")
+    logger.info("Streaming ask request received for user: %s", user.email)
     
     try:
         raw_data = await request.json()
-        logger.debug(f"Raw request data: {raw_data}")
+        logger.debug("Raw request data: %s", raw_data)
         
         try:
             data = ChatRequest(**raw_data)
         except ValueError as ve:
-            logger.error(f"Validation error: {str(ve)}")
+            logger.error("Validation error: %s", ve)
             raise HTTPException(status_code=422, detail=str(ve))
 
         try:
-            if not data.conversation_id:
-                new_conversation = Conversation(
-                    user_id=user.id, 
-                    title=data.message[:50]
-                )
-                db.add(new_conversation)
-                db.commit()
-                db.refresh(new_conversation)
-                data.conversation_id = new_conversation.id
-                logger.info(f"Created new conversation: {data.conversation_id}")
-            else:
-                conversation = db.query(Conversation).filter(
-                    Conversation.id == data.conversation_id,
-                    Conversation.user_id == user.id
-                ).first()
-                if not conversation:
-                    logger.error(f"Conversation not found: {data.conversation_id}")
-                    raise HTTPException(status_code=404, detail="Conversation not found")
-
-            new_message = Message(
-                conversation_id=data.conversation_id,
-                role="user",
-                content=data.message
-            )
-            db.add(new_message)
-            db.commit()
-            logger.info(f"Stored user message in conversation: {data.conversation_id}")
+            stream = await start_chat_generation(db, user, data, "/api/streaming/ask", abandon_grace=settings.SSE_RESUME_GRACE_SECONDS)
 
             setup_time = time.time() - start_time
-            logger.info(f"Setup time before streaming: {setup_time:.2f} seconds")
-
-            model = create_model_for_conversation(data.conversation_id, data.model_type, data.model_name, data.temperature)
-
-            return StreamingResponse(
-                stream_generator(model, data.conversation_id, data.message, request, db),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "Content-Type": "text/event-stream",
-                    "X-Accel-Buffering": "no",
-                    "Access-Control-Allow-Origin": "*",
-                }
-            )
+            logger.info("Setup time before streaming: %.2f seconds", setup_time)
+
+            return event_stream_response(stream, stream_generation_frames(stream, 0, request))
 
         except SQLAlchemyError as e:
-            logger.error(f"Database error during conversation handling: {str(e)}")
-            db.rollback()
+            logger.error("Database error during conversation handling: %s", e)
+            await db.rollback()
             raise HTTPException(status_code=500, detail="Database error occurred")
 
+    except HTTPException:
+        raise
     except ValueError as ve:
-        logger.error(f"Invalid request data: {str(ve)}")
+        logger.error("Invalid request data: %s", ve)
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}\n{traceback.format_exc()}")
+        logger.error("Unexpected error: %s\n%s", e, traceback.format_exc())
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
     finally:
         total_time = time.time() - start_time
-        logger.info(f"Total processing time for streaming_ask: {total_time:.2f} seconds")
+        logger.info("Total processing time for streaming_ask: %.2f seconds", total_time)
 
 logger.info("Chat router initialized")
@@ -29,10 +29,39 @@ class ConversationsListResponse(BaseModel):
     total_pages: int
     total_count: int
     per_page: int
+    next_cursor: Optional[str] = None
 
 class MessagesListResponse(BaseModel):
     messages: List[MessageResponse]
-    page: int
-    total_pages: int
-    total_count: int
+    page: Optional[int] = None
+    total_pages: Optional[int] = None
+    total_count: Optional[int] = None
     per_page: int
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+class SearchResult(BaseModel):
+    kind: str  # "conversation" for title matches, "message" for message matches
+    conversation_id: UUID4
+    conversation_title: Optional[str] = None
+    message_id: Optional[UUID4] = None
+    role: Optional[str] = None
+    snippet: str
+    rank: float
+    created_at: str
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+    per_page: int
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+class GenerationResponse(BaseModel):
+    generation_id: str
+    conversation_id: UUID4
+    status: str
+    error: Optional[str] = None
+    frames: int
+    subscribers: int
+    created_at: str
+    finished_at: Optional[str] = None
@@ -1,96 +1,406 @@
 import logging
 import json
 import asyncio
+import base64
+import binascii
 import time
-from typing import AsyncGenerator, Dict
+from datetime import datetime
+from typing import AsyncGenerator, Awaitable, Dict, List, Optional, Tuple, TypeVar
 from uuid import UUID
-from sqlalchemy.orm import Session
+from sqlalchemy import Float, Select, and_, asc, cast, desc, func, literal, null, select, tuple_, union_all, update
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from config.settings import settings
+from core import metrics
+from core.broadcast import ReplayUnavailableError
+from core.generation import (
+    ABANDONED, CANCELLED, FAILED, GenerationCapacityError, GenerationStream, generation_registry
+)
+from core.context import context_budget, context_builder
 from core.model_interface import ModelFactory, ModelInterface
-from models.models import Message
+from core.scheduler import Grant, RateLimitedError, estimate_tokens, generation_scheduler
+from core.semantic_cache import with_semantic_cache
+from database.database import AsyncSessionLocal
+from database.message_writer import MessageWriteError, message_writer
+from models.models import SEARCH_CONFIG, Conversation, Message, User
 from fastapi import Request, HTTPException
+from fastapi.responses import StreamingResponse
+from middleware.auth import AuthenticatedUser
+from .chat_models import ChatRequest
+from .sse import DISCONNECTED_FRAME, DONE_FRAME, DisconnectWatcher, coalesce_tokens, data_frame, error_frame, queue_frame
 
 logger = logging.getLogger(__name__)
 
-def create_model_for_conversation(conversation_id: UUID, model_type: str, model_name: str, temperature: float) -> ModelInterface:
+T = TypeVar("T")
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def encode_search_cursor(rank: float, created_at: datetime, row_id: UUID) -> str:
+    raw = f"{rank!r}|{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str) -> Tuple[float, datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        rank, created_at, row_id = raw.split("|", 2)
+        return float(rank), datetime.fromisoformat(created_at), UUID(row_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def build_search_query(user_id: UUID, terms: str, limit: int, after: Optional[Tuple[float, datetime, UUID]] = None) -> Select:
+    """Ranked title and message matches in the user's conversations.
+
+    Both sides are matched through their GIN-indexed ``search_vector`` and
+    ordered by rank, then newest first, with ``(rank, created_at, id)`` as
+    the keyset. Snippets are only highlighted for the rows of the page.
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+    conversation_hits = select(
+        literal("conversation").label("kind"),
+        Conversation.id.label("hit_id"),
+        Conversation.id.label("conversation_id"),
+        null().label("role"),
+        Conversation.created_at.label("created_at"),
+        cast(func.ts_rank_cd(Conversation.search_vector, tsquery), Float).label("rank"),
+    ).where(
+        Conversation.user_id == user_id,
+        Conversation.search_vector.op("@@")(tsquery),
+    )
+    message_hits = select(
+        literal("message").label("kind"),
+        Message.id.label("hit_id"),
+        Message.conversation_id.label("conversation_id"),
+        Message.role.label("role"),
+        Message.created_at.label("created_at"),
+        cast(func.ts_rank_cd(Message.search_vector, tsquery), Float).label("rank"),
+    ).join(Conversation, Conversation.id == Message.conversation_id).where(
+        Conversation.user_id == user_id,
+        Message.search_vector.op("@@")(tsquery),
+    )
+    hits = union_all(conversation_hits, message_hits).subquery()
+
+    page = select(hits)
+    if after:
+        page = page.where(tuple_(hits.c.rank, hits.c.created_at, hits.c.hit_id) < tuple_(*after))
+    page = page.order_by(desc(hits.c.rank), desc(hits.c.created_at), desc(hits.c.hit_id)).limit(limit).subquery()
+
+    matched_text = func.coalesce(Message.content, Conversation.title, "")
+    return (
+        select(
+            page,
+            Conversation.title.label("title"),
+            func.ts_headline(SEARCH_CONFIG, matched_text, tsquery, settings.SEARCH_HEADLINE_OPTIONS).label("snippet"),
+        )
+        .join(Conversation, Conversation.id == page.c.conversation_id)
+        .outerjoin(Message, and_(page.c.kind == "message", Message.id == page.c.hit_id))
+        .order_by(desc(page.c.rank), desc(page.c.created_at), desc(page.c.hit_id))
+    )
+
+async def get_owned_conversation(db: AsyncSession, conversation_id: UUID, user_id: UUID) -> Optional[Conversation]:
+    return await db.scalar(
+        select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
+        )
+    )
+
+async def stream_messages_ndjson(conversation_id: UUID) -> AsyncGenerator[str, None]:
+    # Server-side cursor: rows are fetched and serialized one batch at a time,
+    # so memory stays flat however long the conversation is.
+    query = select(Message.id, Message.role, Message.content, Message.created_at)\
+        .where(Message.conversation_id == conversation_id)\
+        .order_by(asc(Message.created_at), asc(Message.id))\
+        .execution_options(yield_per=settings.MESSAGE_STREAM_BATCH_SIZE)
+    start_time = time.time()
+    row_count = 0
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query)
+            async for rows in result.partitions():
+                row_count += len(rows)
+                yield "".join(
+                    json.dumps({
+                        "id": str(row.id),
+                        "role": row.role,
+                        "content": row.content,
+                        "created_at": row.created_at.isoformat()
+                    }) + "\n"
+                    for row in rows
+                )
+    except SQLAlchemyError as e:
+        logger.error("Database error while streaming messages for conversation %s: %s", conversation_id, e)
+        yield json.dumps({"error": "Database error occurred"}) + "\n"
+    logger.info("Streamed %s messages for conversation %s in %.2f seconds", row_count, conversation_id, time.time() - start_time)
+
+async def create_conversation_record(db: AsyncSession, user_id: UUID, title: str) -> Conversation:
+    # Keeps users.conversation_count in step within the same transaction
+    conversation = Conversation(user_id=user_id, title=title)
+    db.add(conversation)
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(conversation_count=User.conversation_count + 1)
+    )
+    await db.commit()
+    return conversation
+
+def create_model_for_conversation(
+    conversation_id: UUID,
+    model_type: str,
+    model_name: str,
+    temperature: float,
+    tenant: Optional[str] = None
+) -> ModelInterface:
     start_time = time.time()
     try:
-        model = ModelFactory.create_model(model_type, model_name, temperature)
+        model = with_semantic_cache(ModelFactory.create_model(model_type, model_name, temperature, tenant))
         creation_time = time.time() - start_time
-        logger.info(f"Model created successfully for conversation {conversation_id}. Type: {model_type}, Name: {model_name}. Creation time: {creation_time:.2f} seconds")
+        logger.info("Model created successfully for conversation %s. Type: %s, Name: %s. Creation time: %.2f seconds", conversation_id, model_type, model_name, creation_time)
         return model
     except Exception as e:
-        logger.error(f"Error creating model for conversation {conversation_id}: {str(e)}. Time taken: {time.time() - start_time:.2f} seconds")
+        logger.error("Error creating model for conversation %s: %s. Time taken: %.2f seconds", conversation_id, e, time.time() - start_time)
         raise HTTPException(status_code=500, detail=f"Error creating model: {str(e)}")
 
-async def store_message(db: Session, conversation_id: UUID, role: str, content: str) -> bool:
-    max_retries = 3
-    retry_count = 0
+async def store_message(conversation_id: UUID, role: str, content: str) -> bool:
+    # Batched by the write-behind queue; returns once the row is committed.
     start_time = time.time()
-    
-    while retry_count < max_retries:
-        try:
-            new_message = Message(
-                conversation_id=conversation_id,
-                role=role,
-                content=content
-            )
-            db.add(new_message)
-            db.commit()
-            storage_time = time.time() - start_time
-            logger.info(f"Stored {role} message in conversation: {conversation_id}. Storage time: {storage_time:.2f} seconds")
-            return True
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to store message (attempt {retry_count + 1}): {str(e)}. Time elapsed: {time.time() - start_time:.2f} seconds")
-            db.rollback()
-            retry_count += 1
-            if retry_count < max_retries:
-                await asyncio.sleep(0.5)  # Wait before retrying
-    
-    logger.error(f"Failed to store message after {max_retries} attempts. Total time: {time.time() - start_time:.2f} seconds")
-    return False
-
-async def stream_generator(
+    try:
+        message_id = await message_writer.write(conversation_id, role, content)
+    except MessageWriteError as e:
+        logger.error("%s. Time elapsed: %.2f seconds", e, time.time() - start_time)
+        return False
+    context_builder.append(conversation_id, role, content, message_id)
+    logger.info("Stored %s message in conversation: %s. Storage time: %.2f seconds", role, conversation_id, time.time() - start_time)
+    return True
+
+class _Abandoned(Exception):
+    """No client has been attached to the stream for its abandon grace period."""
+
+async def _unless_abandoned(stream: GenerationStream, awaitable: Awaitable[T]) -> T:
+    """Await ``awaitable``, polling for abandonment meanwhile; cancels it and raises ``_Abandoned``."""
+    if stream.abandoned:
+        raise _Abandoned()
+    if stream.abandon_grace is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.SSE_DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if stream.abandoned:
+                raise _Abandoned()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+
+async def run_generation(
+    stream: GenerationStream,
     model: ModelInterface,
     conversation_id: UUID,
-    content: str, 
-    request: Request, 
-    db: Session
-) -> AsyncGenerator[str, None]:
+    content: str,
+    weight: float = 1.0,
+    history: Optional[List[Dict[str, str]]] = None
+) -> None:
+    """Produce the SSE frames of one answer into ``stream``.
+
+    Runs as a background job, so the answer is persisted whether or not
+    anybody is still reading. The job first waits for a fair-share slot,
+    publishing its queue position while it waits. Streams started with an
+    abandon grace period are cut short once no client has been attached for
+    that long, even while queued or waiting on the provider; abandonment
+    and cancellation store the partial answer as well.
+    """
     response_chunks = []
     start_time = time.time()
     token_count = 0
-    
+    prompt_tokens = estimate_tokens(content) + sum(estimate_tokens(message["content"]) for message in history or ())
+    grant: Optional[Grant] = None
+    batches = None
+
     try:
-        async for token in model.generate(content):
-            if await request.is_disconnected():
-                logger.info(f"Client disconnected, storing partial response. Tokens generated: {token_count}. Time elapsed: {time.time() - start_time:.2f} seconds")
-                if response_chunks:
-                    complete_response = "".join(response_chunks)
-                    await store_message(db, conversation_id, "llm", complete_response)
-                yield f"data: {json.dumps({'error': 'Client disconnected'})}\n\n"
-                return
-
-            response_chunks.append(token)
-            token_count += 1
-            yield f"data: {json.dumps({'data': token})}\n\n"
-            await asyncio.sleep(0)  # Allow other tasks to run
+        grant = await _unless_abandoned(stream, generation_scheduler.acquire(
+            str(stream.user_id),
+            prompt_tokens + settings.SCHEDULER_ESTIMATED_COMPLETION_TOKENS,
+            weight,
+            on_position=lambda position: stream.publish(queue_frame(position))
+        ))
+        batches = coalesce_tokens(
+            model.generate(content, history),
+            settings.SSE_COALESCE_WINDOW_MS / 1000,
+            settings.SSE_COALESCE_MAX_CHARS
+        )
+        response_chars = 0
+        while True:
+            try:
+                batch = await _unless_abandoned(stream, anext(batches))
+            except StopAsyncIteration:
+                break
+            text = "".join(batch)
+            response_chunks.append(text)
+            token_count += len(batch)
+            response_chars += len(text)
+            grant.used_tokens = prompt_tokens + response_chars // 4
+            stream.publish(data_frame(text))
+
+        # Free the slot before the write; storing does not need the provider
+        await batches.aclose()
+        await generation_scheduler.release(grant)
+        grant = None
 
         if response_chunks:
             complete_response = "".join(response_chunks)
-            if await store_message(db, conversation_id, "llm", complete_response):
-                yield "data: [DONE]\n\n"
+            if await store_message(conversation_id, "llm", complete_response):
+                stream.publish(DONE_FRAME)
             else:
-                yield f"data: {json.dumps({'error': 'Failed to store message'})}\n\n"
+                stream.finish(FAILED, "Failed to store message")
+                stream.publish(error_frame("Failed to store message"))
         else:
-            yield "data: [DONE]\n\n"
+            stream.publish(DONE_FRAME)
 
         total_time = time.time() - start_time
-        logger.info(f"Stream generation completed. Tokens generated: {token_count}. Total time: {total_time:.2f} seconds. Average time per token: {total_time/token_count:.4f} seconds")
+        average = f"{total_time / token_count:.4f} seconds" if token_count else "n/a"
+        logger.info("Stream generation completed. Tokens generated: %s. Total time: %.2f seconds. Average time per token: %s", token_count, total_time, average)
 
+    except _Abandoned:
+        logger.info("Client did not reconnect, storing partial response. Tokens generated: %s. Time elapsed: %.2f seconds", token_count, time.time() - start_time)
+        # Stop the provider stream and give the slot back before the write
+        if batches is not None:
+            await batches.aclose()
+        if grant is not None:
+            await generation_scheduler.release(grant)
+            grant = None
+        if response_chunks:
+            complete_response = "".join(response_chunks)
+            await store_message(conversation_id, "llm", complete_response)
+        stream.finish(ABANDONED)
+        stream.publish(DISCONNECTED_FRAME)
+    except asyncio.CancelledError:
+        logger.info("Generation %s cancelled. Tokens generated: %s", stream.id, token_count)
+        if response_chunks:
+            complete_response = "".join(response_chunks)
+            await store_message(conversation_id, "llm", complete_response)
+        stream.finish(CANCELLED)
+        stream.publish(error_frame("Generation cancelled"))
+        raise
     except Exception as e:
-        logger.error(f"Error in stream_generator: {str(e)}. Time elapsed: {time.time() - start_time:.2f} seconds")
+        logger.error("Error in generation %s: %s. Time elapsed: %.2f seconds", stream.id, e, time.time() - start_time)
         if response_chunks:
             complete_response = "".join(response_chunks)
-            await store_message(db, conversation_id, "llm", complete_response)
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            await store_message(conversation_id, "llm", complete_response)
+        stream.finish(FAILED, str(e))
+        stream.publish(error_frame(str(e)))
+    finally:
+        # Closing the batches cancels their pump and with it the upstream stream
+        if batches is not None:
+            await batches.aclose()
+        if grant is not None:
+            await generation_scheduler.release(grant)
+
+async def start_chat_generation(
+    db: AsyncSession,
+    user: AuthenticatedUser,
+    data: ChatRequest,
+    route: str,
+    abandon_grace: Optional[float] = None
+) -> GenerationStream:
+    """Store the user's message and start the answer as a background job."""
+    start_time = time.perf_counter()
+    if not generation_registry.has_capacity():
+        raise HTTPException(status_code=503, detail="Too many active generations")
+    try:
+        generation_scheduler.check_queue(str(user.id))
+    except RateLimitedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after or 1))})
+
+    if not data.conversation_id:
+        new_conversation = await create_conversation_record(db, user.id, data.message[:50])
+        data.conversation_id = new_conversation.id
+        history = []
+        if settings.CONTEXT_ENABLED:
+            context_builder.start(data.conversation_id)
+        logger.info("Created new conversation: %s", data.conversation_id)
+    else:
+        conversation = await get_owned_conversation(db, data.conversation_id, user.id)
+        if not conversation:
+            logger.error("Conversation not found: %s", data.conversation_id)
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        # Read before this turn's message is stored, so it is not sent twice
+        history = []
+        if settings.CONTEXT_ENABLED:
+            history = await context_builder.history(db, data.conversation_id, context_budget(data.model_type, data.model_name))
+
+    if not await store_message(data.conversation_id, "user", data.message):
+        raise HTTPException(status_code=500, detail="Failed to store message")
+    logger.info("Stored user message in conversation: %s", data.conversation_id)
+
+    # Prompt variants are chosen per tenant, i.e. per email domain
+    tenant = user.email.rpartition("@")[2].lower() or None
+    model = create_model_for_conversation(data.conversation_id, data.model_type, data.model_name, data.temperature, tenant)
+    conversation_id = data.conversation_id
+    weight = settings.SCHEDULER_USER_WEIGHTS.get(user.email, 1.0)
+    try:
+        stream = generation_registry.start(
+            user.id,
+            conversation_id,
+            lambda stream: run_generation(stream, model, conversation_id, data.message, weight, history),
+            abandon_grace=abandon_grace
+        )
+    except GenerationCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    metrics.chat_setup_duration.labels(route, data.model_name).observe(time.perf_counter() - start_time)
+    return stream
+
+def event_stream_response(stream: GenerationStream, frames: AsyncGenerator[str, None]) -> StreamingResponse:
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Content-Type": "text/event-stream",
+            "X-Accel-Buffering": "no",
+            "Access-Control-Allow-Origin": "*",
+            "X-Generation-ID": stream.id,
+            "X-Conversation-ID": str(stream.conversation_id),
+        }
+    )
+
+async def stream_generation_frames(
+    stream: GenerationStream,
+    after_seq: int,
+    request: Request
+) -> AsyncGenerator[str, None]:
+    """Follow ``stream`` from ``after_seq``, tagging each frame with an SSE id.
+
+    Leaving (client disconnect) only detaches this subscriber; the
+    generation keeps running so the client can resume with Last-Event-ID.
+    """
+    streams_gauge = metrics.active_streams.labels("sse")
+    streams_gauge.inc()
+    try:
+        with stream.attach():
+            async with DisconnectWatcher(request, settings.SSE_DISCONNECT_POLL_INTERVAL) as watcher:
+                try:
+                    async for seq, frame in stream.replay(after_seq):
+                        if watcher.disconnected:
+                            logger.info("Client detached from generation %s at frame %s", stream.id, seq - 1)
+                            return
+                        yield f"id: {stream.id}:{seq}\n{frame}"
+                except ReplayUnavailableError as e:
+                    logger.warning("Cannot resume generation %s: %s", stream.id, e)
+                    yield error_frame("Replay window exceeded")
+    finally:
+        # Also covers attach or the disconnect watcher failing on entry
+        streams_gauge.dec()
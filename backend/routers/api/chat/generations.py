@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import SQLAlchemyError
+from database.database import get_async_db
+from core.generation import GenerationStream, generation_registry, parse_event_id
+
+from .chat_models import ChatRequest, GenerationResponse
+from .chat_utils import event_stream_response, start_chat_generation, stream_generation_frames
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def get_owned_generation(request: Request, generation_id: str) -> GenerationStream:
+    stream = generation_registry.get(generation_id)
+    if not stream or stream.user_id != request.state.user.id:
+        raise HTTPException(status_code=404, detail="Generation not found")
+    return stream
+
+@router.post('/generations', response_model=GenerationResponse, status_code=202)
+async def create_generation(
+    data: ChatRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    user = request.state.user
+    try:
+        stream = await start_chat_generation(db, user, data, "/api/generations")
+    except SQLAlchemyError as e:
+        logger.error("Database error while starting generation: %s", e)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Database error occurred")
+    logger.info("Started generation %s in conversation %s for user: %s", stream.id, stream.conversation_id, user.email)
+    return stream.to_dict()
+
+@router.get('/generations/{generation_id}', response_model=GenerationResponse)
+async def get_generation(generation_id: str, request: Request):
+    return get_owned_generation(request, generation_id).to_dict()
+
+@router.post('/generations/{generation_id}/cancel', response_model=GenerationResponse)
+async def cancel_generation(generation_id: str, request: Request):
+    stream = get_owned_generation(request, generation_id)
+    if generation_registry.cancel(generation_id):
+        logger.info("Cancelling generation %s", generation_id)
+        # Let the job store its partial answer before reporting the status
+        await asyncio.wait({stream.task})
+    return stream.to_dict()
+
+@router.get('/generations/{generation_id}/events')
+@router.get('/streaming/{generation_id}')
+async def subscribe_generation(
+    generation_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    after: int = Query(0, ge=0, description="Last frame sequence received; used when no Last-Event-ID header is sent")
+) -> StreamingResponse:
+    after_seq = after
+    if last_event_id:
+        try:
+            event_generation_id, after_seq = parse_event_id(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+        if event_generation_id != generation_id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID belongs to another generation")
+
+    stream = get_owned_generation(request, generation_id)
+    if after_seq > len(stream.frames):
+        raise HTTPException(status_code=400, detail="Last-Event-ID is ahead of the stream")
+    if after_seq < stream.frames.first_index:
+        raise HTTPException(status_code=410, detail="Missed frames are no longer buffered")
+
+    logger.info("Subscribing to generation %s after frame %s for user: %s", generation_id, after_seq, request.state.user.email)
+    return event_stream_response(stream, stream_generation_frames(stream, after_seq, request))
@@ -0,0 +1,108 @@
+import asyncio
+import json
+from json.encoder import encode_basestring_ascii
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+from fastapi import Request
+
+# Frames are assembled from constant pieces; only the token text itself goes
+# through the (C-accelerated) JSON string encoder. The output is identical to
+# json.dumps({"data": text}).
+_DATA_FRAME_PREFIX = 'data: {"data": '
+_DATA_FRAME_SUFFIX = '}\n\n'
+
+DONE_FRAME = "data: [DONE]\n\n"
+DISCONNECTED_FRAME = f"data: {json.dumps({'error': 'Client disconnected'})}\n\n"
+
+def data_frame(text: str) -> str:
+    return _DATA_FRAME_PREFIX + encode_basestring_ascii(text) + _DATA_FRAME_SUFFIX
+
+def error_frame(message: str) -> str:
+    return f"data: {json.dumps({'error': message})}\n\n"
+
+def queue_frame(position: int) -> str:
+    return f"data: {json.dumps({'queue_position': position})}\n\n"
+
+class _End:
+    def __init__(self, error: Optional[BaseException] = None):
+        self.error = error
+
+async def coalesce_tokens(
+    tokens: AsyncIterator[str],
+    window: float,
+    max_chars: int
+) -> AsyncGenerator[List[str], None]:
+    """Group tokens into batches so each SSE frame carries several of them.
+
+    A background task drains ``tokens`` into a queue. A batch is flushed once
+    it holds ``max_chars`` characters or ``window`` seconds after its first
+    token, whichever comes first, so coalescing never delays a token by
+    more than ``window``.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump() -> None:
+        try:
+            async for token in tokens:
+                queue.put_nowait(token)
+        except Exception as e:
+            queue.put_nowait(_End(e))
+        else:
+            queue.put_nowait(_End())
+
+    pump_task = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    end: Optional[_End] = None
+    try:
+        while end is None:
+            item = await queue.get()
+            if isinstance(item, _End):
+                end = item
+                break
+
+            batch = [item]
+            size = len(item)
+            deadline = loop.time() + window
+            while size < max_chars:
+                # Wait on the queue itself so a full batch flushes without waiting out the window
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if isinstance(item, _End):
+                    end = item
+                    break
+                batch.append(item)
+                size += len(item)
+            yield batch
+
+        if end.error is not None:
+            raise end.error
+    finally:
+        pump_task.cancel()
+
+class DisconnectWatcher:
+    """Polls for a client disconnect in the background instead of per token."""
+
+    def __init__(self, request: Request, interval: float):
+        self.request = request
+        self.interval = interval
+        self.disconnected = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "DisconnectWatcher":
+        self._task = asyncio.create_task(self._watch())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._task.cancel()
+
+    async def _watch(self) -> None:
+        while not await self.request.is_disconnected():
+            await asyncio.sleep(self.interval)
+        self.disconnected = True
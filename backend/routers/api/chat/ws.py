@@ -0,0 +1,257 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Optional
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from config.settings import settings
+from core import metrics
+from core.broadcast import ReplayUnavailableError
+from core.generation import GenerationStream, generation_registry
+from database.database import AsyncSessionLocal
+from middleware.auth import AuthenticatedUser, authenticate_token
+
+from .chat_models import ChatRequest
+from .chat_utils import start_chat_generation
+from .sse import DONE_FRAME
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Close codes in the 4000-4999 range are reserved for applications
+WS_UNAUTHORIZED = 4401
+
+async def _receive_text(websocket: WebSocket) -> Optional[str]:
+    """Next text message, or None for a binary one (``receive_text`` fails on those with a KeyError)."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    return message.get("text")
+
+def _frame_message(stream_id: str, seq: int, frame: str) -> str:
+    """Wrap a buffered SSE frame as a WebSocket message without re-encoding it."""
+    if frame == DONE_FRAME:
+        return '{"type": "done", "stream_id": ' + json.dumps(stream_id) + ', "seq": ' + str(seq) + '}'
+    # Strip "data: " and the blank line; what remains is the JSON payload
+    return '{"type": "frame", "stream_id": ' + json.dumps(stream_id) + ', "seq": ' + str(seq) + ', "payload": ' + frame[6:-2] + '}'
+
+def _count(message: dict, key: str, default: Optional[int]) -> Optional[int]:
+    """Non-negative integer field of a client message, ``default`` if absent; raises ValueError otherwise."""
+    value = message.get(key)
+    if value is None:
+        return default
+    # bool is an int subclass, but true is not a count
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{key} must be a non-negative integer")
+    return value
+
+class _Subscription:
+    def __init__(self, stream: GenerationStream, credit: Optional[int]):
+        self.stream = stream
+        self.credit = credit
+        self.credit_available = asyncio.Event()
+        self.credit_available.set()
+        self.task: Optional[asyncio.Task] = None
+
+    def grant(self, credit: int) -> None:
+        if self.credit is not None:
+            self.credit += credit
+            self.credit_available.set()
+
+class ChatConnection:
+    """One authenticated socket carrying any number of generation streams.
+
+    Each stream is addressed by a client-chosen ``stream_id``. Outgoing
+    messages go through a bounded queue drained by a single sender task;
+    a stream opened with ``credit`` only sends that many frames until the
+    client acknowledges more, so a slow tab cannot flood the socket.
+    """
+
+    def __init__(self, websocket: WebSocket, user: AuthenticatedUser, token: str):
+        self.websocket = websocket
+        self.user = user
+        self.token = token
+        self.subscriptions: Dict[str, _Subscription] = {}
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+
+    async def send(self, message: dict) -> None:
+        await self.outbox.put(json.dumps(message))
+
+    async def _sender(self) -> None:
+        while True:
+            await self.websocket.send_text(await self.outbox.get())
+
+    async def serve(self) -> None:
+        sender = asyncio.create_task(self._sender())
+        try:
+            await self.send({"type": "ready", "user": self.user.to_dict()})
+            while True:
+                raw = await _receive_text(self.websocket)
+                if raw is None:
+                    await self.send({"type": "error", "error": "Invalid message: binary frames are not supported"})
+                    continue
+                try:
+                    message = json.loads(raw)
+                    if not isinstance(message, dict):
+                        raise ValueError("Message must be a JSON object")
+                except ValueError as e:
+                    await self.send({"type": "error", "error": f"Invalid message: {str(e)}"})
+                    continue
+                try:
+                    await self.handle(message)
+                except (TypeError, ValueError) as e:
+                    await self.send({"type": "error", "stream_id": message.get("stream_id"), "error": f"Invalid message: {str(e)}"})
+        except WebSocketDisconnect:
+            logger.info("WebSocket closed for user: %s", self.user.email)
+        finally:
+            for subscription in list(self.subscriptions.values()):
+                subscription.task.cancel()
+            sender.cancel()
+
+    async def handle(self, message: dict) -> None:
+        kind = message.get("type")
+        stream_id = message.get("stream_id")
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "auth":
+            await self.reauthenticate(message.get("token"))
+        elif kind == "ask":
+            await self.ask(stream_id, message)
+        elif kind == "subscribe":
+            await self.subscribe(stream_id, message)
+        elif kind == "ack":
+            subscription = self.subscriptions.get(stream_id)
+            if subscription:
+                subscription.grant(_count(message, "credit", 0))
+        elif kind == "cancel":
+            subscription = self.subscriptions.get(stream_id)
+            if subscription:
+                generation_registry.cancel(subscription.stream.id)
+        else:
+            await self.send({"type": "error", "stream_id": stream_id, "error": f"Unknown message type: {kind}"})
+
+    async def reauthenticate(self, token: Optional[str]) -> None:
+        # Lets clients swap in a refreshed access token without reconnecting
+        user, error = await authenticate_token(token) if token else (None, "Missing token")
+        if user is None or user.id != self.user.id:
+            await self.send({"type": "error", "error": f"Authentication failed: {error or 'user mismatch'}"})
+            return
+        self.user, self.token = user, token
+        await self.send({"type": "ready", "user": user.to_dict()})
+
+    async def _check_stream_id(self, stream_id) -> bool:
+        if not isinstance(stream_id, str) or not stream_id:
+            await self.send({"type": "error", "error": "stream_id is required"})
+            return False
+        if stream_id in self.subscriptions:
+            await self.send({"type": "error", "stream_id": stream_id, "error": "stream_id is already in use"})
+            return False
+        if len(self.subscriptions) >= settings.WS_MAX_STREAMS_PER_CONNECTION:
+            await self.send({"type": "error", "stream_id": stream_id, "error": "Too many open streams"})
+            return False
+        # The access token may have expired or been revoked since the handshake;
+        # for our own tokens this is a local signature and set lookup
+        user, error = await authenticate_token(self.token)
+        if user is None:
+            await self.send({"type": "error", "error": f"Authentication expired: {error}"})
+            await self.websocket.close(code=WS_UNAUTHORIZED)
+            raise WebSocketDisconnect(WS_UNAUTHORIZED)
+        return True
+
+    async def ask(self, stream_id, message: dict) -> None:
+        # Validated up front: once started, the generation has already stored the message
+        credit = _count(message, "credit", None)
+        if not await self._check_stream_id(stream_id):
+            return
+        try:
+            data = ChatRequest(**message)
+        except ValidationError as e:
+            await self.send({"type": "error", "stream_id": stream_id, "error": str(e)})
+            return
+
+        try:
+            async with AsyncSessionLocal() as db:
+                stream = await start_chat_generation(db, self.user, data, "/api/ws", abandon_grace=settings.SSE_RESUME_GRACE_SECONDS)
+        except HTTPException as e:
+            await self.send({"type": "error", "stream_id": stream_id, "status": e.status_code, "error": e.detail})
+            return
+        except SQLAlchemyError as e:
+            logger.error("Database error while starting generation over WebSocket: %s", e)
+            await self.send({"type": "error", "stream_id": stream_id, "status": 500, "error": "Database error occurred"})
+            return
+
+        self._open(stream_id, stream, 0, credit)
+
+    async def subscribe(self, stream_id, message: dict) -> None:
+        after_seq = _count(message, "after", 0)
+        credit = _count(message, "credit", None)
+        if not await self._check_stream_id(stream_id):
+            return
+        stream = generation_registry.get(str(message.get("generation_id")))
+        if not stream or stream.user_id != self.user.id:
+            await self.send({"type": "error", "stream_id": stream_id, "status": 404, "error": "Generation not found"})
+            return
+        self._open(stream_id, stream, after_seq, credit)
+
+    def _open(self, stream_id: str, stream: GenerationStream, after_seq: int, credit: Optional[int]) -> None:
+        subscription = _Subscription(stream, credit)
+        subscription.task = asyncio.create_task(self._forward(stream_id, subscription, after_seq))
+        self.subscriptions[stream_id] = subscription
+
+    async def _forward(self, stream_id: str, subscription: _Subscription, after_seq: int) -> None:
+        stream = subscription.stream
+        streams_gauge = metrics.active_streams.labels("ws")
+        streams_gauge.inc()
+        try:
+            await self.send({
+                "type": "started",
+                "stream_id": stream_id,
+                "generation_id": stream.id,
+                "conversation_id": str(stream.conversation_id),
+            })
+            with stream.attach():
+                async for seq, frame in stream.replay(after_seq):
+                    while subscription.credit is not None and subscription.credit <= 0:
+                        subscription.credit_available.clear()
+                        await subscription.credit_available.wait()
+                    if subscription.credit is not None:
+                        subscription.credit -= 1
+                    await self.outbox.put(_frame_message(stream_id, seq, frame))
+        except ReplayUnavailableError:
+            await self.send({"type": "error", "stream_id": stream_id, "status": 410, "error": "Missed frames are no longer buffered"})
+        finally:
+            streams_gauge.dec()
+            self.subscriptions.pop(stream_id, None)
+
+async def _authenticate(websocket: WebSocket):
+    token = websocket.query_params.get("token")
+    if not token:
+        # Browsers cannot set headers on WebSocket handshakes, so the token
+        # may also arrive as the first message
+        try:
+            raw = await asyncio.wait_for(_receive_text(websocket), timeout=settings.WS_AUTH_TIMEOUT)
+            # A binary first message is no auth message either
+            message = json.loads(raw) if raw is not None else None
+            token = message.get("token") if isinstance(message, dict) and message.get("type") == "auth" else None
+        except (asyncio.TimeoutError, ValueError):
+            token = None
+    if not token:
+        return None, None, "Missing token"
+    user, error = await authenticate_token(token)
+    return user, token, error
+
+@router.websocket('/ws')
+async def chat_websocket(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        user, token, error = await _authenticate(websocket)
+    except WebSocketDisconnect:
+        return
+    if user is None:
+        logger.warning("WebSocket authentication failed: %s", error)
+        await websocket.close(code=WS_UNAUTHORIZED, reason="Invalid authentication credentials")
+        return
+
+    logger.info("WebSocket connected for user: %s", user.email)
+    await ChatConnection(websocket, user, token).serve()
@@ -1,14 +1,38 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from database.database import get_db
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.database import get_async_db, get_pool_stats
+from core.model_interface import admission_controller, generation_coalescer
+from core.semantic_cache import get_semantic_cache_stats
+from database.message_writer import message_writer
+from core.context import context_builder
+from core.generation import generation_registry
+from core.helper.prompt import prompt_registry
+from core.routing import backend_tracker
+from core.scheduler import generation_scheduler
+from core.summarizer import conversation_summarizer
 
 router = APIRouter()
 
 @router.get("/health")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     try:
         # Check database connection
-        db.execute("SELECT 1")
-        return {"status": "healthy", "database": "connected"}
+        await db.execute(text("SELECT 1"))
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "pool": get_pool_stats(),
+            "generations": admission_controller.stats(),
+            "coalesced_generations": generation_coalescer.stats(),
+            "message_writer": message_writer.stats(),
+            "generation_jobs": generation_registry.stats(),
+            "semantic_cache": get_semantic_cache_stats(),
+            "routing": backend_tracker.stats(),
+            "scheduler": generation_scheduler.stats(),
+            "prompts": prompt_registry.stats(),
+            "context": context_builder.stats(),
+            "summaries": conversation_summarizer.stats(),
+        }
     except Exception as e:
-        return {"status": "unhealthy", "error": str(e)}
+        return {"status": "unhealthy", "error": str(e), "pool": get_pool_stats()}
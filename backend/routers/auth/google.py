@@ -1,22 +1,76 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from google.oauth2 import id_token
 from google.auth.transport import requests
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
+from uuid import UUID
+import uuid
 import httpx
 import logging
 import json
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
 
 from config.settings import settings
-from database.database import get_db
+from core.security import (
+    ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE, TokenError, create_access_token, create_refresh_token,
+    decode_token, new_refresh_session, revocation_list
+)
+from database.database import get_async_db
 from models.models import User, Session as DbSession
-from middleware.auth import verify_token
+from middleware.auth import authenticate_token, invalidate_token
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+REFRESH_COOKIE_PATH = "/auth"
+
+def issue_tokens(user: User, session: DbSession, response: Response) -> dict:
+    """Access token for the response body; the refresh token is set as an HttpOnly cookie."""
+    set_refresh_cookie(response, user, session)
+    return access_token_data(user, session)
+
+def access_token_data(user: User, session: DbSession) -> dict:
+    access_token, expires_at = create_access_token(user.id, user.email, user.picture, session.id)
+    return {
+        "access_token": access_token,
+        "token_type": "Bearer",
+        "expires_at": expires_at.isoformat(),
+        "email": user.email,
+        "picture": user.picture
+    }
+
+def set_refresh_cookie(response: Response, user: User, session: DbSession) -> None:
+    # Never in a body or URL, so it stays out of history, logs, Referer headers and page scripts
+    refresh_token = create_refresh_token(user.id, session.id, session.refresh_jti, session.expires_at)
+    response.set_cookie(
+        settings.REFRESH_COOKIE_NAME,
+        refresh_token,
+        expires=session.expires_at,
+        path=REFRESH_COOKIE_PATH,
+        secure=settings.REFRESH_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.REFRESH_COOKIE_SAMESITE,
+    )
+
+def clear_refresh_cookie(response: Response) -> None:
+    response.delete_cookie(
+        settings.REFRESH_COOKIE_NAME,
+        path=REFRESH_COOKIE_PATH,
+        secure=settings.REFRESH_COOKIE_SECURE,
+        httponly=True,
+        samesite=settings.REFRESH_COOKIE_SAMESITE,
+    )
+
+def check_origin(request: Request) -> None:
+    # Cookie-authenticated endpoints only answer our own frontend
+    origin = request.headers.get("Origin")
+    frontend = urlsplit(settings.FRONTEND_URL)
+    if origin is not None and origin != f"{frontend.scheme}://{frontend.netloc}":
+        raise HTTPException(status_code=403, detail="Origin not allowed")
+
 @router.get("/login")
 async def login_google():
     return {
@@ -24,7 +78,7 @@ async def login_google():
     }
 
 @router.get("/callback")
-async def auth_google(code: str, db: Session = Depends(get_db)):
+async def auth_google(code: str, db: AsyncSession = Depends(get_async_db)):
     logger.info("Google callback received")
     token_url = "https://oauth2.googleapis.com/token"
     data = {
@@ -45,9 +99,12 @@ async def auth_google(code: str, db: Session = Depends(get_db)):
     access_token = token_data["access_token"]
     
     try:
-        idinfo = id_token.verify_oauth2_token(token_data["id_token"], requests.Request(), settings.GOOGLE_CLIENT_ID)
+        # Certificate fetching in google-auth is blocking
+        idinfo = await run_in_threadpool(
+            id_token.verify_oauth2_token, token_data["id_token"], requests.Request(), settings.GOOGLE_CLIENT_ID
+        )
         
-        user = db.query(User).filter(User.email == idinfo["email"]).first()
+        user = await db.scalar(select(User).where(User.email == idinfo["email"]))
         if not user:
             logger.info(f"Creating new user: {idinfo['email']}")
             user = User(
@@ -56,44 +113,111 @@ async def auth_google(code: str, db: Session = Depends(get_db)):
                 picture=idinfo["picture"]
             )
             db.add(user)
-            db.commit()
-            db.refresh(user)
+            await db.commit()
         else:
             # Update user's picture if it has changed
             if user.picture != idinfo.get("picture"):
                 user.picture = idinfo.get("picture")
-                db.commit()
-                db.refresh(user)
+                await db.commit()
             logger.info(f"Existing user logged in: {idinfo['email']}")
 
-        expires_at = datetime.now(timezone.utc) + timedelta(seconds=token_data["expires_in"])
+        session_id, refresh_jti, expires_at = new_refresh_session()
         session = DbSession(
+            id=session_id,
             user_id=user.id,
             access_token=access_token,
+            refresh_jti=refresh_jti,
             expires_at=expires_at
         )
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        await db.commit()
         logger.info(f"Created new session for user: {user.email}")
         
-        # Prepare data for frontend
-        frontend_data = {
-            "access_token": access_token,
-            "token_type": token_data["token_type"],
-            "expires_at": expires_at.isoformat(),
-            "email": user.email,
-            "picture": user.picture
-        }
+        # Prepare data for frontend; the refresh token only goes in a cookie
+        frontend_data = access_token_data(user, session)
         encoded_data = quote(json.dumps(frontend_data))
         
         redirect_url = f"{settings.FRONTEND_URL}/auth/callback?data={encoded_data}"
-        logger.info(f"Redirecting to: {redirect_url}")
-        return RedirectResponse(url=redirect_url)
+        logger.info(f"Redirecting to: {settings.FRONTEND_URL}/auth/callback")
+        redirect = RedirectResponse(url=redirect_url)
+        set_refresh_cookie(redirect, user, session)
+        return redirect
     except ValueError as e:
         logger.error(f"Invalid Google token: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid Google token")
 
+@router.post("/refresh")
+async def refresh_tokens(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    check_origin(request)
+    refresh_token = request.cookies.get(settings.REFRESH_COOKIE_NAME)
+    if not refresh_token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        claims = decode_token(refresh_token, REFRESH_TOKEN_TYPE)
+    except TokenError as e:
+        logger.warning(f"Refresh token rejected: {str(e)}")
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    session = await db.scalar(
+        select(DbSession).where(DbSession.id == UUID(claims["sid"])).with_for_update()
+    )
+    now = datetime.now(timezone.utc)
+    if session is None or session.revoked_at is not None or session.expires_at < now:
+        raise HTTPException(status_code=401, detail="Session is no longer valid")
+
+    if session.refresh_jti != claims.get("jti"):
+        # A rotated-out refresh token was replayed: treat the session as stolen
+        logger.warning(f"Refresh token reuse detected for session: {session.id}")
+        session.revoked_at = now
+        await db.commit()
+        revocation_list.revoke(session.id, session.expires_at)
+        raise HTTPException(status_code=401, detail="Session is no longer valid")
+
+    user = await db.get(User, session.user_id)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    session.refresh_jti = uuid.uuid4().hex
+    await db.commit()
+    logger.info(f"Rotated refresh token for session: {session.id}")
+    return issue_tokens(user, session, response)
+
+@router.post("/logout")
+async def logout(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    check_origin(request)
+    clear_refresh_cookie(response)
+    auth_header = request.headers.get("Authorization")
+    token = auth_header.split(" ")[1] if auth_header and auth_header.startswith("Bearer ") else None
+    refresh_token = request.cookies.get(settings.REFRESH_COOKIE_NAME)
+
+    session = None
+    user = None
+    if token:
+        user, error = await authenticate_token(token)
+    if user is not None:
+        try:
+            session_id = UUID(decode_token(token, ACCESS_TOKEN_TYPE)["sid"])
+            session = await db.get(DbSession, session_id)
+        except TokenError:
+            # Legacy Google access token
+            session = await db.scalar(select(DbSession).where(DbSession.access_token == token))
+            await invalidate_token(token)
+    elif refresh_token:
+        # The access token has expired; the refresh cookie still identifies the session
+        try:
+            session = await db.get(DbSession, UUID(decode_token(refresh_token, REFRESH_TOKEN_TYPE)["sid"]))
+        except TokenError:
+            session = None
+    else:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    if session is not None and session.revoked_at is None:
+        session.revoked_at = datetime.now(timezone.utc)
+        await db.commit()
+        revocation_list.revoke(session.id, session.expires_at)
+        logger.info(f"Revoked session: {session.id}")
+    return {"status": "logged_out"}
+
 @router.get("/user")
 async def read_users_me(request: Request):
     try:
@@ -103,7 +227,7 @@ async def read_users_me(request: Request):
             raise HTTPException(status_code=401, detail="Not authenticated")
 
         token = auth_header.split(" ")[1]
-        user, error = await verify_token(token)
+        user, error = await authenticate_token(token)
 
         if user is None:
             logger.warning(f"Authentication failed: {error}")
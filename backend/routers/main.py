@@ -1,16 +1,42 @@
+import asyncio
 import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from .api import routers as api_routers
 from .auth import routers as auth_router
 from .api.health import router as health_router
-from middleware.auth import auth_middleware
+from .api.metrics import router as metrics_router
+from middleware.auth import auth_middleware, close_auth_clients
+from core.model_interface import client_registry, warm_up_models
+from core.security import revocation_list
+from database.message_writer import message_writer
+from core.summarizer import conversation_summarizer
+from core.generation import generation_registry
+from core import metrics
+from core.logging_config import log_sampled_var, log_sampler, request_id_var, route_var
 from fastapi.responses import JSONResponse
 
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up_models()
+    revocation_task = asyncio.create_task(revocation_list.run())
+    message_writer.start()
+    conversation_summarizer.start()
+    yield
+    revocation_task.cancel()
+    await conversation_summarizer.stop()
+    await generation_registry.shutdown()
+    await message_writer.stop()
+    await client_registry.aclose()
+    await close_auth_clients()
+
 def create_app():
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     # Add CORS middleware
     app.add_middleware(
@@ -22,11 +48,14 @@ def create_app():
     )
 
     # Define public routes that don't require authentication
-    public_routes = ["/auth/login", "/auth/callback", "/health", "/ping"]
+    public_routes = ["/auth/login", "/auth/callback", "/health", "/ping", "/metrics"]
 
     # Include health check router
     app.include_router(health_router, prefix="/health", tags=["health"])
 
+    # Prometheus scrape endpoint
+    app.include_router(metrics_router, tags=["metrics"])
+
     # Include API routers with /api prefix
     for router in api_routers:
         app.include_router(router, prefix="/api", tags=["api"])
@@ -40,22 +69,48 @@ def create_app():
         try:
             return await call_next(request)
         except Exception as e:
-            logger.error(f"Unhandled exception: {str(e)}")
+            logger.error("Unhandled exception: %s", e)
             return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
 
     @app.middleware("http")
     async def conditional_auth_middleware(request: Request, call_next):
-        logger.info(f"Processing request for path: {request.url.path}")
+        logger.debug("Processing request for path: %s", request.url.path)
         
         # Allow OPTIONS requests without authentication
         if request.method == "OPTIONS":
-            logger.info(f"Allowing OPTIONS request for path: {request.url.path}")
+            logger.debug("Allowing OPTIONS request for path: %s", request.url.path)
             return await call_next(request)
         
         if request.url.path.startswith("/api") and request.url.path not in public_routes:
-            logger.info(f"Applying auth middleware for path: {request.url.path}")
+            logger.debug("Applying auth middleware for path: %s", request.url.path)
             return await auth_middleware(request, call_next)
-        logger.info(f"Skipping auth middleware for path: {request.url.path}")
+        logger.debug("Skipping auth middleware for path: %s", request.url.path)
         return await call_next(request)
 
+    @app.middleware("http")
+    async def request_metrics_middleware(request: Request, call_next):
+        start_time = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = request.scope.get("route")
+            metrics.http_request_duration.labels(
+                request.method, getattr(route, "path", "unmatched"), status
+            ).observe(time.perf_counter() - start_time)
+
+    # Added last so it runs first and every other middleware logs with the request id
+    @app.middleware("http")
+    async def request_context_middleware(request: Request, call_next):
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        request_id_var.set(request_id)
+        route_var.set(request.url.path)
+        log_sampled_var.set(log_sampler.sample(request.url.path))
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+
     return app
@@ -97,8 +97,10 @@ export function useSSE() {
                 const lines = buffer.split('\n\n')
                 buffer = lines.pop() ?? ''
 
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
+                for (const frame of lines) {
+                    // Frames carry an `id:` line (for resuming) before the data line
+                    const line = frame.split('\n').find((field) => field.startsWith('data: '))
+                    if (line) {
                         const isComplete = handleStreamData(line.slice(6), onProgress)
                         if (isComplete) return
                     }
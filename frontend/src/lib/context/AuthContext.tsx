@@ -24,6 +24,30 @@ export const useAuth = () => {
 
 const queryClient = new QueryClient()
 
+// One refresh at a time; concurrent 401s share its result
+let refreshPromise: Promise<string | null> | null = null
+
+const refreshAccessToken = (): Promise<string | null> => {
+    if (!refreshPromise) {
+        // The refresh token is an HttpOnly cookie the backend reads and rotates
+        refreshPromise = fetch(`${process.env.NEXT_PUBLIC_BACKEND_URL}/auth/refresh`, {
+            method: 'POST',
+            credentials: 'include',
+        })
+            .then(async (response) => {
+                if (!response.ok) return null
+                const data = await response.json()
+                localStorage.setItem('accessToken', data.access_token)
+                return data.access_token as string
+            })
+            .catch(() => null)
+            .finally(() => {
+                refreshPromise = null
+            })
+    }
+    return refreshPromise
+}
+
 export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children }) => {
     return (
         <QueryClientProvider client={queryClient}>
@@ -39,21 +63,32 @@ const AuthContextContent: React.FC<{ children: React.ReactNode }> = ({ children
     const { toast } = useToast()
 
     const authenticatedFetch = async (url: string, options: RequestInit = {}) => {
-        const token = localStorage.getItem('accessToken')
-        const headers = new Headers(options.headers)
+        const send = (token: string | null) => {
+            const headers = new Headers(options.headers)
 
-        if (token) {
-            headers.set('Authorization', `Bearer ${token}`)
-        }
+            if (token) {
+                headers.set('Authorization', `Bearer ${token}`)
+            }
+
+            if (options.method && options.method !== 'GET') {
+                headers.set('X-HTTP-Method', options.method)
+            }
 
-        if (options.method && options.method !== 'GET') {
-            headers.set('X-HTTP-Method', options.method)
+            return fetch(url, {
+                ...options,
+                headers,
+            })
         }
 
-        const response = await fetch(url, {
-            ...options,
-            headers,
-        })
+        let response = await send(localStorage.getItem('accessToken'))
+
+        if (response.status === 401) {
+            // The access token has probably expired; retry once with a refreshed one
+            const token = await refreshAccessToken()
+            if (token) {
+                response = await send(token)
+            }
+        }
 
         if (response.status === 401) {
             localStorage.removeItem('accessToken')
@@ -118,6 +153,17 @@ const AuthContextContent: React.FC<{ children: React.ReactNode }> = ({ children
 
     const logoutMutation = useMutation({
         mutationFn: async () => {
+            const token = localStorage.getItem('accessToken')
+            try {
+                // Revokes the session and clears the refresh cookie
+                await fetch(`${process.env.NEXT_PUBLIC_BACKEND_URL}/auth/logout`, {
+                    method: 'POST',
+                    credentials: 'include',
+                    headers: token ? { Authorization: `Bearer ${token}` } : {},
+                })
+            } catch (error) {
+                // Still log out locally when the backend is unreachable
+            }
             localStorage.removeItem('accessToken')
             localStorage.removeItem('user')
             await queryClient.invalidateQueries({ queryKey: ['user'] })